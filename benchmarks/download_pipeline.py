@@ -0,0 +1,521 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""\
+Benchmark the download pipeline: HDFS readers, formats and `range_iter`.
+
+Synthetic part-file directories are generated for every layout, and then
+served in every format able to open them, through a local directory backend
+and through a local WebHDFS stand-in. Each case runs in a fresh interpreter,
+reporting throughput, time to first byte, seek latency and peak memory.
+
+It runs offline on a single box, without the database nor the metastore, but
+the package must be installed (e.g. `pip install -e .`) to register the formats.
+
+    python benchmarks/download_pipeline.py --parts 1,16 --part-size 4,64
+"""
+import argparse
+import BaseHTTPServer
+import bz2
+import contextlib
+import io
+import json
+import os
+import random
+import resource
+import shutil
+import SocketServer
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+import urlparse
+
+HERE = os.path.abspath(os.path.dirname(__file__))
+
+def _import_pipeline():
+    """\
+    Register the `cosmohub.api` package without creating the application, which
+    needs the database and the metastore, so the pipeline can be imported alone.
+    """
+    root = os.path.join(os.path.dirname(HERE), 'cosmohub')
+    for name, path in [('cosmohub', root), ('cosmohub.api', os.path.join(root, 'api'))]:
+        if name not in sys.modules:
+            module = types.ModuleType(name)
+            module.__path__ = [path]
+            sys.modules[name] = module
+
+_import_pipeline()
+
+import numpy as np
+
+from thriftpy2.transport import TMemoryBuffer
+from thriftpy2.protocol import TCompactProtocol
+
+from cosmohub.api.hadoop.hdfs import HDFSPathReader, HDFSParquetReader
+from cosmohub.api.io import recarray
+from cosmohub.api.io.format import FormatRegistry
+from cosmohub.api.io.stream import range_iter
+from cosmohub.api.io.thrift import parquet_thrift
+
+DESCRIPTION = [
+    ('id',   'BIGINT_TYPE'),
+    ('ra',   'DOUBLE_TYPE'),
+    ('dec',  'DOUBLE_TYPE'),
+    ('mag',  'FLOAT_TYPE'),
+    ('flag', 'INT_TYPE'),
+]
+
+COMMENTS = 'Synthetic results generated by the download pipeline benchmark.'
+
+MiB = 1024*1024
+
+#
+# Synthetic data
+#
+
+def _records(rows, start, rng):
+    """\
+    Return `rows` random records following DESCRIPTION.
+    """
+    records = np.empty(rows, dtype=recarray.dtype(DESCRIPTION))
+    records['id'] = np.arange(start, start + rows)
+    records['ra'] = rng.uniform(0, 360, rows)
+    records['dec'] = rng.uniform(-90, 90, rows)
+    records['mag'] = rng.uniform(15, 30, rows)
+    records['flag'] = rng.randint(0, 16, rows)
+    return records
+
+# Parquet physical types of the record array types, with their little-endian dtype
+_parquet_types = {
+    'BIGINT_TYPE' : ('INT64', '<i8'),
+    'DOUBLE_TYPE' : ('DOUBLE', '<f8'),
+    'FLOAT_TYPE'  : ('FLOAT', '<f4'),
+    'INT_TYPE'    : ('INT32', '<i4'),
+}
+
+def _serialize(obj):
+    tmem = TMemoryBuffer()
+    obj.write(TCompactProtocol(tmem))
+    return tmem.getvalue()
+
+def _write_parquet(path, records, row_group_rows):
+    """\
+    Write `records` as a minimal Parquet file, as Hive names the columns:
+    required fields, PLAIN encoding, no compression and one page per chunk.
+    """
+    pt = parquet_thrift()
+
+    schema = [pt.SchemaElement(name='hive_schema', num_children=len(DESCRIPTION))]
+    for i, (_, type_) in enumerate(DESCRIPTION):
+        schema.append(pt.SchemaElement(
+            name='_col{0}'.format(i),
+            type=getattr(pt.Type, _parquet_types[type_][0]),
+            repetition_type=pt.FieldRepetitionType.REQUIRED,
+        ))
+
+    with open(path, 'wb') as fd:
+        fd.write(b'PAR1')
+        row_groups = []
+        for start in range(0, len(records), row_group_rows):
+            rows = records[start:start+row_group_rows]
+            columns = []
+            for i, (name, type_) in enumerate(DESCRIPTION):
+                values = rows[name].astype(_parquet_types[type_][1]).tostring()
+                header = _serialize(pt.PageHeader(
+                    type=pt.PageType.DATA_PAGE,
+                    uncompressed_page_size=len(values),
+                    compressed_page_size=len(values),
+                    data_page_header=pt.DataPageHeader(
+                        num_values=len(rows),
+                        encoding=pt.Encoding.PLAIN,
+                        definition_level_encoding=pt.Encoding.RLE,
+                        repetition_level_encoding=pt.Encoding.RLE,
+                    ),
+                ))
+                offset = fd.tell()
+                fd.write(header)
+                fd.write(values)
+                columns.append(pt.ColumnChunk(
+                    file_offset=offset,
+                    meta_data=pt.ColumnMetaData(
+                        type=schema[i+1].type,
+                        encodings=[pt.Encoding.PLAIN, pt.Encoding.RLE],
+                        path_in_schema=['_col{0}'.format(i)],
+                        codec=pt.CompressionCodec.UNCOMPRESSED,
+                        num_values=len(rows),
+                        total_uncompressed_size=len(header) + len(values),
+                        total_compressed_size=len(header) + len(values),
+                        data_page_offset=offset,
+                    ),
+                ))
+            size = sum(c.meta_data.total_compressed_size for c in columns)
+            row_groups.append(pt.RowGroup(
+                columns=columns,
+                total_byte_size=size,
+                num_rows=len(rows),
+                file_offset=columns[0].file_offset,
+                total_compressed_size=size,
+                ordinal=len(row_groups),
+            ))
+
+        footer = _serialize(pt.FileMetaData(
+            version=1,
+            schema=schema,
+            num_rows=len(records),
+            row_groups=row_groups,
+            created_by='cosmohub download pipeline benchmark',
+        ))
+        fd.write(footer)
+        fd.write(struct.pack('<i', len(footer)) + b'PAR1')
+
+def generate(path, layout, parts, part_size, seed):
+    """\
+    Generate a directory of `parts` files of about `part_size` bytes of records
+    each, stored in `layout` the way Hive writes them.
+    """
+    if os.path.isdir(path):
+        return
+
+    rng = np.random.RandomState(seed)
+    rows = max(1, part_size // recarray.dtype(DESCRIPTION).itemsize)
+
+    tmp = path + '.tmp'
+    os.makedirs(tmp)
+    for i in range(parts):
+        records = _records(rows, i * rows, rng)
+        part = os.path.join(tmp, '{0:06d}_0'.format(i))
+
+        if layout == 'recarray':
+            with open(part, 'wb') as fd:
+                fd.write(records.tostring())
+        elif layout == 'text':
+            with open(part + '.bz2', 'wb') as fd:
+                fd.write(bz2.compress(recarray.to_csv(records, DESCRIPTION)))
+        elif layout == 'parquet':
+            _write_parquet(part, records, 128*1024)
+        else:
+            raise ValueError("Unknown layout '{0}'".format(layout))
+    os.rename(tmp, path)
+
+#
+# Backends
+#
+
+class LocalClient(object):
+    """\
+    Serve a local directory through the subset of the HDFS client API used by
+    the readers.
+    """
+
+    def __init__(self, root):
+        self._root = root
+
+    def _local(self, path):
+        return os.path.join(self._root, path.lstrip('/'))
+
+    def status(self, path):
+        local = self._local(path)
+        if os.path.isdir(local):
+            return {'type' : 'DIRECTORY', 'length' : 0}
+        return {'type' : 'FILE', 'length' : os.path.getsize(local)}
+
+    def list(self, path, status=False):
+        names = sorted(os.listdir(self._local(path)))
+        if not status:
+            return names
+        return [
+            (name, dict(self.status(os.path.join(path, name)), pathSuffix=name))
+            for name in names
+        ]
+
+    @contextlib.contextmanager
+    def read(self, path, offset=0, length=None, buffer_size=None):
+        with open(self._local(path), 'rb') as fd:
+            fd.seek(offset)
+            yield io.BytesIO(fd.read(-1 if length is None else length))
+
+    def get_home_directory(self):
+        return '/'
+
+class WebHDFSHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """\
+    Answer the WebHDFS operations used by the readers from a local directory.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def _status(self, local, name):
+        stat = os.stat(local)
+        return {
+            'accessTime' : int(stat.st_atime * 1000),
+            'blockSize' : 128*MiB,
+            'group' : 'cosmohub',
+            'length' : 0 if os.path.isdir(local) else stat.st_size,
+            'modificationTime' : int(stat.st_mtime * 1000),
+            'owner' : 'cosmohub',
+            'pathSuffix' : name,
+            'permission' : '755',
+            'replication' : 1,
+            'type' : 'DIRECTORY' if os.path.isdir(local) else 'FILE',
+        }
+
+    def _send(self, code, body, content_type='application/json'):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        params = dict(urlparse.parse_qsl(url.query))
+        path = url.path[len('/webhdfs/v1'):] or '/'
+        local = os.path.join(self.server.root, path.lstrip('/'))
+        op = params.get('op', '').upper()
+
+        if op == 'GETHOMEDIRECTORY':
+            return self._send(200, json.dumps({'Path' : '/'}))
+
+        if not os.path.exists(local):
+            return self._send(404, json.dumps({'RemoteException' : {
+                'exception' : 'FileNotFoundException',
+                'javaClassName' : 'java.io.FileNotFoundException',
+                'message' : 'File does not exist: ' + path,
+            }}))
+
+        if op == 'GETFILESTATUS':
+            return self._send(200, json.dumps({'FileStatus' : self._status(local, '')}))
+
+        if op == 'LISTSTATUS':
+            return self._send(200, json.dumps({'FileStatuses' : {'FileStatus' : [
+                self._status(os.path.join(local, name), name)
+                for name in sorted(os.listdir(local))
+            ]}}))
+
+        if op == 'OPEN':
+            offset = int(params.get('offset', 0))
+            with open(local, 'rb') as fd:
+                fd.seek(offset)
+                length = params.get('length')
+                data = fd.read(-1 if length is None else int(length))
+            return self._send(200, data, 'application/octet-stream')
+
+        self._send(400, json.dumps({'RemoteException' : {
+            'exception' : 'IllegalArgumentException',
+            'javaClassName' : 'java.lang.IllegalArgumentException',
+            'message' : 'Unsupported operation: ' + op,
+        }}))
+
+class WebHDFSServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, root):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), WebHDFSHandler)
+        self.root = root
+
+    @property
+    def url(self):
+        return 'http://{0}:{1}'.format(*self.server_address)
+
+def _client(backend, root):
+    if backend == 'local':
+        return LocalClient(root)
+
+    from hdfs import InsecureClient
+    return InsecureClient(root, user='cosmohub')
+
+#
+# Measurements
+#
+
+def run_case(case):
+    """\
+    Serve a dataset in a format and measure it, in the current process.
+    """
+    client = _client(case['backend'], case['root'])
+    format_ = FormatRegistry('cosmohub_format')[case['format']]
+    layout = case['layout']
+
+    start = time.time()
+    if layout == 'parquet':
+        reader = HDFSParquetReader(client, case['path'])
+    else:
+        reader = HDFSPathReader(client, case['path'])
+    stream = format_.open(reader, layout, DESCRIPTION, COMMENTS)
+
+    length = stream.seek(0, io.SEEK_END) if stream.seekable() else None
+    data = range_iter(stream, 0, length, case['chunk_size'], case['buffer_size'])
+
+    total = len(next(data))
+    ttfb = time.time() - start
+    for chunk in data:
+        total += len(chunk)
+    elapsed = time.time() - start
+
+    seeks = []
+    if stream.seekable() and total:
+        rng = random.Random(case['seed'])
+        for _ in range(case['seeks']):
+            pos = rng.randrange(total)
+            before = time.time()
+            stream.seek(pos)
+            stream.read(case['chunk_size'])
+            seeks.append(time.time() - before)
+    seeks.sort()
+
+    return {
+        'bytes' : total,
+        'elapsed' : elapsed,
+        'throughput' : total / elapsed / MiB if elapsed else None,
+        'ttfb' : ttfb,
+        'seek_p50' : seeks[len(seeks) // 2] if seeks else None,
+        'seek_max' : seeks[-1] if seeks else None,
+        # Kilobytes on Linux
+        'peak_rss' : resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+    }
+
+def _measure(case):
+    """\
+    Run a case in a fresh interpreter, so peak memory is not shared.
+    """
+    output = subprocess.check_output([
+        sys.executable, os.path.abspath(__file__), '--case', json.dumps(case)
+    ])
+    return json.loads(output.splitlines()[-1])
+
+def _cases(options, workdir, servers):
+    formats = FormatRegistry('cosmohub_format')
+    names = options['formats'] or list(formats)
+
+    for name in names:
+        format_ = formats[name]
+        layouts = [format_.layout] + sorted(format_.transcoders)
+        for layout in layouts:
+            for parts in options['parts']:
+                for part_size in options['part_size']:
+                    dataset = '{0}-{1}x{2}M'.format(layout, parts, part_size)
+                    generate(
+                        os.path.join(workdir, dataset), layout,
+                        parts, part_size*MiB, options['seed']
+                    )
+                    for backend in options['backends']:
+                        yield {
+                            'backend' : backend,
+                            'root' : servers[backend],
+                            'path' : '/' + dataset,
+                            'format' : name,
+                            'layout' : layout,
+                            'parts' : parts,
+                            'part_size' : part_size,
+                            'chunk_size' : options['chunk_size'],
+                            'buffer_size' : options['buffer_size'],
+                            'seeks' : options['seeks'],
+                            'seed' : options['seed'],
+                        }
+
+def _format_row(case, result):
+    def ms(value):
+        return '{0:9.2f}'.format(value * 1000) if value is not None else '{0:>9}'.format('-')
+
+    return '{backend:<8} {format:<8} {layout:<9} {parts:>5} {part_size:>6}M {size:>9.1f}M {throughput:>9.1f} {ttfb} {seek} {rss:>8.1f}M'.format(
+        size=result['bytes'] / float(MiB),
+        throughput=result['throughput'] or 0,
+        ttfb=ms(result['ttfb']),
+        seek=ms(result['seek_p50']),
+        rss=result['peak_rss'],
+        **case
+    )
+
+def _parse_list(type_):
+    def parse(value):
+        return [type_(v) for v in value.split(',') if v]
+    return parse
+
+def _parse_args(args):
+    parser = argparse.ArgumentParser(
+        description='Benchmark the download pipeline on synthetic results.')
+    parser.add_argument('--formats', '-f', type=_parse_list(str), default=None,
+        help="comma-separated formats to benchmark (default: all)")
+    parser.add_argument('--backends', '-b', type=_parse_list(str), default=['local', 'webhdfs'],
+        help="comma-separated backends among 'local' and 'webhdfs'")
+    parser.add_argument('--parts', '-p', type=_parse_list(int), default=[1, 8],
+        help="comma-separated number of part files per dataset")
+    parser.add_argument('--part-size', '-s', type=_parse_list(int), default=[4, 32],
+        help="comma-separated size of each part file, in MiB of records")
+    parser.add_argument('--chunk-size', type=int, default=16*1024,
+        help="bytes read at once, as HADOOP_HDFS_CHUNK_SIZE")
+    parser.add_argument('--buffer-size', type=int, default=4,
+        help="chunks read ahead, as HADOOP_HDFS_BUFFER_SIZE")
+    parser.add_argument('--seeks', type=int, default=20,
+        help="random seeks measured on seekable streams")
+    parser.add_argument('--seed', type=int, default=0,
+        help="seed for the synthetic data and the seek positions")
+    parser.add_argument('--workdir', '-w', default=None,
+        help="directory to generate the datasets in (default: temporary)")
+    parser.add_argument('--json', '-j', default=None,
+        help="also write the results to this JSON file")
+    parser.add_argument('--case', default=None,
+        help=argparse.SUPPRESS)
+
+    return vars(parser.parse_args(args))
+
+def main(args=None):
+    if not args:
+        args = sys.argv[1:]
+
+    options = _parse_args(args)
+
+    if options['case']:
+        sys.stdout.write('\n' + json.dumps(run_case(json.loads(options['case']))) + '\n')
+        return 0
+
+    workdir = options['workdir'] or tempfile.mkdtemp(prefix='cosmohub-benchmark-')
+    if not os.path.isdir(workdir):
+        os.makedirs(workdir)
+
+    servers = {'local' : workdir}
+    server = None
+    if 'webhdfs' in options['backends']:
+        server = WebHDFSServer(workdir)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        servers['webhdfs'] = server.url
+
+    sys.stdout.write('{0:<8} {1:<8} {2:<9} {3:>5} {4:>7} {5:>10} {6:>9} {7:>9} {8:>9} {9:>9}\n'.format(
+        'backend', 'format', 'layout', 'parts', 'size', 'output', 'MiB/s', 'TTFB ms', 'seek ms', 'peak RSS'
+    ))
+
+    results = []
+    try:
+        for case in _cases(options, workdir, servers):
+            try:
+                result = _measure(case)
+            except subprocess.CalledProcessError as e:
+                results.append(dict(case, error=e.returncode))
+                sys.stdout.write('{backend:<8} {format:<8} {layout:<9} {parts:>5} {part_size:>6}M  failed\n'.format(**case))
+                continue
+            results.append(dict(case, **result))
+            sys.stdout.write(_format_row(case, result) + '\n')
+            sys.stdout.flush()
+    finally:
+        if server:
+            server.shutdown()
+        if not options['workdir']:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if options['json']:
+        with open(options['json'], 'w') as fd:
+            json.dump(results, fd, indent=2)
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
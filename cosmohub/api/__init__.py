@@ -21,7 +21,6 @@ from flask_sqlalchemy import SQLAlchemy, Model as FlaskModel
 from flask_uwsgi_websocket import WebSocket
 from flask_cors import CORS
 from itsdangerous import TimedJSONWebSignatureSerializer
-from pkg_resources import iter_entry_points # @UnresolvedImport
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext import declarative
 from sqlalchemy.orm.exc import NoResultFound
@@ -31,6 +30,7 @@ from . import release
 from .database import naming
 from .database import schema as db_schema
 from .hadoop import hive
+from .io.format import FormatRegistry
 
 log = logging.getLogger(__name__)
 
@@ -68,11 +68,14 @@ app.columns = hive.reflect_catalogs(
     database=app.config['HIVE_DATABASE'],
 )
 
-# Load available formats
-app.formats = {
-    entry.name : entry.load()
-    for entry in iter_entry_points(group='cosmohub_format')
-}
+# Load number of rows and size of each catalog, to estimate the cost of queries
+app.statistics = hive.reflect_statistics(
+    metastore_uri=app.config['HIVE_METASTORE_URI'],
+    database=app.config['HIVE_DATABASE'],
+)
+
+# Register available formats, which are loaded on first use
+app.formats = FormatRegistry('cosmohub_format')
 
 # Set up token signer
 app.jwt = TimedJSONWebSignatureSerializer(app.config['SECRET_KEY'])
@@ -171,3 +174,6 @@ app.register_blueprint(mod_rest)
 
 # Import sockets module to register its routes
 from . import sockets # @UnusedImport
+
+# Import tasks module to schedule background tasks
+from . import tasks # @UnusedImport
@@ -115,6 +115,12 @@ class User(db.Model):
         nullable=True,
         comment='Last login timestamp'
     )
+    quotas = Column(
+        'quotas',
+        JSON,
+        nullable=True,
+        comment='Limits overriding the default ones for this User'
+    )
     
     # Relationships
     groups_granted = relationship(
@@ -686,6 +692,15 @@ class Query(db.Model):
             'status',
             'ts_submitted'
         ),
+        Index(
+            'ix__query__cache_key__status',
+            'cache_key',
+            'status'
+        ),
+        Index(
+            'ix__query__results_id',
+            'results_id'
+        ),
         # Foreign keys
         ForeignKeyConstraint(
             ['user_id'],
@@ -740,6 +755,12 @@ class Query(db.Model):
         nullable=False,
         comment='Record serialization format'
     )
+    layout = Column(
+        'layout',
+        String(8),
+        nullable=True,
+        comment='Layout of the stored results (defaults to the one of format)'
+    )
     status = Column(
         'status',
         _StatusType,
@@ -753,6 +774,18 @@ class Query(db.Model):
         nullable=True,
         comment='Job unique identifier (external)'
     )
+    cache_key = Column(
+        'cache_key',
+        String(64),
+        nullable=True,
+        comment='Digest of the normalized SQL, storage format and catalog versions'
+    )
+    results_id = Column(
+        'results_id',
+        Integer,
+        nullable=True,
+        comment='Query whose stored results are shared (defaults to this one)'
+    )
     schema = deferred(
         Column(
             'schema',
@@ -768,6 +801,42 @@ class Query(db.Model):
         nullable=True,
         comment='Size in bytes'
     )
+    stored_size = Column(
+        'stored_size',
+        BigInteger,
+        nullable=True,
+        comment='Size in bytes of the stored results'
+    )
+    rows = Column(
+        'rows',
+        BigInteger,
+        nullable=True,
+        comment='Total number of rows'
+    )
+    scan_size = Column(
+        'scan_size',
+        BigInteger,
+        nullable=True,
+        comment='Estimated number of bytes scanned'
+    )
+    statistics = deferred(
+        Column(
+            'statistics',
+            JSON,
+            nullable=True,
+            comment='Minimum, maximum and null count of each column in schema',
+        ),
+        group = 'json',
+    )
+    digests = deferred(
+        Column(
+            'digests',
+            JSON,
+            nullable=True,
+            comment='Length and SHA-256 digest of the results, by format and file',
+        ),
+        group = 'json',
+    )
     ts_submitted = Column(
         'ts_submitted',
         DateTime,
@@ -787,6 +856,18 @@ class Query(db.Model):
         nullable=True,
         comment='When this Query execution finished'
     )
+    ts_downloaded = Column(
+        'ts_downloaded',
+        DateTime,
+        nullable=True,
+        comment='When the results of this Query were last downloaded (hourly)'
+    )
+    ts_purged = Column(
+        'ts_purged',
+        DateTime,
+        nullable=True,
+        comment='When the stored results of this Query were removed'
+    )
 
     # Relationships
     user = relationship('User',
@@ -796,6 +877,18 @@ class Query(db.Model):
             passive_deletes=True
         )
     )
+    submission = relationship(
+        'QuerySubmission',
+        uselist=False,
+        cascade='all, delete-orphan',
+        passive_deletes=True
+    )
+    completion = relationship(
+        'QueryCompletion',
+        uselist=False,
+        cascade='all, delete-orphan',
+        passive_deletes=True
+    )
 
     @hybrid_property
     def id(self):
@@ -815,6 +908,164 @@ class Query(db.Model):
             repr(self.sql),
         )
 
+class QuerySubmission(db.Model):
+    """\
+    Outbox of queries pending to be submitted to Oozie
+    """
+    __tablename__ = 'query_submission'
+    __table_args__ = (
+        # Primary key
+        PrimaryKeyConstraint('query_id'),
+        # Indexes
+        Index(
+            'ix__query_submission__ts_due',
+            'ts_due'
+        ),
+        # Foreign keys
+        ForeignKeyConstraint(
+            ['query_id'],
+            ['query.id'],
+            onupdate='CASCADE',
+            ondelete='CASCADE'
+        ),
+    )
+
+    # Columns
+    _query_id = Column(
+        'query_id',
+        Integer,
+        nullable=False,
+        comment='Query unique identifier'
+    )
+    format = Column(
+        'format',
+        String(8),
+        nullable=False,
+        comment='Format the results are stored with'
+    )
+    priority = Column(
+        'priority',
+        String(16),
+        nullable=False,
+        comment='Priority class, which sets the order and YARN queue'
+    )
+    attempts = Column(
+        'attempts',
+        Integer,
+        nullable=False,
+        default=0,
+        comment='Number of failed submission attempts'
+    )
+    error = Column(
+        'error',
+        Text,
+        nullable=True,
+        comment='Error of the last failed submission attempt'
+    )
+    ts_due = Column(
+        'ts_due',
+        DateTime,
+        nullable=False,
+        server_default=func.now(),
+        comment='When the next submission attempt is due'
+    )
+
+    @hybrid_property
+    def query_id(self):
+        return self._query_id
+
+    def __repr__(self):
+        return u"%s(query_id=%s, attempts=%s, ts_due=%s)" % (
+            self.__class__.__name__,
+            repr(self._query_id),
+            repr(self.attempts),
+            repr(self.ts_due),
+        )
+
+class QueryCompletion(db.Model):
+    """\
+    Queries whose jobs have finished, pending to be inspected and notified
+    """
+    __tablename__ = 'query_completion'
+    __table_args__ = (
+        # Primary key
+        PrimaryKeyConstraint('query_id'),
+        # Indexes
+        Index(
+            'ix__query_completion__stage__ts_due',
+            'stage',
+            'ts_due'
+        ),
+        # Foreign keys
+        ForeignKeyConstraint(
+            ['query_id'],
+            ['query.id'],
+            onupdate='CASCADE',
+            ondelete='CASCADE'
+        ),
+    )
+    
+    class Stage(enum.Enum):
+        INSPECT = 'INSPECT'
+        NOTIFY  = 'NOTIFY'
+    
+    _StageType = Enum(*[s.value for s in Stage], name='ty__query_completion__stage')
+    
+    # Columns
+    _query_id = Column(
+        'query_id',
+        Integer,
+        nullable=False,
+        comment='Query unique identifier'
+    )
+    status = Column(
+        'status',
+        Query._StatusType,
+        nullable=False,
+        comment='Final status of the job'
+    )
+    stage = Column(
+        'stage',
+        _StageType,
+        nullable=False,
+        default='INSPECT',
+        comment='Stage pending to be run'
+    )
+    attempts = Column(
+        'attempts',
+        Integer,
+        nullable=False,
+        default=0,
+        comment='Number of failed attempts of the current stage'
+    )
+    error = Column(
+        'error',
+        Text,
+        nullable=True,
+        comment='Error of the last failed attempt'
+    )
+    ts_due = Column(
+        'ts_due',
+        DateTime,
+        nullable=False,
+        server_default=func.now(),
+        comment='When the next attempt is due'
+    )
+    
+    @hybrid_property
+    def query_id(self):
+        return self._query_id
+    
+    def __repr__(self):
+        return u"%s(query_id=%s, status=%s, stage=%s, attempts=%s, ts_due=%s)" % (
+            self.__class__.__name__,
+            repr(self._query_id),
+            repr(self.status),
+            repr(self.stage),
+            repr(self.attempts),
+            repr(self.ts_due),
+        )
+
 class VAD(db.Model):
     """\
     Many-to-many between Catalog and File
@@ -951,3 +1202,112 @@ class File(db.Model):
             repr(self.name),
             repr(self.version),
         )
+
+class MailMessage(db.Model):
+    """\
+    Outbox of mail messages pending to be sent
+    """
+    __tablename__ = 'mail_message'
+    __table_args__ = (
+        # Primary key
+        PrimaryKeyConstraint('id'),
+        # Indexes
+        Index(
+            'ix__mail_message__ts_due',
+            'ts_due'
+        ),
+        Index(
+            'ix__mail_message__batch_key',
+            'batch_key'
+        ),
+    )
+    
+    # Columns
+    _id = Column(
+        'id',
+        Integer,
+        nullable=False,
+        comment='Message unique identifier'
+    )
+    batch_key = Column(
+        'batch_key',
+        Text,
+        nullable=True,
+        comment='Messages with the same key are sent together as a single one'
+    )
+    sender = Column(
+        'sender',
+        Text,
+        nullable=True,
+        comment='Sender address (defaults to MAIL_DEFAULT_SENDER)'
+    )
+    reply_to = Column(
+        'reply_to',
+        Text,
+        nullable=True,
+        comment='Reply-To address'
+    )
+    recipients = Column(
+        'recipients',
+        JSON,
+        nullable=False,
+        comment='List of recipient addresses'
+    )
+    subject = Column(
+        'subject',
+        Text,
+        nullable=False,
+        comment='Subject'
+    )
+    body = Column(
+        'body',
+        Text,
+        nullable=False,
+        comment='Plain text body'
+    )
+    html = Column(
+        'html',
+        Text,
+        nullable=True,
+        comment='HTML body'
+    )
+    attempts = Column(
+        'attempts',
+        Integer,
+        nullable=False,
+        default=0,
+        comment='Number of failed sending attempts'
+    )
+    error = Column(
+        'error',
+        Text,
+        nullable=True,
+        comment='Error of the last failed sending attempt'
+    )
+    ts_created = Column(
+        'ts_created',
+        DateTime,
+        nullable=False,
+        server_default=func.now(),
+        comment='When this message was queued'
+    )
+    ts_due = Column(
+        'ts_due',
+        DateTime,
+        nullable=False,
+        server_default=func.now(),
+        comment='When the next sending attempt is due'
+    )
+    
+    @hybrid_property
+    def id(self):
+        return self._id
+    
+    def __repr__(self):
+        return u"%s(id=%s, recipients=%s, subject=%s, attempts=%s)" % (
+            self.__class__.__name__,
+            repr(self._id),
+            repr(self.recipients),
+            repr(self.subject),
+            repr(self.attempts),
+        )
@@ -2,8 +2,10 @@
 
 import contextlib
 import logging
+import zlib
 
 from functools import wraps
+from sqlalchemy import text
 from sqlalchemy.exc import DBAPIError
 
 log = logging.getLogger(__name__)
@@ -58,3 +60,14 @@ def transactional_session(session, read_only=False):
     
     finally:
         session.expunge_all()
+
+def try_advisory_lock(session, name):
+    """\
+    Try to take the PostgreSQL advisory lock identified by `name`, held until
+    the end of the current transaction. Return True if it was taken.
+    """
+    key = zlib.crc32(name.encode('utf-8')) & 0x7FFFFFFF
+    return session.execute(
+        text("SELECT pg_try_advisory_xact_lock(:key)"),
+        {'key' : key}
+    ).scalar()
@@ -59,6 +59,8 @@ Query = {
     'status'       : fields.String,
     'job_id'       : fields.String,
     'size'         : fields.Integer,
+    'rows'         : fields.Integer,
+    'scan_size'    : fields.Integer,
     'ts_submitted' : fields.DateTime('iso8601'),
     'ts_started'   : fields.DateTime('iso8601'),
     'ts_finished'  : fields.DateTime('iso8601'),
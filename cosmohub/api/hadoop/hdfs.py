@@ -2,15 +2,14 @@ import collections
 import copy
 import io
 import os
-import pkg_resources
 import struct
-import thriftpy2
 
 from thriftpy2.transport import TMemoryBuffer
 from thriftpy2.http import TFileObjectTransport
 from thriftpy2.protocol import TCompactProtocol
 
-parquet_thrift = thriftpy2.load(pkg_resources.resource_filename('cosmohub.resources', 'parquet.thrift'), module_name="parquet_thrift")
+from ..io import digest
+from ..io.thrift import parquet_thrift
 
 class HDFSPathReader(io.RawIOBase):
     """\
@@ -18,6 +17,9 @@ class HDFSPathReader(io.RawIOBase):
   
     If the path refers to a directory, the contents of the files (ordered by
     name) are concatenated in the resulting stream.
+    
+    Each file is read from its 'offset' up to its 'length', which are absolute
+    positions inside the file.
     """
 
     def __init__(self, client, path):
@@ -71,6 +73,54 @@ class HDFSPathReader(io.RawIOBase):
 
         self._current_files = copy.deepcopy(self._all_files)
     
+    def read_range(self, start, length):
+        """\
+        Return `length` bytes of the stream, starting at `start`.
+        
+        The current position is not used nor changed, so that several ranges
+        can be read concurrently.
+        """
+        chunks = []
+        for entry in self._all_files:
+            size = entry['length'] - entry['offset']
+            if start >= size:
+                start -= size
+                continue
+            
+            n = min(length, size - start)
+            file_path = os.path.join(self._path, entry['name'])
+            with self._client.read(file_path, offset=entry['offset']+start, length=n) as fd:
+                chunks.append(fd.read())
+            
+            start = 0
+            length -= n
+            if not length:
+                break
+        
+        return b''.join(chunks)
+    
+    def crc32c(self):
+        """\
+        Return the CRC32C of the whole stream, combining the checksums computed
+        by HDFS for each file, or None if they cannot be combined.
+        
+        HDFS only returns composable checksums when `dfs.checksum.combine.mode`
+        is set to COMPOSITE_CRC and files are written with CRC32C checksums.
+        Files not read from their beginning cannot be combined either.
+        """
+        crc = 0
+        for entry in self._all_files:
+            if entry['offset'] != 0:
+                return None
+            
+            checksum = self._client.checksum(os.path.join(self._path, entry['name']))
+            if checksum['algorithm'] != 'COMPOSITE-CRC32C':
+                return None
+            
+            crc = digest.crc32c_combine(crc, int(checksum['bytes'], 16), entry['length'])
+        
+        return crc
+    
     def readinto(self, b):
         """\
         Read up to len(b) bytes into b.
@@ -143,15 +193,16 @@ class HDFSPathReader(io.RawIOBase):
         self._position = 0
 
         for entry in self._all_files:
-            if entry['length'] <= skip:
-                self._position += entry['length']
-                skip -= entry['length']
+            size = entry['length'] - entry['offset']
+            if size <= skip:
+                self._position += size
+                skip -= size
                 continue
 
             new_entry = entry.copy()
           
             if skip:
-                new_entry['offset'] = skip
+                new_entry['offset'] += skip
                 self._position += skip
                 skip = 0
 
@@ -179,9 +230,207 @@ class HDFSParquetReader(HDFSPathReader):
   
     If the path refers to a directory, the contents of the files (ordered by
     name) are concatenated in the resulting stream. 
-    The offsets of each FileMetaData are adjusted and merged into one.
+    The offsets of each FileMetaData are adjusted and merged into one, while the
+    original ones are kept in `parts`.
+    
+    Offset indexes embed absolute page offsets, so those belonging to shifted
+    files are rewritten and must be appended after the stream, as provided by
+    the `page_indexes` property.
+    
+    If a list of columns is provided, only their column chunks are streamed and
+    the FileMetaData is rewritten to describe just those columns. Page indexes
+    and bloom filters are not available for projected columns.
     """
+    
+    # Offsets in a ColumnMetaData that point inside the file
+    _METADATA_OFFSETS = (
+        'data_page_offset',
+        'index_page_offset',
+        'dictionary_page_offset',
+        'bloom_filter_offset',
+    )
+    
+    def __init__(self, client, path, columns=None):
+        """\
+        :param client: HDFSClient to use to access the data
+        :type client: `pyhdfs.HdfsClient`
+        :param path: HDFS path to read
+        :type path: str
+        :param columns: Name of the top-level columns to read (default all)
+        :type columns: list
+        """
+        self._columns = columns
+        
+        super(HDFSParquetReader, self).__init__(client, path)
+    
+    @property
+    def filemetadata(self):
+        """\
+        Return the merged FileMetaData of the whole dataset.
+        """
+        return self._filemetadata
+    
+    @property
+    def page_indexes(self):
+        """\
+        Return the rewritten offset indexes to append after the stream.
+        """
+        return self._page_indexes
+    
+    @property
+    def parts(self):
+        """\
+        Return the name, data length and FileMetaData of every part file.
+        """
+        return self._parts
+
+    def read_part(self, name, offset, length):
+        """\
+        Return `length` bytes of the part file `name`, starting at `offset`.
+        """
+        with self._client.read(os.path.join(self._path, name), offset=offset, length=length) as fd:
+            return fd.read()
 
+    def _relocate(self, chunk, delta):
+        """\
+        Shift by `delta` bytes every offset of a ColumnChunk.
+        
+        Offset indexes are not handled here, as they must be rewritten.
+        """
+        if chunk.file_offset:
+            chunk.file_offset += delta
+        if chunk.column_index_offset:
+            chunk.column_index_offset += delta
+        
+        for attr in self._METADATA_OFFSETS:
+            if getattr(chunk.meta_data, attr):
+                setattr(chunk.meta_data, attr, getattr(chunk.meta_data, attr) + delta)
+    
+    def _rewrite_offset_indexes(self, file_path, row_groups, delta):
+        """\
+        Read the offset indexes of the given row groups and shift their pages.
+        
+        The rewritten indexes are appended to `_page_indexes` and the chunks
+        are updated to point to their position relative to its start.
+        """
+        chunks = []
+        for rg in row_groups:
+            for c in rg.columns:
+                if c.offset_index_offset and c.offset_index_length:
+                    chunks.append(c)
+                else:
+                    c.offset_index_offset = None
+                    c.offset_index_length = None
+        
+        if not chunks:
+            return []
+        
+        start = min(c.offset_index_offset for c in chunks)
+        stop = max(c.offset_index_offset + c.offset_index_length for c in chunks)
+        with self._client.read(file_path, offset=start, length=stop-start) as fd:
+            data = fd.read(stop-start)
+        
+        for c in chunks:
+            pos = c.offset_index_offset - start
+            tprot = TCompactProtocol(TMemoryBuffer(data[pos:pos+c.offset_index_length]))
+            index = parquet_thrift().OffsetIndex()
+            index.read(tprot)
+            
+            for page in index.page_locations:
+                page.offset += delta
+            
+            tmem = TMemoryBuffer()
+            index.write(TCompactProtocol(tmem))
+            buf = tmem.getvalue()
+            
+            c.offset_index_offset = len(self._page_indexes)
+            c.offset_index_length = len(buf)
+            self._page_indexes += buf
+        
+        return chunks
+
+    def _project_schema(self, fmd):
+        """\
+        Keep only the requested top-level columns in the schema of `fmd`.
+        """
+        def subtree_length(i):
+            n = 1
+            for _ in range(fmd.schema[i].num_children or 0):
+                n += subtree_length(i + n)
+            return n
+        
+        root = fmd.schema[0]
+        schema = [root]
+        column_orders = []
+        
+        i = 1
+        leaf = 0
+        kept = 0
+        for _ in range(root.num_children):
+            n = subtree_length(i)
+            leaves = len([el for el in fmd.schema[i:i+n] if not el.num_children])
+            
+            if fmd.schema[i].name in self._columns:
+                kept += 1
+                schema.extend(fmd.schema[i:i+n])
+                if fmd.column_orders:
+                    column_orders.extend(fmd.column_orders[leaf:leaf+leaves])
+            
+            i += n
+            leaf += leaves
+        
+        missing = set(self._columns) - set(el.name for el in schema[1:])
+        if missing:
+            raise ValueError('Unknown columns: {0}'.format(', '.join(sorted(missing))))
+        
+        # Columns requested more than once are only kept once
+        root.num_children = kept
+        fmd.schema = schema
+        if fmd.column_orders:
+            fmd.column_orders = column_orders
+    
+    def _project_row_group(self, name, rg):
+        """\
+        Keep only the chunks of the requested columns in the row group `rg`.
+        
+        Each chunk is scheduled to be read from the file `name`, and its offsets
+        are relocated to its position in the resulting stream.
+        """
+        columns = []
+        for c in rg.columns:
+            if c.meta_data.path_in_schema[0] not in self._columns:
+                continue
+            
+            start = c.meta_data.data_page_offset
+            if c.meta_data.dictionary_page_offset:
+                start = min(start, c.meta_data.dictionary_page_offset)
+            length = c.meta_data.total_compressed_size
+            
+            self._all_files.append({
+                'name': name,
+                'length': start + length,
+                'offset': start,
+            })
+            
+            c.offset_index_offset = None
+            c.offset_index_length = None
+            c.column_index_offset = None
+            c.column_index_length = None
+            c.meta_data.bloom_filter_offset = None
+            self._relocate(c, 4 + self._length - start)
+            
+            self._length += length
+            columns.append(c)
+        
+        rg.columns = columns
+        rg.file_offset = columns[0].meta_data.data_page_offset
+        if columns[0].meta_data.dictionary_page_offset:
+            rg.file_offset = min(rg.file_offset, columns[0].meta_data.dictionary_page_offset)
+        rg.total_byte_size = sum(c.meta_data.total_uncompressed_size for c in columns)
+        rg.total_compressed_size = sum(c.meta_data.total_compressed_size for c in columns)
+        
+        return rg
+    
     def _initialize(self):
         """\
         Open the requested path and compute some internal parameters.
@@ -194,45 +443,90 @@ class HDFSParquetReader(HDFSPathReader):
         self._all_files = collections.deque()
         
         self._filemetadata = None
+        self._page_indexes = b''
+        self._parts = []
+        rewritten = []
         offset = 0
 
         status = self._client.status(self._path)
         if status['type']=='FILE' and status['length']>0:
-            raise NotImplementedError()
-
+            status['pathSuffix'] = os.path.basename(self._path)
+            self._path = os.path.dirname(self._path)
+            entries = [(status['pathSuffix'], status)]
         else:
-            for _, entry in self._client.list(self._path, status=True):
-                if entry['type'] != 'FILE' or entry['length']==0:
-                    continue
+            entries = self._client.list(self._path, status=True)
+        
+        for _, entry in entries:
+            if entry['type'] != 'FILE' or entry['length']==0:
+                continue
+            
+            file_path = os.path.join(self._path, entry['pathSuffix'])
+            
+            with self._client.read(file_path, offset=entry['length']-8, length=4) as fd:
+                fmd_len = struct.unpack('<i', fd.read(4))[0]
+            
+            with self._client.read(file_path, offset=entry['length']-fmd_len-8, length=fmd_len) as fd:
+                tbuf = TFileObjectTransport(fd)
+                tprot = TCompactProtocol(tbuf)
+                tfmd = parquet_thrift().FileMetaData()
+                tfmd.read(tprot)
+            
+            self._parts.append({
+                'name': entry['pathSuffix'],
+                'length': entry['length'] - fmd_len - 12,
+                'filemetadata': tfmd,
+            })
+            
+            if self._columns is not None:
+                if self._filemetadata is None:
+                    self._filemetadata = copy.deepcopy(tfmd)
+                    self._filemetadata.row_groups = []
+                    self._filemetadata.num_rows = 0
+                    if not self._filemetadata.key_value_metadata:
+                        self._filemetadata.key_value_metadata = []
+                    self._project_schema(self._filemetadata)
                 
-                with self._client.read(os.path.join(self._path, entry['pathSuffix']), offset=entry['length']-8, length=4) as fd:
-                    fmd_len = struct.unpack('<i', fd.read(4))[0]
+                for rg in copy.deepcopy(tfmd.row_groups):
+                    self._filemetadata.row_groups.append(
+                        self._project_row_group(entry['pathSuffix'], rg)
+                    )
+                self._filemetadata.num_rows += tfmd.num_rows
+                continue
+            
+            if self._filemetadata is None:
+                self._filemetadata = copy.deepcopy(tfmd)
+                if not self._filemetadata.key_value_metadata:
+                    self._filemetadata.key_value_metadata = []
+            else:
+                row_groups = copy.deepcopy(tfmd.row_groups)
+                rewritten.extend(
+                    self._rewrite_offset_indexes(file_path, row_groups, offset)
+                )
                 
-                with self._client.read(os.path.join(self._path, entry['pathSuffix']), offset=entry['length']-fmd_len-8, length=fmd_len) as fd:
-                    tbuf = TFileObjectTransport(fd)
-                    tprot = TCompactProtocol(tbuf)
-                    tfmd = parquet_thrift.FileMetaData()
-                    tfmd.read(tprot)
-                    
-                    if self._filemetadata is None:
-                        self._filemetadata = copy.deepcopy(tfmd)
-                        offset += entry['length'] - fmd_len - 12
-                    else:
-                        for rg in tfmd.row_groups:
-                            rg = copy.deepcopy(rg)
-                            for c in rg.columns:
-                                if c.file_offset:
-                                    c.file_offset += offset
-                                if c.meta_data.data_page_offset:
-                                    c.meta_data.data_page_offset += offset
-                            self._filemetadata.row_groups.append(rg)
-                        offset += entry['length'] - fmd_len - 12
+                for rg in row_groups:
+                    if rg.file_offset:
+                        rg.file_offset += offset
+                    for c in rg.columns:
+                        self._relocate(c, offset)
                 
-                self._all_files.append({
-                    'name': entry['pathSuffix'],
-                    'length': entry['length'] - fmd_len - 8,
-                    'offset': 4,
-                })
-                self._length += entry['length'] - fmd_len - 12
+                self._filemetadata.row_groups.extend(row_groups)
+                self._filemetadata.num_rows += tfmd.num_rows
             
+            offset += entry['length'] - fmd_len - 12
+            
+            self._all_files.append({
+                'name': entry['pathSuffix'],
+                'length': entry['length'] - fmd_len - 8,
+                'offset': 4,
+            })
+            self._length += entry['length'] - fmd_len - 12
+        
+        # Rewritten offset indexes follow the 'PAR1' magic and the stream
+        for c in rewritten:
+            c.offset_index_offset += 4 + self._length
+        
+        if self._filemetadata:
+            for i, rg in enumerate(self._filemetadata.row_groups):
+                rg.ordinal = i if i < 2**15 else None
+        
         self._current_files = copy.deepcopy(self._all_files)
@@ -1,5 +1,6 @@
-import pandas as pd
+import collections
 import pyparsing as pp
+import re
 import textwrap
 
 from sqlalchemy import create_engine
@@ -61,6 +62,212 @@ def parse_progress(report):
     
     return (completed, running, failed, total-completed)
 
+_SQL_TOKEN = re.compile(r"""
+    (?P<comment> --[^\n]* | /\*.*?\*/ )
+    | (?P<string> '(?:[^'\\]|\\.)*' | "(?:[^"\\]|\\.)*" )
+    | (?P<quoted> `(?:[^`]|``)*` )
+    | (?P<space> \s+ )
+    | (?P<word> \w+ )
+    | (?P<symbol> . )
+""", re.VERBOSE | re.DOTALL)
+
+def _sql_tokens(sql):
+    """\
+    Yield the kind and value of every token in a HiveQL statement, except for
+    comments and whitespace.
+    """
+    for match in _SQL_TOKEN.finditer(sql):
+        if match.lastgroup not in ('comment', 'space'):
+            yield match.lastgroup, match.group()
+
+def normalize_sql(sql):
+    """\
+    Return a HiveQL statement in a canonical form, so that equivalent ones
+    written differently compare equal.
+    
+    Comments and the trailing semicolon are removed, tokens are separated by a
+    single space and identifiers and keywords are lower-cased, while string
+    literals are kept as they are.
+    """
+    tokens = [
+        value if kind == 'string' else value.lower()
+        for kind, value in _sql_tokens(sql)
+    ]
+    while tokens and tokens[-1] == ';':
+        tokens.pop()
+    
+    return ' '.join(tokens)
+
+def sql_identifiers(sql):
+    """\
+    Return the lower-cased words and quoted identifiers in a HiveQL statement,
+    among which the relations it reads from.
+    """
+    identifiers = set()
+    for kind, value in _sql_tokens(sql):
+        if kind == 'word':
+            identifiers.add(value.lower())
+        elif kind == 'quoted':
+            identifiers.add(value[1:-1].replace('``', '`').lower())
+    
+    return identifiers
+
+# Functions, clauses and virtual columns whose values change between runs
+_NONDETERMINISTIC = frozenset([
+    'block__offset__inside__file', 'current_date', 'current_timestamp',
+    'current_user', 'in_file', 'input__file__name', 'java_method',
+    'logged_in_user', 'rand', 'reflect', 'reflect2', 'row__offset__inside__block',
+    'surrogate_key', 'tablesample', 'unix_timestamp', 'uuid',
+])
+
+def is_deterministic(sql):
+    """\
+    Return whether a HiveQL statement returns the same results every time it is
+    run on the same data, that is, if it uses no function, clause or virtual
+    column known to vary between runs.
+    """
+    return not any(
+        kind == 'word' and value.lower() in _NONDETERMINISTIC
+        for kind, value in _sql_tokens(sql)
+    )
+
+def _identifier(kind, value):
+    if kind == 'quoted':
+        return value[1:-1].replace('``', '`').lower()
+    return value.lower()
+
+def sql_relations(sql):
+    """\
+    Return the relations a HiveQL statement reads from, as tuples of their
+    lower-cased database, or None if not qualified, and name.
+    
+    Relations are the names following FROM and JOIN, and those listed after
+    them separated by commas, except for the ones defined by a WITH clause.
+    """
+    tokens = [
+        (kind, value if kind != 'word' else value.lower())
+        for kind, value in _sql_tokens(sql)
+    ]
+    names = ('word', 'quoted')
+    
+    ctes = set()
+    relations = set()
+    for i, (kind, value) in enumerate(tokens):
+        # Common table expressions are defined as `name AS (`
+        if kind in names and tokens[i+1:i+3] == [('word', 'as'), ('symbol', '(')]:
+            ctes.add(_identifier(kind, value))
+        
+        if (kind, value) not in (('word', 'from'), ('word', 'join')):
+            continue
+        
+        j = i + 1
+        while j < len(tokens) and tokens[j][0] in names:
+            parts = [_identifier(*tokens[j])]
+            j += 1
+            while tokens[j:j+1] == [('symbol', '.')] and j + 1 < len(tokens) and tokens[j+1][0] in names:
+                parts.append(_identifier(*tokens[j+1]))
+                j += 2
+            
+            if len(parts) == 1:
+                relations.add((None, parts[0]))
+            else:
+                relations.add(('.'.join(parts[:-1]), parts[-1]))
+            
+            # Skip the alias, and read the next relation of a list
+            if tokens[j:j+1] == [('word', 'as')]:
+                j += 1
+            if j < len(tokens) and tokens[j][0] in names and tokens[j+1:j+2] == [('symbol', ',')]:
+                j += 1
+            if tokens[j:j+1] != [('symbol', ',')]:
+                break
+            j += 1
+    
+    return set(
+        (database, name) for database, name in relations
+        if database is not None or name not in ctes
+    )
+
+_EXPLAIN_OPERATOR = re.compile(r'^(TableScan|Limit|ListSink|[A-Z][\w ]* Operator)$')
+_EXPLAIN_STATISTICS = re.compile(r'Statistics: Num rows: (\d+) Data size: (\d+)')
+
+def parse_explain(lines):
+    """\
+    Return the bytes scanned and the rows returned by a HiveQL statement, as
+    estimated in the lines of its EXPLAIN plan, or None if not estimated.
+    
+    Bytes scanned add up the statistics of every table scan, and rows returned
+    those of every file output, or the last operator if there is none, as in
+    plans converted to a fetch task.
+    """
+    scanned = rows = last = None
+    operator = None
+    for line in lines:
+        line = line.strip()
+        if _EXPLAIN_OPERATOR.match(line):
+            operator = line
+            continue
+        
+        match = _EXPLAIN_STATISTICS.search(line)
+        if not match:
+            continue
+        
+        num_rows, data_size = int(match.group(1)), int(match.group(2))
+        if operator == 'TableScan':
+            scanned = (scanned or 0) + data_size
+        elif operator == 'File Output Operator':
+            rows = (rows or 0) + num_rows
+        last = num_rows
+        operator = None
+    
+    if rows is None:
+        rows = last
+    
+    return scanned, rows
+
+def reflect_statistics(metastore_uri, database):
+    """\
+    Return the number of rows and the size in bytes of every table, as stored
+    in the metastore, adding up those of their partitions.
+    """
+    engine = create_engine(metastore_uri)
+    
+    sql = textwrap.dedent("""\
+    SELECT
+        tb."TBL_NAME" AS tb_name,
+        pp."PARAM_KEY" AS key,
+        SUM(DOUBLE_OR_NULL(pp."PARAM_VALUE")) AS value
+    FROM "DBS" AS db
+    JOIN "TBLS" AS tb
+        ON db."DB_ID" = tb."DB_ID"
+    JOIN (
+        SELECT "TBL_ID", "PARAM_KEY", "PARAM_VALUE"
+        FROM "TABLE_PARAMS"
+        
+        UNION ALL
+        
+        SELECT p."TBL_ID", pp."PARAM_KEY", pp."PARAM_VALUE"
+        FROM "PARTITIONS" AS p
+        JOIN "PARTITION_PARAMS" AS pp
+            ON pp."PART_ID" = p."PART_ID"
+    ) AS pp
+        ON pp."TBL_ID" = tb."TBL_ID"
+    WHERE db."NAME" = %(database)s
+        AND pp."PARAM_KEY" IN ('numRows', 'totalSize')
+    GROUP BY tb."TBL_NAME", pp."PARAM_KEY"
+    """)
+    
+    keys = {
+        'numRows' : 'rows',
+        'totalSize' : 'size',
+    }
+    
+    statistics = collections.defaultdict(lambda: {'rows' : None, 'size' : None})
+    for row in engine.execute(sql, {'database' : database}):
+        if row['value'] is not None:
+            statistics[row['tb_name']][keys[row['key']]] = int(row['value'])
+    
+    return dict(statistics)
+
 def reflect_catalogs(metastore_uri, database):
     engine = create_engine(metastore_uri)
 
@@ -155,10 +362,11 @@ def reflect_catalogs(metastore_uri, database):
     ORDER BY tb_name, kind, idx
     """)
 
-    data = pd.read_sql(
-        sql, engine, index_col=['tb_name', 'idx'],
-        params={'database' : database},
-    )
+    # Group columns by table, in order
+    catalogs = collections.defaultdict(list)
+    for row in engine.execute(sql, {'database' : database}):
+        row = dict(row)
+        del row['idx']
+        catalogs[row.pop('tb_name')].append(row)
 
-    # Replace all NaN with nulls to stick to JSON specification
-    return data.where(pd.notnull(data), None)
+    return dict(catalogs)
@@ -2,17 +2,24 @@ import pkg_resources
 import requests
 
 from flask import current_app
+from textwrap import dedent
 from requests_kerberos import HTTPKerberosAuth, OPTIONAL
 from string import Template
 from urllib import quote
 from urlparse import urljoin
 from xml.sax.saxutils import escape
 
+# Suffix of the directory, next to the results, where their summary is written
+SUMMARY_SUFFIX = '.summary'
+
 class Oozie(object):
     """\
     Simple interface to Oozie REST API.
     """
     
+    # Number of jobs filtered by identifier in each request
+    _FILTER_LENGTH = 50
+    
     def __init__(self, oozie_url, database, username=None):
         """\
         Initializes a Hive interface object.
@@ -30,7 +37,7 @@ class Oozie(object):
         self._username = username
         self._kerberos_auth = HTTPKerberosAuth(mutual_authentication=OPTIONAL)
     
-    def submit(self, query, path, format_, callback_url=None):
+    def submit(self, query, path, format_, callback_url=None, name='cosmohub', summary=None, queue=None):
         """\
         Submits a HiveQL query for execution and returns its ID.
         
@@ -47,19 +54,57 @@ class Oozie(object):
         :rtype: str
         :param callback_url: URL to call on job completion
         :type callback_url: str
+        :param name: Name of the workflow job, to find it later
+        :type name: str
+        :param summary: Aggregates over the results, written next to them
+        :type summary: list
+        :param queue: YARN queue to run the job in (defaults to HIVE_YARN_QUEUE)
+        :type queue: str
         :return: Job unique identifier
         :rtype: str 
         """
         
-        sql = current_app.config['WEBHCAT_SCRIPT_TEMPLATE'].format(
+        # Part files are either concatenated by the workflow or merged by Hive
+        compaction = current_app.config['RESULTS_COMPACTION']
+        compact = bool(compaction) and format_.concatenable
+        compaction_config = ''
+        if compaction and not format_.concatenable:
+            compaction_config = dedent(
+                """\
+                SET hive.merge.tezfiles=true;
+                SET hive.merge.mapfiles=true;
+                SET hive.merge.mapredfiles=true;
+                SET hive.merge.smallfiles.avgsize={target_size};
+                SET hive.merge.size.per.task={target_size};
+                """
+            ).format(**compaction)
+        
+        # Aggregates are computed in the same pass over the query that writes
+        # the results, and stored as text next to them, so that they can be
+        # read on completion. They are kept out of the results directory, as
+        # it is overwritten as a whole.
+        template = 'WEBHCAT_SUMMARY_TEMPLATE' if summary else 'WEBHCAT_SCRIPT_TEMPLATE'
+        sql = current_app.config[template].format(
             common_config = current_app.config['WEBHCAT_SCRIPT_COMMON'],
             compression_config = format_.compression_config,
+            compaction_config = compaction_config,
             database = self._database,
             path = path,
             row_format = format_.row_format,
-            query = query
+            query = query,
+            summary_path = path + SUMMARY_SUFFIX,
+            aggregates = ', '.join(summary or []),
         )
         
+        # Both the launcher and the Hive jobs are run in the same queue
+        queue = queue or current_app.config['HIVE_YARN_QUEUE']
+        sql = dedent(
+            """\
+            SET tez.queue.name={queue};
+            SET mapreduce.job.queuename={queue};
+            """
+        ).format(queue=queue) + sql
+        
         tpl = Template(pkg_resources.resource_string('cosmohub.resources', 'job.properties.tpl'))
         props = tpl.safe_substitute(
             oozie_path = current_app.config['OOZIE_WF_PATH'],
@@ -69,6 +114,12 @@ class Oozie(object):
             jdbc_principal = current_app.config['JDBC_PRINCIPAL'],
             query = escape(sql),
             callback_url = callback_url,
+            job_name = escape(name),
+            queue_name = escape(queue),
+            results_path = escape(path),
+            compact = 'true' if compact else 'false',
+            compact_max_files = compaction['max_files'] if compact else 0,
+            compact_target_size = compaction['target_size'] if compact else 0,
         )
         
         headers = {'Content-Type' : 'application/xml;charset=UTF-8'}
@@ -106,6 +157,60 @@ class Oozie(object):
         
         return r.json()
     
+    def find(self, name):
+        """\
+        Retrieves the identifier of the last workflow job named `name`.
+        
+        Raises requests.exceptions.HTTPError on error.
+        
+        :param name: Name of the workflow job
+        :type name: str
+        :return: Job unique identifier, or None if there is no such job
+        :rtype: str
+        """
+        params = {
+            'jobtype' : 'wf',
+            'filter' : 'name={0}'.format(name),
+            'len' : 1,
+        }
+        
+        r = requests.get(self._jobs_url, params=params, auth=self._kerberos_auth)
+        r.raise_for_status()
+        
+        jobs = r.json()['workflows']
+        if jobs:
+            return jobs[0]['id']
+    
+    def status_multi(self, ids):
+        """\
+        Retrieves the status of several workflow jobs at once.
+        
+        Jobs are looked up in batches, filtering the jobs endpoint by their
+        identifiers. Jobs unknown to Oozie are missing from the result.
+        Raises requests.exceptions.HTTPError on error.
+        
+        :param ids: Job unique identifiers
+        :type ids: list
+        :return: a dictionary with status info for each job identifier
+        :rtype: dict
+        """
+        statuses = {}
+        for i in range(0, len(ids), self._FILTER_LENGTH):
+            batch = ids[i:i+self._FILTER_LENGTH]
+            params = {
+                'jobtype' : 'wf',
+                'filter' : ';'.join('id={0}'.format(id_) for id_ in batch),
+                'len' : len(batch),
+            }
+            
+            r = requests.get(self._jobs_url, params=params, auth=self._kerberos_auth)
+            r.raise_for_status()
+            
+            for job in r.json()['workflows'] or []:
+                statuses[job['id']] = job
+        
+        return statuses
+    
     def cancel(self, id_):
         """\
         Cancels the execution of a job and returns its status.
@@ -50,6 +50,7 @@ class Hive(object):
         script = current_app.config['WEBHCAT_SCRIPT_TEMPLATE'].format(
             common_config = current_app.config['WEBHCAT_SCRIPT_COMMON'],
             compression_config = format_.compression_config,
+            compaction_config = '',
             database = self._database,
             path = path,
             row_format = format_.row_format,
@@ -0,0 +1,134 @@
+"""\
+Compute and combine the digests of downloads, as exposed in their headers.
+"""
+import base64
+import hashlib
+import struct
+
+# Reversed Castagnoli polynomial, as used by HDFS block checksums
+_CRC32C_POLY = 0x82F63B78
+
+def _crc32c_table():
+    table = []
+    for n in range(256):
+        crc = n
+        for _ in range(8):
+            crc = (crc >> 1) ^ (_CRC32C_POLY if crc & 1 else 0)
+        table.append(crc)
+    return table
+
+_CRC32C_TABLE = _crc32c_table()
+
+def crc32c(data, crc=0):
+    """\
+    Return the CRC32C of `data`, continuing from the one of the preceding data.
+
+    Meant for headers and footers, which are small enough to be checksummed in
+    pure Python.
+
+    :param data: data to checksum
+    :type data: bytes
+    :param crc: CRC32C of the data preceding `data`
+    :type crc: int
+    :rtype: int
+    """
+    crc ^= 0xFFFFFFFF
+    for byte in bytearray(data):
+        crc = _CRC32C_TABLE[(crc ^ byte) & 0xFF] ^ (crc >> 8)
+    return crc ^ 0xFFFFFFFF
+
+def _gf2_times(matrix, vector):
+    result = 0
+    i = 0
+    while vector:
+        if vector & 1:
+            result ^= matrix[i]
+        vector >>= 1
+        i += 1
+    return result
+
+def _gf2_square(matrix):
+    return [_gf2_times(matrix, row) for row in matrix]
+
+def crc32c_combine(crc1, crc2, length2):
+    """\
+    Return the CRC32C of two blocks of data concatenated, given their CRC32C
+    and the length of the second one, without reading them again.
+
+    :param crc1: CRC32C of the first block
+    :type crc1: int
+    :param crc2: CRC32C of the second block
+    :type crc2: int
+    :param length2: length in bytes of the second block
+    :type length2: int
+    :rtype: int
+    """
+    if length2 <= 0:
+        return crc1
+
+    # Operators appending one, two and four zero bits to the first CRC
+    odd = [_CRC32C_POLY] + [1 << n for n in range(31)]
+    even = _gf2_square(odd)
+    odd = _gf2_square(even)
+
+    # Append as many zero bytes as the length of the second block
+    while True:
+        even = _gf2_square(odd)
+        if length2 & 1:
+            crc1 = _gf2_times(even, crc1)
+        length2 >>= 1
+        if not length2:
+            break
+
+        odd = _gf2_square(even)
+        if length2 & 1:
+            crc1 = _gf2_times(odd, crc1)
+        length2 >>= 1
+        if not length2:
+            break
+
+    return crc1 ^ crc2
+
+def encode_crc32c(crc):
+    """\
+    Return a CRC32C encoded in base64, as its 4 big-endian bytes.
+    """
+    return base64.b64encode(struct.pack('>I', crc)).decode('ascii')
+
+def encode_sha256(data):
+    """\
+    Return the SHA-256 digest of `data` encoded in base64.
+    """
+    return base64.b64encode(hashlib.sha256(data).digest()).decode('ascii')
+
+def sha256_iter(chunks, length, callback):
+    """\
+    Yield every chunk in `chunks`, computing their SHA-256 digest on the way.
+
+    Once `length` bytes have been yielded, or every chunk if it is None,
+    `callback` is called with the number of bytes and the digest encoded in
+    base64. Streams ending early, or being closed before their end, do not call
+    it.
+    """
+    sha = hashlib.sha256()
+    size = 0
+
+    for chunk in chunks:
+        sha.update(chunk)
+        size += len(chunk)
+        yield chunk
+
+    if length is None or size == length:
+        callback(size, base64.b64encode(sha.digest()).decode('ascii'))
+
+def repr_digest(digests):
+    """\
+    Return the value of the `Repr-Digest` header listing `digests`.
+
+    :param digests: base64 encoded digests, by algorithm name
+    :type digests: dict
+    """
+    return ', '.join(
+        '{0}=:{1}:'.format(name, value)
+        for name, value in sorted(digests.items(), reverse=True)
+    )
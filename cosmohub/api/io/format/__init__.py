@@ -0,0 +1,42 @@
+"""\
+Registry of the download formats provided by `cosmohub_format` entry points.
+"""
+
+import collections
+
+from pkg_resources import iter_entry_points # @UnresolvedImport
+
+class FormatRegistry(collections.Mapping):
+    """\
+    Map format names to their classes, loading each plugin on first use.
+    
+    Only the entry point metadata is read when the registry is built, so the
+    (often heavy) modules implementing each format are imported the first time
+    that format is requested, and only in the processes that request it.
+    """
+    
+    def __init__(self, group):
+        """\
+        :param group: name of the entry point group to look formats up in
+        :type group: str
+        """
+        self._entries = collections.OrderedDict(
+            (entry.name, entry)
+            for entry in iter_entry_points(group=group)
+        )
+        self._loaded = {}
+    
+    def __getitem__(self, name):
+        if name not in self._loaded:
+            self._loaded[name] = self._entries[name].load()
+        
+        return self._loaded[name]
+    
+    def __iter__(self):
+        return iter(self._entries)
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    def __contains__(self, name):
+        return name in self._entries
@@ -1,22 +1,360 @@
 """\
-Add a ASDF header to an existing stream of record array data.
+Present an existing stream of record array data as ASDF binary blocks.
 """
 
 from __future__ import absolute_import
 
-import asdf
+import bz2
+import io
+import json
+import struct
 import textwrap
 
-from astropy.io import fits
-from cStringIO import StringIO
+from .base import BaseFormat, BaseTranscoder
+from .. import recarray
+from ...release import __version__
 
-from .base import BaseFormat
+# Uncompressed length of each binary block
+_BLOCK_LENGTH = 16*1024*1024
+
+_BLOCK_MAGIC = b'\xd3BLK'
+
+# Magic, header size, flags, compression, allocated, used and data sizes, checksum
+_BLOCK_HEADER = struct.Struct('>4sHI4sQQQ16s')
+
+# ASDF datatypes of the numpy types used in record arrays
+_datatype = {
+    'i' : 'int{0}',
+    'u' : 'uint{0}',
+    'f' : 'float{0}',
+}
+
+def _block_header(data_size, used_size=None, compression=b'', checksum=b''):
+    """\
+    Return the header of a binary block.
+    """
+    if used_size is None:
+        used_size = data_size
+    
+    return _BLOCK_HEADER.pack(
+        _BLOCK_MAGIC, _BLOCK_HEADER.size - 6, 0, compression.ljust(4, b'\0'),
+        used_size, used_size, data_size, checksum.ljust(16, b'\0'),
+    )
+
+def _block_rows(record_length):
+    """\
+    Return the number of records stored in each binary block.
+    """
+    return max(1, _BLOCK_LENGTH // record_length)
+
+def _tree(description, comments, rows, block_rows):
+    """\
+    Return the ASDF header and tree, with an array for each binary block.
+    
+    The tree is written in YAML flow style, which JSON is a subset of.
+    """
+    dtype = recarray.dtype(description)
+    
+    datatype = []
+    for name in dtype.names:
+        field = dtype[name]
+        if field.kind == 'S':
+            type_ = ['ascii', field.itemsize]
+        else:
+            type_ = _datatype[field.kind].format(8 * field.itemsize)
+        datatype.append({
+            'name' : name,
+            'datatype' : type_,
+            'byteorder' : 'big',
+        })
+    
+    lines = [
+        '#ASDF 1.0.0',
+        '#ASDF_STANDARD 1.4.0',
+        '%YAML 1.1',
+        '%TAG ! tag:stsci.edu:asdf/',
+        '--- !core/asdf-1.1.0',
+        'asdf_library: !core/software-1.0.0 {0}'.format(json.dumps({
+            'name' : 'cosmohub',
+            'version' : __version__,
+        })),
+        'comments: {0}'.format(json.dumps(comments or '')),
+        'rows: {0}'.format(rows),
+        'catalog:',
+    ]
+    if not rows:
+        lines[-1] += ' []'
+    
+    for i, start in enumerate(range(0, rows, block_rows)):
+        lines.append('- !core/ndarray-1.0.0 {0}'.format(json.dumps({
+            'source' : i,
+            'datatype' : datatype,
+            'byteorder' : 'big',
+            'shape' : [min(block_rows, rows - start)],
+        })))
+    
+    lines.append('...')
+    
+    return '\n'.join(lines) + '\n'
+
+def _block_index(offsets):
+    """\
+    Return the block index, listing the offset of every binary block.
+    """
+    if not offsets:
+        return b''
+    
+    lines = ['#ASDF BLOCK INDEX', '%YAML 1.1', '---']
+    lines.extend('- {0}'.format(offset) for offset in offsets)
+    lines.append('...')
+    
+    return '\n'.join(lines) + '\n'
+
+class BlockStream(io.RawIOBase):
+    """\
+    Present a stream of fixed-width records as uncompressed ASDF binary blocks.
+    
+    Every block holds the same number of records, except for the last one, so
+    the length of the stream and the offset of each block are known in advance
+    and the stream remains seekable.
+    """
+    
+    def __init__(self, fd, record_length):
+        """\
+        :param fd: readable and seekable stream of fixed-width records
+        :type fd: file object
+        :param record_length: length in bytes of each record
+        :type record_length: int
+        """
+        self._fd = fd
+        
+        pos = self._fd.tell()
+        self._fd_length = self._fd.seek(0, io.SEEK_END)
+        self._fd.seek(pos)
+        
+        self._rows = self._fd_length // record_length
+        self._block_rows = _block_rows(record_length)
+        self._data_length = self._block_rows * record_length
+        self._stride = _BLOCK_HEADER.size + self._data_length
+        
+        self._blocks = (self._fd_length + self._data_length - 1) // self._data_length
+        self._length = self._blocks * _BLOCK_HEADER.size + self._fd_length
+        self._position = 0
+    
+    @property
+    def rows(self):
+        """\
+        Return the number of records in the stream.
+        """
+        return self._rows
+    
+    @property
+    def block_rows(self):
+        """\
+        Return the number of records in each block.
+        """
+        return self._block_rows
+    
+    @property
+    def offsets(self):
+        """\
+        Return the offset of each block within the stream.
+        """
+        return [i * self._stride for i in range(self._blocks)]
+    
+    def readinto(self, b):
+        """\
+        Read up to len(b) bytes into b.
+        
+        Returns number of bytes read (0 for EOF), or None if the object
+        is set not to block and has no data to read.
+        """
+        if self._position >= self._length:
+            return 0
+        
+        block, offset = divmod(self._position, self._stride)
+        start = block * self._data_length
+        data_size = min(self._data_length, self._fd_length - start)
+        
+        if offset < _BLOCK_HEADER.size:
+            chunk = _block_header(data_size)[offset:offset+len(b)]
+        else:
+            offset -= _BLOCK_HEADER.size
+            if self._fd.tell() != start + offset:
+                self._fd.seek(start + offset)
+            chunk = self._fd.read(min(len(b), data_size - offset))
+            if not chunk:
+                raise IOError('Unexpected end of record array stream')
+        
+        n = len(chunk)
+        self._position += n
+        
+        # Return the data read
+        try:
+            b[:n] = chunk
+        except TypeError as err:
+            import array
+            if not isinstance(b, array.array):
+                raise err
+            b[:n] = array.array(b'b', chunk)
+        
+        return n
+    
+    def seek(self, pos, whence=0):
+        """\
+        Change stream position.
+        
+        Change the stream position to byte offset pos. Argument pos is
+        interpreted relative to the position indicated by whence.  Values
+        for whence are:
+        
+        * 0 -- start of stream (the default); offset should be zero or positive
+        * 1 -- current stream position; offset may be negative
+        * 2 -- end of stream; offset is usually negative
+        
+        Return the new absolute position.
+        """
+        if self.closed:
+            raise ValueError("seek on closed file")
+        try:
+            pos.__index__
+        except AttributeError:
+            raise TypeError("an integer is required")
+        if not (0 <= whence <= 2):
+            raise ValueError("invalid whence")
+        
+        self._position = {
+            0: max(0, pos),
+            1: min(self._length, max(0, self._position + pos)),
+            2: min(self._length, self._length + pos)
+        }[whence]
+        
+        return self._position
+    
+    def readable(self):
+        """\
+        Return True if the stream can be read from. If False, `read()` will
+        raise IOError.
+        """
+        return True
+    
+    def seekable(self):
+        """\
+        Return True if the stream supports random access. If False, `seek()`,
+        `tell()` and `truncate()` will raise IOError.
+        """
+        return True
+
+class RecArrayAsdfTranscoder(BaseTranscoder):
+    """\
+    Re-encode a stream of record array data as compressed ASDF binary blocks.
+    
+    Each chunk of records is compressed into a block of its own, so that
+    clients can locate them through the block index and decompress them in
+    parallel.
+    """
+    
+    _CHUNK_LENGTH = _BLOCK_LENGTH
+    
+    # Compression label written in the header of every block
+    _compression = None
+    
+    def __init__(self, fd, description, comments=None):
+        super(RecArrayAsdfTranscoder, self).__init__(fd, description, comments)
+        
+        self._record_length = recarray.dtype(description).itemsize
+        
+        self._offsets = []
+        self._file_offset = 0
+    
+    def _compress(self, data):
+        """\
+        Return the compressed data of a block.
+        """
+        raise NotImplementedError
+    
+    def _header(self):
+        """\
+        Return the ASDF tree, with the shape of every block.
+        """
+        header = _tree(
+            self._description, self._comments,
+            self._fd_length // self._record_length,
+            _block_rows(self._record_length),
+        )
+        
+        self._file_offset = len(header)
+        return header
+    
+    def _encode(self, data):
+        """\
+        Return a compressed block with a chunk of records.
+        
+        Its checksum is left as zeros, meaning not computed, as readers have
+        disagreed on whether it covers the compressed or uncompressed data.
+        """
+        compressed = self._compress(data)
+        block = _block_header(
+            len(data), len(compressed), self._compression,
+        ) + compressed
+        
+        self._offsets.append(self._file_offset)
+        self._file_offset += len(block)
+        
+        return block
+    
+    def _footer(self):
+        """\
+        Return the block index.
+        """
+        return _block_index(self._offsets)
+
+class RecArrayAsdfBz2Transcoder(RecArrayAsdfTranscoder):
+    """\
+    Re-encode a stream of record array data as bzip2-compressed ASDF blocks.
+    """
+    
+    _compression = b'bzp2'
+    
+    def _compress(self, data):
+        return bz2.compress(data)
+
+class RecArrayAsdfLz4Transcoder(RecArrayAsdfTranscoder):
+    """\
+    Re-encode a stream of record array data as LZ4-compressed ASDF blocks.
+    
+    Requires the optional `lz4` package.
+    """
+    
+    _compression = b'lz4'
+    
+    # Data is compressed in frames prefixed with their length, as asdf does
+    _FRAME_LENGTH = 4*1024*1024
+    
+    def __init__(self, fd, description, comments=None):
+        super(RecArrayAsdfLz4Transcoder, self).__init__(fd, description, comments)
+        
+        import lz4.block
+        self._lz4 = lz4.block
+    
+    def _compress(self, data):
+        frames = []
+        for i in range(0, len(data), self._FRAME_LENGTH):
+            frame = self._lz4.compress(data[i:i+self._FRAME_LENGTH])
+            frames.append(struct.pack('>I', len(frame)) + frame)
+        
+        return b''.join(frames)
 
 class AsdfFile(BaseFormat):
     """\
-    Add a ASDF header to an existing stream of record array data.
+    Present an existing stream of record array data as ASDF binary blocks.
+    
+    The records are split in uncompressed blocks of the same size, listed in a
+    trailing block index, so that they can be read partially or memory-mapped.
     """
     
+    layout = 'recarray'
+    
     compression_config = textwrap.dedent(
         """\
         SET hive.exec.compress.output=false;
@@ -32,41 +370,36 @@ class AsdfFile(BaseFormat):
         """
     )
     
-    _dtype = {
-        'BIGINT_TYPE'    : 'K',
-        'BOOLEAN_TYPE'   : 'L',
-        'CHAR_TYPE'      : '255A',
-        'DATE_TYPE'      : 'K',
-        'DOUBLE_TYPE'    : 'D',
-        'FLOAT_TYPE'     : 'E',
-        'INT_TYPE'       : 'J',
-        'SMALLINT_TYPE'  : 'I',
-        'STRING_TYPE'    : '255A',
-        'TIMESTAMP_TYPE' : 'K',
-        'TINYINT_TYPE'   : 'B',
-        'VARCHAR_TYPE'   : '255A',
-    }
-    
-    def _initialize(self):
+    def __init__(self, fd, description, comments=None):
         """\
-        Build the header from the field names
+        Build the ASDF tree and the block index
         """
-        columns = [
-            fits.Column(name=str(c[0]), format=self._dtype[c[1]]) # @UndefinedVariable
-            for c in self._description
-        ]
-        
-        thdu = fits.BinTableHDU.from_columns(columns) # @UndefinedVariable
-        rows = self._fd_length / int(thdu.header['NAXIS1'])
-        
-        tree = {
-            'catalog' : asdf.Stream([rows], thdu.columns.dtype.newbyteorder('>')),
-            'comments' : self._comments,
-        }
+        stream = BlockStream(fd, recarray.dtype(description).itemsize)
         
-        header = StringIO()
-        asdf.AsdfFile(tree).write_to(header)
+        super(AsdfFile, self).__init__(stream, description, comments)
         
-        self._header = header.getvalue()
-        
-        super(AsdfFile, self)._initialize()
+        self._header = _tree(description, comments, stream.rows, stream.block_rows)
+        self._footer = _block_index([
+            len(self._header) + offset
+            for offset in stream.offsets
+        ])
+
+class AsdfBz2File(AsdfFile):
+    """\
+    ASDF binary blocks compressed with bzip2, transcoded from stored record
+    array data.
+    """
+    
+    transcoders = {
+        'recarray' : RecArrayAsdfBz2Transcoder,
+    }
+
+class AsdfLz4File(AsdfFile):
+    """\
+    ASDF binary blocks compressed with LZ4, transcoded from stored record array
+    data.
+    """
+    
+    transcoders = {
+        'recarray' : RecArrayAsdfLz4Transcoder,
+    }
@@ -4,11 +4,45 @@ Base class for wrapping raw data into a suitable download format.
 
 import io
 
+from .. import digest
+
 class BaseFormat(io.RawIOBase):
     """\
     Base class for wrapping raw data into a suitable download format.
     """
     
+    # Layout of the stored raw data that this format wraps as is
+    layout = None
+    
+    # Transcoders able to serve this format from raw data in other layouts
+    transcoders = {}
+    
+    # Whether the raw data is read as the concatenation of its part files
+    concatenable = True
+    
+    @classmethod
+    def can_open(cls, layout):
+        """\
+        Return True if this format can be served from raw data in `layout`.
+        """
+        return layout == cls.layout or layout in cls.transcoders
+    
+    @classmethod
+    def open(cls, fd, layout, description, comments=None):
+        """\
+        Serve raw data stored in `layout` using this format.
+        
+        If the layout is not the one wrapped by this format, or the format lists
+        a transcoder for it, the raw data is transcoded on the fly.
+        """
+        if layout in cls.transcoders:
+            return cls.transcoders[layout](fd, description, comments)
+        
+        if layout == cls.layout:
+            return cls(fd, description, comments)
+        
+        raise ValueError("Cannot serve '{0}' data in this format".format(layout))
+    
     def __init__(self, fd, description, comments=None):
         """\
         :param fd: readable and seekable raw data stream
@@ -73,6 +107,19 @@ class BaseFormat(io.RawIOBase):
         """
         return self._row_format
     
+    def crc32c(self):
+        """\
+        Return the CRC32C of the whole stream, combining the ones of the header
+        and footer with the one of the raw data, or None if it is unknown.
+        """
+        crc32c = getattr(self._fd, 'crc32c', None)
+        crc = crc32c() if crc32c else None
+        if crc is None:
+            return None
+        
+        crc = digest.crc32c_combine(digest.crc32c(self._header), crc, self._fd_length)
+        return digest.crc32c_combine(crc, digest.crc32c(self._footer), len(self._footer))
+    
     def readinto(self, b):
         """\
         Read up to len(b) bytes into b.
@@ -156,3 +203,135 @@ class BaseFormat(io.RawIOBase):
         `tell()` and `truncate()` will raise IOError.
         """
         return self._fd.seekable()
+
+class BaseTranscoder(io.RawIOBase):
+    """\
+    Base class for re-encoding raw data into a download format on the fly.
+    
+    The raw data is read in chunks of whole records, which are encoded one
+    after the other. As the final length is not known in advance, the resulting
+    stream can only be read sequentially.
+    """
+    
+    _CHUNK_LENGTH = 4*1024*1024
+    
+    def __init__(self, fd, description, comments=None):
+        """\
+        :param fd: readable and seekable raw data stream
+        :type fd: file object
+        :param description: Set of fields and types constituting the raw data
+        :type description: Cursor.description
+        """
+        self._fd = fd
+        self._description = description
+        self._comments = comments
+        
+        self._record_length = 1
+        
+        pos = self._fd.tell()
+        self._fd_length = self._fd.seek(0, io.SEEK_END)
+        self._fd.seek(pos)
+        
+        self._buffer = b''
+        self._offset = 0
+        self._remainder = b''
+        self._started = False
+        self._finished = False
+    
+    @property
+    def source_length(self):
+        """\
+        Return the length of the raw data being transcoded.
+        """
+        return self._fd_length
+    
+    def _header(self):
+        """\
+        Return the data to emit before the first record.
+        """
+        return b''
+    
+    def _encode(self, data):
+        """\
+        Return the encoded representation of a chunk of whole records.
+        """
+        raise NotImplementedError
+    
+    def _footer(self):
+        """\
+        Return the data to emit after the last record.
+        """
+        return b''
+    
+    def _next_chunk(self):
+        """\
+        Return the next chunk of encoded data.
+        """
+        if not self._started:
+            self._started = True
+            return self._header()
+        
+        length = max(1, self._CHUNK_LENGTH // self._record_length) * self._record_length
+        chunks = [self._remainder]
+        size = len(self._remainder)
+        while size < length:
+            chunk = self._fd.read(length - size)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            size += len(chunk)
+        
+        data = b''.join(chunks)
+        if not data:
+            self._finished = True
+            return self._footer()
+        
+        n = len(data) - len(data) % self._record_length
+        if not n:
+            raise IOError('Raw data stream ended in the middle of a record')
+        
+        self._remainder = data[n:]
+        return self._encode(data[:n])
+    
+    def readinto(self, b):
+        """\
+        Read up to len(b) bytes into b.
+
+        Returns number of bytes read (0 for EOF), or None if the object
+        is set not to block and has no data to read.
+        """
+        while self._offset >= len(self._buffer):
+            if self._finished:
+                return 0
+            self._buffer = self._next_chunk()
+            self._offset = 0
+        
+        chunk = self._buffer[self._offset:self._offset+len(b)]
+        
+        n = len(chunk)
+        self._offset += n
+        
+        # Return the data read
+        try:
+            b[:n] = chunk
+        except TypeError as err:
+            import array
+            if not isinstance(b, array.array):
+                raise err
+            b[:n] = array.array(b'b', chunk)
+
+        return n
+
+    def readable(self):
+        """\
+        Return True if the stream can be read from. If False, `read()` will
+        raise IOError.
+        """
+        return True
+
+    def seekable(self):
+        """\
+        Return True if the stream supports random access. If False, `seek()`,
+        `tell()` and `truncate()` will raise IOError.
+        """
+        return False
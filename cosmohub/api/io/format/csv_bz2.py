@@ -2,15 +2,53 @@
 Add a proper CSV header to an existing CSV data stream.
 """
 import bz2
+import numpy as np
 import textwrap
 
-from .base import BaseFormat
+from .base import BaseFormat, BaseTranscoder
+from .. import recarray
+
+def _csv_header(description, comments):
+    """\
+    Build the commented CSV header with the field names.
+    """
+    header = '# ' + '\n# '.join(comments.split('\n')) +'\n'
+    header += ','.join(f[0] for f in description) + '\n'
+    
+    return header.encode('utf8')
+
+class RecArrayCsvBz2Transcoder(BaseTranscoder):
+    """\
+    Re-encode a stream of record array data as a bzip2-compressed CSV.
+    """
+    
+    def __init__(self, fd, description, comments=None):
+        super(RecArrayCsvBz2Transcoder, self).__init__(fd, description, comments)
+        
+        self._dtype = recarray.dtype(description)
+        self._record_length = self._dtype.itemsize
+        self._compressor = bz2.BZ2Compressor()
+    
+    def _header(self):
+        return self._compressor.compress(_csv_header(self._description, self._comments))
+    
+    def _encode(self, data):
+        records = np.frombuffer(data, dtype=self._dtype)
+        return self._compressor.compress(recarray.to_csv(records, self._description))
+    
+    def _footer(self):
+        return self._compressor.flush()
 
 class CsvBz2File(BaseFormat):
     """\
     Add a proper CSV header to an existing CSV data stream.
     """
     
+    layout = 'text'
+    transcoders = {
+        'recarray' : RecArrayCsvBz2Transcoder,
+    }
+    
     compression_config = textwrap.dedent(
         """\
         SET hive.exec.compress.output=true;
@@ -34,7 +72,4 @@ class CsvBz2File(BaseFormat):
         """
         super(CsvBz2File, self).__init__(fd, description, comments)
         
-        header = '# ' + '\n# '.join(comments.split('\n')) +'\n'
-        header += ','.join(f[0] for f in description) + '\n'
-        
-        self._header = bz2.compress(header.encode('utf8'))
+        self._header = bz2.compress(_csv_header(description, comments))
@@ -4,8 +4,6 @@ Add a FITS header and padding to an existing stream of record array data.
 import re
 import textwrap
 
-from astropy.io import fits
-
 from .base import BaseFormat
 
 class FitsFile(BaseFormat):
@@ -13,6 +11,8 @@ class FitsFile(BaseFormat):
     Add a FITS header and padding to an existing stream of record array data.
     """
     
+    layout = 'recarray'
+    
     compression_config = textwrap.dedent(
         """\
         SET hive.exec.compress.output=false;
@@ -52,6 +52,9 @@ class FitsFile(BaseFormat):
         """\
         Build the FITS header and footer
         """
+        # Deferred, as importing astropy takes a while
+        from astropy.io import fits
+        
         super(FitsFile, self).__init__(fd, description)
         
         columns = [
@@ -0,0 +1,267 @@
+"""\
+Re-encode a stream of record array data as tile-compressed FITS tables.
+"""
+import numpy as np
+import re
+import struct
+import textwrap
+import zlib
+
+from .base import BaseFormat, BaseTranscoder
+from .. import recarray
+
+_BLOCK_LENGTH = 2880
+
+def _card(key, value=None, comment=None):
+    """\
+    Format a fixed-format FITS header card.
+    """
+    if value is None:
+        card = '{0:<8}'.format(key)
+        if comment:
+            card += comment
+    else:
+        if isinstance(value, bool):
+            value = '{0:>20}'.format('T' if value else 'F')
+        elif isinstance(value, (int, long)):
+            value = '{0:>20}'.format(value)
+        else:
+            value = "'{0:<8}'".format(value.replace("'", "''"))
+            value = '{0:<20}'.format(value)
+        card = '{0:<8}= {1}'.format(key, value)
+        if comment:
+            card += ' / ' + comment
+
+    return '{0:<80}'.format(card[:80])
+
+def _pad_header(cards):
+    """\
+    Join the header cards, terminate and pad them to a whole FITS block.
+    """
+    header = ''.join(cards) + '{0:<80}'.format('END')
+    return header + ' ' * (-len(header) % _BLOCK_LENGTH)
+
+class RecArrayFitsFzTranscoder(BaseTranscoder):
+    """\
+    Re-encode a stream of record array data as tile-compressed FITS tables.
+
+    Records are grouped in tiles, and every column of each tile is compressed
+    on its own, following the FITS tiled table compression convention. Numeric
+    columns have their bytes shuffled (GZIP_2) before compression, and string
+    columns are narrowed to the widths found in the results, if known.
+
+    Each table extension holds a bounded number of records, so that only one of
+    them has to be kept in memory before its header can be written.
+    """
+
+    # Uncompressed length of each tile and table extension
+    _TILE_LENGTH = 1024*1024
+    _HDU_LENGTH = 64*1024*1024
+
+    _COMPRESSION_LEVEL = 6
+
+    _tform = {
+        'BIGINT_TYPE'    : 'K',
+        'BOOLEAN_TYPE'   : 'L',
+        'CHAR_TYPE'      : 'A',
+        'DATE_TYPE'      : 'K',
+        'DOUBLE_TYPE'    : 'D',
+        'FLOAT_TYPE'     : 'E',
+        'INT_TYPE'       : 'J',
+        'SMALLINT_TYPE'  : 'I',
+        'STRING_TYPE'    : 'A',
+        'TIMESTAMP_TYPE' : 'K',
+        'TINYINT_TYPE'   : 'B',
+        'VARCHAR_TYPE'   : 'A',
+    }
+
+    _non_printable_re = re.compile(r'[^ -~]+')
+
+    def __init__(self, fd, description, comments=None):
+        super(RecArrayFitsFzTranscoder, self).__init__(fd, description, comments)
+
+        self._dtype = recarray.dtype(description)
+        self._record_length = self._dtype.itemsize
+
+        # Narrow strings to the maximum width recorded upon completion
+        self._columns = []
+        for c in description:
+            name, type_ = str(c[0]), c[1]
+            width = recarray.string_width(c)
+            
+            tform = self._tform[type_]
+            if tform == 'A':
+                size = self._dtype[name].itemsize
+                if width is not None and 0 <= width < size:
+                    size = max(1, width)
+                tform = '{0}A'.format(size)
+            self._columns.append((name, tform))
+
+        self._tile_rows = max(1, self._TILE_LENGTH // self._record_length)
+        self._hdu_rows = max(1, self._HDU_LENGTH // (self._tile_rows * self._record_length)) * self._tile_rows
+
+        self._pending = b''
+        self._tiles = []
+        self._tiles_rows = 0
+        self._hdus = 0
+
+    def _header(self):
+        """\
+        Return the primary header, with the comments.
+        """
+        cards = [
+            _card('SIMPLE', True, 'conforms to FITS standard'),
+            _card('BITPIX', 8, 'array data type'),
+            _card('NAXIS', 0, 'number of array dimensions'),
+            _card('EXTEND', True),
+        ]
+        for comment in (self._comments or '').split('\n'):
+            comment = self._non_printable_re.sub('', comment)
+            for i in range(0, max(1, len(comment)), 72):
+                cards.append(_card('COMMENT', comment=comment[i:i+72]))
+
+        return _pad_header(cards)
+
+    def _compress(self, data):
+        compressor = zlib.compressobj(self._COMPRESSION_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return compressor.compress(data) + compressor.flush()
+
+    def _compress_tile(self, data):
+        """\
+        Return the compressed data of every column of a tile.
+        """
+        records = np.frombuffer(data, dtype=self._dtype)
+
+        columns = []
+        for name, tform in self._columns:
+            values = records[name]
+            if tform.endswith('A'):
+                values = values.astype('S' + tform[:-1])
+
+            size = values.dtype.itemsize
+            if size > 1 and not tform.endswith('A'):
+                # GZIP_2: most significant bytes of every value first
+                values = np.ascontiguousarray(
+                    np.ascontiguousarray(values).view(np.uint8).reshape(len(records), size).T
+                )
+
+            columns.append(self._compress(values.tostring()))
+
+        return len(records), columns
+
+    def _hdu(self):
+        """\
+        Return the table extension with the compressed tiles pending to write.
+        """
+        tiles, rows = self._tiles, self._tiles_rows
+        self._tiles, self._tiles_rows = [], 0
+        self._hdus += 1
+
+        # Descriptors of each column in each tile, then the heap
+        table = []
+        heap = []
+        heap_length = 0
+        for _, columns in tiles:
+            for column in columns:
+                table.append(struct.pack('>qq', len(column), heap_length))
+                heap.append(column)
+                heap_length += len(column)
+
+        cards = [
+            _card('XTENSION', 'BINTABLE', 'binary table extension'),
+            _card('BITPIX', 8, 'array data type'),
+            _card('NAXIS', 2, 'number of array dimensions'),
+            _card('NAXIS1', 16 * len(self._columns), 'length of dimension 1'),
+            _card('NAXIS2', len(tiles), 'length of dimension 2'),
+            _card('PCOUNT', heap_length, 'number of group parameters'),
+            _card('GCOUNT', 1, 'number of groups'),
+            _card('TFIELDS', len(self._columns), 'number of table fields'),
+        ]
+        for i, (name, tform) in enumerate(self._columns, 1):
+            length = max([len(columns[i-1]) for _, columns in tiles] or [0])
+            ctype = 'GZIP_2' if not tform.endswith('A') and self._dtype[name].itemsize > 1 else 'GZIP_1'
+            cards.extend([
+                _card('TTYPE{0}'.format(i), name),
+                _card('TFORM{0}'.format(i), '1QB({0})'.format(length)),
+                _card('ZFORM{0}'.format(i), tform),
+                _card('ZCTYP{0}'.format(i), ctype),
+            ])
+        cards.extend([
+            _card('ZTABLE', True, 'this is a compressed table'),
+            _card('ZTILELEN', self._tile_rows, 'number of rows in each tile'),
+            _card('ZNAXIS1', sum(
+                int(tform[:-1]) if tform.endswith('A') else self._dtype[name].itemsize
+                for name, tform in self._columns
+            ), 'length of uncompressed rows'),
+            _card('ZNAXIS2', rows, 'number of uncompressed rows'),
+            _card('ZPCOUNT', 0, 'size of uncompressed heap'),
+            _card('EXTNAME', 'RESULTS{0}'.format(self._hdus) if self._hdus > 1 else 'RESULTS'),
+        ])
+
+        data = b''.join(table) + b''.join(heap)
+        data += b'\0' * (-len(data) % _BLOCK_LENGTH)
+
+        return _pad_header(cards) + data
+
+    def _encode(self, data):
+        """\
+        Compress whole tiles, and return the table extensions completed.
+        """
+        data = self._pending + data
+        tile_length = self._tile_rows * self._record_length
+
+        output = []
+        offset = 0
+        while len(data) - offset >= tile_length:
+            self._tiles.append(self._compress_tile(data[offset:offset+tile_length]))
+            self._tiles_rows += self._tile_rows
+            offset += tile_length
+
+            if self._tiles_rows >= self._hdu_rows:
+                output.append(self._hdu())
+
+        self._pending = data[offset:]
+
+        return b''.join(output)
+
+    def _footer(self):
+        """\
+        Compress the last tile and return the last table extension.
+        """
+        if self._pending:
+            self._tiles.append(self._compress_tile(self._pending))
+            self._tiles_rows += len(self._pending) // self._record_length
+            self._pending = b''
+
+        if self._tiles or not self._hdus:
+            return self._hdu()
+
+        return b''
+
+class FitsFzFile(BaseFormat):
+    """\
+    Tile-compressed FITS tables, transcoded from stored record array data.
+    """
+
+    layout = 'recarray'
+
+    # Compressed tiles must always be built, even from its own layout
+    transcoders = {
+        'recarray' : RecArrayFitsFzTranscoder,
+    }
+
+    compression_config = textwrap.dedent(
+        """\
+        SET hive.exec.compress.output=false;
+        SET mapreduce.output.fileoutputformat.compress=false;
+        SET hive.merge.tezfiles=false;
+        """
+    )
+    row_format = textwrap.dedent(
+        """\
+        ROW FORMAT SERDE 'es.pic.astro.hadoop.serde.RecArraySerDe'
+        STORED AS
+            INPUTFORMAT 'es.pic.astro.hadoop.io.BinaryOutputFormat'
+            OUTPUTFORMAT 'es.pic.astro.hadoop.io.BinaryOutputFormat'
+        """
+    )
@@ -1,23 +1,230 @@
 """\
 Patch the FileMetaData provided by HDFSParquetReader to generate a single Parquet file.
 """
-import pkg_resources
+import collections
+import copy
+import numpy as np
 import struct
 import textwrap
-import thriftpy2
 
 from thriftpy2.transport import TMemoryBuffer
 from thriftpy2.protocol import TCompactProtocol
 
-from .base import BaseFormat
+from .base import BaseFormat, BaseTranscoder
+from .. import recarray
+from ..thrift import parquet_thrift
 
-parquet_thrift = thriftpy2.load(pkg_resources.resource_filename('cosmohub.resources', 'parquet.thrift'), module_name="parquet_thrift")
+class RecArrayParquetTranscoder(BaseTranscoder):
+    """\
+    Re-encode a stream of record array data as a Parquet file.
+    
+    Each chunk of records becomes a row group, with every column PLAIN encoded
+    and uncompressed in pages of bounded size. As records cannot hold nulls, all
+    the columns are required.
+    """
+    
+    # Length of the records in each row group, and of the values in each page
+    _CHUNK_LENGTH = 32*1024*1024
+    _PAGE_LENGTH = 1024*1024
+    
+    # Parquet physical type, little-endian dtype and converted type of each field
+    _type = {
+        'BIGINT_TYPE'    : ('INT64', '<i8', None),
+        'BOOLEAN_TYPE'   : ('BOOLEAN', None, None),
+        'CHAR_TYPE'      : ('BYTE_ARRAY', None, 'UTF8'),
+        'DATE_TYPE'      : ('INT32', '<i4', 'DATE'),
+        'DOUBLE_TYPE'    : ('DOUBLE', '<f8', None),
+        'FLOAT_TYPE'     : ('FLOAT', '<f4', None),
+        'INT_TYPE'       : ('INT32', '<i4', None),
+        'SMALLINT_TYPE'  : ('INT32', '<i4', 'INT_16'),
+        'STRING_TYPE'    : ('BYTE_ARRAY', None, 'UTF8'),
+        'TIMESTAMP_TYPE' : ('INT64', '<i8', 'TIMESTAMP_MILLIS'),
+        'TINYINT_TYPE'   : ('INT32', '<i4', 'UINT_8'),
+        'VARCHAR_TYPE'   : ('BYTE_ARRAY', None, 'UTF8'),
+    }
+    
+    def __init__(self, fd, description, comments=None):
+        super(RecArrayParquetTranscoder, self).__init__(fd, description, comments)
+        
+        self._dtype = recarray.dtype(description)
+        self._record_length = self._dtype.itemsize
+        
+        pt = parquet_thrift()
+        self._schema = [pt.SchemaElement(name='schema', num_children=len(description))]
+        for c in description:
+            physical, _, converted = self._type[c[1]]
+            self._schema.append(pt.SchemaElement(
+                name=c[0],
+                type=getattr(pt.Type, physical),
+                repetition_type=pt.FieldRepetitionType.REQUIRED,
+                converted_type=getattr(pt.ConvertedType, converted) if converted else None,
+            ))
+        
+        self._file_offset = 0
+        self._row_groups = []
+        self._num_rows = 0
+    
+    def _plain(self, values, type_):
+        """\
+        Return the values of a column in PLAIN encoding, and their statistics.
+        """
+        pt = parquet_thrift()
+        _, dtype, _ = self._type[type_]
+        
+        if type_ == 'BOOLEAN_TYPE':
+            # Bit-packed, least significant bit first
+            bits = values == b'T'
+            bits = np.concatenate([bits, np.zeros(-len(bits) % 8, dtype=bool)])
+            return np.packbits(bits.reshape(-1, 8)[:, ::-1]).tostring(), None
+        
+        if dtype is None:
+            # Length-prefixed strings, without their padding
+            lengths = recarray.string_lengths(values)
+            text = np.ascontiguousarray(values).view(np.uint8).reshape(len(values), -1)
+            data = np.hstack([
+                lengths.astype('<i4').view(np.uint8).reshape(len(values), 4),
+                text,
+            ])
+            keep = np.hstack([
+                np.ones((len(values), 4), dtype=bool),
+                np.arange(text.shape[1]) < lengths[:, None],
+            ])
+            return data[keep].tostring(), None
+        
+        values = values.astype(dtype)
+        statistics = pt.Statistics(null_count=0)
+        finite = values[~np.isnan(values)] if values.dtype.kind == 'f' else values
+        if len(finite):
+            statistics.min_value = finite.min().tostring()
+            statistics.max_value = finite.max().tostring()
+        
+        return values.tostring(), statistics
+    
+    def _header(self):
+        """\
+        Return the leading 'PAR1' magic.
+        """
+        self._file_offset = 4
+        return b'PAR1'
+    
+    def _encode(self, data):
+        """\
+        Return a row group with the records in `data`.
+        """
+        pt = parquet_thrift()
+        records = np.frombuffer(data, dtype=self._dtype)
+        
+        chunks = []
+        columns = []
+        for i, c in enumerate(self._description):
+            name, type_ = str(c[0]), c[1]
+            rows = max(8, self._PAGE_LENGTH // self._dtype[name].itemsize // 8 * 8)
+            
+            start = self._file_offset + sum(len(chunk) for chunk in chunks)
+            length = 0
+            statistics = []
+            for first in range(0, len(records), rows):
+                values, stats = self._plain(records[name][first:first+rows], type_)
+                header = _serialize_struct(pt.PageHeader(
+                    type=pt.PageType.DATA_PAGE,
+                    uncompressed_page_size=len(values),
+                    compressed_page_size=len(values),
+                    data_page_header=pt.DataPageHeader(
+                        num_values=min(rows, len(records) - first),
+                        encoding=pt.Encoding.PLAIN,
+                        definition_level_encoding=pt.Encoding.RLE,
+                        repetition_level_encoding=pt.Encoding.RLE,
+                        statistics=stats,
+                    ),
+                ))
+                chunks.extend([header, values])
+                length += len(header) + len(values)
+                statistics.append(stats)
+            
+            columns.append(pt.ColumnChunk(
+                file_offset=start,
+                meta_data=pt.ColumnMetaData(
+                    type=self._schema[i+1].type,
+                    encodings=[pt.Encoding.PLAIN, pt.Encoding.RLE],
+                    path_in_schema=[c[0]],
+                    codec=pt.CompressionCodec.UNCOMPRESSED,
+                    num_values=len(records),
+                    total_uncompressed_size=length,
+                    total_compressed_size=length,
+                    data_page_offset=start,
+                    statistics=self._merge_statistics(statistics, type_),
+                ),
+            ))
+        
+        size = sum(len(chunk) for chunk in chunks)
+        self._row_groups.append(pt.RowGroup(
+            columns=columns,
+            total_byte_size=size,
+            num_rows=len(records),
+            file_offset=self._file_offset,
+            total_compressed_size=size,
+            ordinal=len(self._row_groups) if len(self._row_groups) < 2**15 else None,
+        ))
+        self._num_rows += len(records)
+        self._file_offset += size
+        
+        return b''.join(chunks)
+    
+    def _merge_statistics(self, statistics, type_):
+        """\
+        Return the statistics of a column chunk from those of its pages.
+        """
+        if not statistics or any(s is None for s in statistics):
+            return None
+        
+        pt = parquet_thrift()
+        dtype = np.dtype(self._type[type_][1])
+        bounds = [s for s in statistics if s.min_value is not None]
+        merged = pt.Statistics(null_count=0)
+        if bounds:
+            merged.min_value = min(
+                np.frombuffer(s.min_value, dtype=dtype)[0] for s in bounds
+            ).tostring()
+            merged.max_value = max(
+                np.frombuffer(s.max_value, dtype=dtype)[0] for s in bounds
+            ).tostring()
+        
+        return merged
+    
+    def _footer(self):
+        """\
+        Return the FileMetaData with all the row groups.
+        """
+        pt = parquet_thrift()
+        fmd = pt.FileMetaData(
+            version=1,
+            schema=self._schema,
+            num_rows=self._num_rows,
+            row_groups=self._row_groups,
+            key_value_metadata=[pt.KeyValue('comments', self._comments)] if self._comments else None,
+            created_by='cosmohub',
+            column_orders=[
+                pt.ColumnOrder(TYPE_ORDER=pt.TypeDefinedOrder())
+                for _ in self._description
+            ],
+        )
+        
+        return _serialize(fmd)
 
 class ParquetFile(BaseFormat):
     """\
     Load header and footer from custom reader.
     """
     
+    layout = 'parquet'
+    
+    # Each part file has its own footer
+    concatenable = False
+    
+    transcoders = {
+        'recarray' : RecArrayParquetTranscoder,
+    }
+    
     compression_config = textwrap.dedent(
         """\
         SET hive.exec.compress.output=false;
@@ -34,28 +241,222 @@ class ParquetFile(BaseFormat):
         super(ParquetFile, self).__init__(fd, description)
         
         self._header = b'PAR1'
-        fmd = fd._filemetadata # FIXME: Refactor
-
-        # Rename columns
-        colname_map = {}
-        for i, column in enumerate(description):
-            colname_map['_col' + str(i)] = column[0]
-
-        for el in fmd.schema:
-            if el.name in colname_map:
-                el.name = colname_map[el.name]
-
-        for rg in fmd.row_groups:
-            for c in rg.columns:
-                if c.meta_data.path_in_schema[0] in colname_map:
-                    c.meta_data.path_in_schema[0] = colname_map[c.meta_data.path_in_schema[0]]
-
-        # Add comment
-        fmd.key_value_metadata.append(parquet_thrift.KeyValue('comments', comments))
-
-        # Serialize footer
-        tmem = TMemoryBuffer()
-        tprot = TCompactProtocol(tmem)
-        fmd.write(tprot)
-        self._footer = tmem.getvalue()
-        self._footer += struct.pack('<i', len(self._footer)) + b'PAR1'
+        self._filemetadata = _patch_filemetadata(fd.filemetadata, description, comments)
+        
+        # Rewritten offset indexes go right before the FileMetaData
+        self._footer = fd.page_indexes + _serialize(self._filemetadata)
+    
+    @property
+    def filemetadata(self):
+        """\
+        Return the FileMetaData of the file being served.
+        """
+        return self._filemetadata
+
+class ParquetDataset(object):
+    """\
+    Present the part files read by HDFSParquetReader as a Parquet dataset.
+    
+    Each part is served on its own, as a Parquet file with its original offsets,
+    and the dataset is completed with the `_metadata` and `_common_metadata`
+    summary files, so readers can plan over all the row groups at once.
+    """
+    
+    suffix = '.parquet'
+    
+    def __init__(self, fd, description, comments):
+        """\
+        :param fd: reader providing the FileMetaData of every part file
+        :type fd: HDFSParquetReader
+        :param description: Set of fields and types constituting the records
+        :type description: Cursor.description
+        :param comments: Comments to be stored in the key-value metadata
+        :type comments: str
+        """
+        self._description = description
+        self._comments = comments
+        self._parts = collections.OrderedDict(
+            (part['name'] + self.suffix, part) for part in fd.parts
+        )
+        
+        # Summary files are only built once, as listing the dataset needs them
+        self._metadata = None
+        self._common_metadata = None
+    
+    def part(self, name):
+        """\
+        Return the name of the part file served as `name`, or None.
+        """
+        if name in self._parts:
+            return self._parts[name]['name']
+    
+    def files(self):
+        """\
+        Return the name and size of every file in the dataset.
+        """
+        files = [
+            ('_metadata', len(self.metadata())),
+            ('_common_metadata', len(self.common_metadata())),
+        ]
+        for name, part in self._parts.items():
+            fmd = copy.deepcopy(part['filemetadata'])
+            _renumber(fmd)
+            fmd = _patch_filemetadata(fmd, self._description, self._comments)
+            files.append((name, 4 + part['length'] + len(_serialize(fmd))))
+        
+        return files
+    
+    def metadata(self):
+        """\
+        Return the contents of the `_metadata` file, with all the row groups.
+        """
+        if self._metadata is not None:
+            return self._metadata
+        
+        fmd = None
+        for name, part in self._parts.items():
+            row_groups = copy.deepcopy(part['filemetadata'].row_groups)
+            for rg in row_groups:
+                for c in rg.columns:
+                    c.file_path = name
+            
+            if fmd is None:
+                fmd = copy.deepcopy(part['filemetadata'])
+                fmd.row_groups = []
+                fmd.num_rows = 0
+            
+            fmd.row_groups.extend(row_groups)
+            fmd.num_rows += part['filemetadata'].num_rows
+        
+        _renumber(fmd)
+        fmd = _patch_filemetadata(fmd, self._description, self._comments)
+        self._metadata = b'PAR1' + _serialize(fmd)
+        return self._metadata
+    
+    def common_metadata(self):
+        """\
+        Return the contents of the `_common_metadata` file, with the schema only.
+        """
+        if self._common_metadata is not None:
+            return self._common_metadata
+        
+        part = next(iter(self._parts.values()))
+        fmd = copy.deepcopy(part['filemetadata'])
+        fmd.row_groups = []
+        fmd.num_rows = 0
+        
+        fmd = _patch_filemetadata(fmd, self._description, self._comments)
+        self._common_metadata = b'PAR1' + _serialize(fmd)
+        return self._common_metadata
+
+def column_statistics(fmd):
+    """\
+    Return the minimum, maximum and null count of every column in `fmd`.
+    
+    The statistics of all the row groups are merged. Bounds are only decoded
+    for numeric and boolean columns, and are None if any row group lacks them.
+    
+    :param fmd: FileMetaData of the results
+    :type fmd: FileMetaData
+    :return: statistics of each column, in the order of the schema
+    :rtype: list of dict
+    """
+    pt = parquet_thrift()
+    dtypes = {
+        pt.Type.BOOLEAN : '?',
+        pt.Type.INT32   : '<i4',
+        pt.Type.INT64   : '<i8',
+        pt.Type.FLOAT   : '<f4',
+        pt.Type.DOUBLE  : '<f8',
+    }
+    
+    def decode(value, type_):
+        if value is None or type_ not in dtypes:
+            return None
+        value = np.frombuffer(value, dtype=dtypes[type_])[0].item()
+        if isinstance(value, float) and not np.isfinite(value):
+            return None
+        return value
+    
+    leaves = [el for el in fmd.schema[1:] if not el.num_children]
+    statistics = [
+        {'min' : None, 'max' : None, 'nulls' : 0}
+        for _ in leaves
+    ]
+    
+    for i, rg in enumerate(fmd.row_groups):
+        for el, column, summary in zip(leaves, rg.columns, statistics):
+            meta = column.meta_data
+            stats = meta.statistics or pt.Statistics()
+            
+            # Required columns cannot hold nulls, even without statistics
+            if el.repetition_type == pt.FieldRepetitionType.REQUIRED:
+                pass
+            elif summary['nulls'] is not None:
+                if stats.null_count is None:
+                    summary['nulls'] = None
+                else:
+                    summary['nulls'] += stats.null_count
+            
+            min_value = stats.min_value if stats.min_value is not None else stats.min
+            max_value = stats.max_value if stats.max_value is not None else stats.max
+            min_value = decode(min_value, meta.type)
+            max_value = decode(max_value, meta.type)
+            
+            if i == 0:
+                summary['min'], summary['max'] = min_value, max_value
+            elif None in (min_value, max_value, summary['min'], summary['max']):
+                summary['min'], summary['max'] = None, None
+            else:
+                summary['min'] = min(summary['min'], min_value)
+                summary['max'] = max(summary['max'], max_value)
+    
+    return statistics
+
+def _patch_filemetadata(fmd, description, comments):
+    """\
+    Rename the columns of `fmd` after `description` and attach the comments.
+    """
+    colname_map = {}
+    for i, column in enumerate(description):
+        colname_map['_col' + str(i)] = column[0]
+    
+    for el in fmd.schema:
+        if el.name in colname_map:
+            el.name = colname_map[el.name]
+    
+    for rg in fmd.row_groups:
+        for c in rg.columns:
+            if c.meta_data.path_in_schema[0] in colname_map:
+                c.meta_data.path_in_schema[0] = colname_map[c.meta_data.path_in_schema[0]]
+    
+    if not fmd.key_value_metadata:
+        fmd.key_value_metadata = []
+    fmd.key_value_metadata.append(parquet_thrift().KeyValue('comments', comments))
+    
+    return fmd
+
+def _renumber(fmd):
+    """\
+    Number the row groups of `fmd` in order, as HDFSParquetReader does.
+    """
+    for i, rg in enumerate(fmd.row_groups):
+        rg.ordinal = i if i < 2**15 else None
+
+def _serialize_struct(obj):
+    """\
+    Serialize a Thrift struct with the compact protocol.
+    """
+    tmem = TMemoryBuffer()
+    tprot = TCompactProtocol(tmem)
+    obj.write(tprot)
+    
+    return tmem.getvalue()
+
+def _serialize(fmd):
+    """\
+    Serialize `fmd` followed by its length and the trailing 'PAR1' magic.
+    """
+    footer = _serialize_struct(fmd)
+    
+    return footer + struct.pack('<i', len(footer)) + b'PAR1'
@@ -0,0 +1,247 @@
+"""\
+Wrap an existing stream of record array data into a VOTable BINARY2 envelope.
+"""
+
+from __future__ import absolute_import
+
+import base64
+import io
+import numpy as np
+import re
+import textwrap
+
+from xml.sax.saxutils import escape, quoteattr
+
+from .base import BaseFormat
+
+class Binary2Stream(io.RawIOBase):
+    """\
+    Present a stream of fixed-width records as base64-encoded BINARY2 rows.
+
+    Every record is prefixed with its null flags (all clear, as the record
+    array serialization has no notion of nulls) and the resulting byte stream
+    is encoded in base64 on the fly. Positions in the encoded stream are mapped
+    back to whole records, so the stream remains seekable.
+    """
+
+    def __init__(self, fd, record_length, num_fields):
+        """\
+        :param fd: readable and seekable stream of fixed-width records
+        :type fd: file object
+        :param record_length: length in bytes of each record
+        :type record_length: int
+        :param num_fields: number of fields in each record
+        :type num_fields: int
+        """
+        self._fd = fd
+        self._record_length = record_length
+        self._flags_length = (num_fields + 7) // 8
+        self._row_length = self._flags_length + self._record_length
+
+        pos = self._fd.tell()
+        self._rows = self._fd.seek(0, io.SEEK_END) // self._record_length
+        self._fd.seek(pos)
+
+        self._binary_length = self._rows * self._row_length
+        self._length = 4 * ((self._binary_length + 2) // 3)
+        self._position = 0
+
+    @property
+    def rows(self):
+        """\
+        Return the number of records in the stream.
+        """
+        return self._rows
+
+    def _read_records(self, start, stop):
+        """\
+        Read records [start, stop) from the underlying stream.
+        """
+        length = (stop - start) * self._record_length
+
+        if self._fd.tell() != start * self._record_length:
+            self._fd.seek(start * self._record_length)
+
+        chunks = []
+        while length > 0:
+            chunk = self._fd.read(length)
+            if not chunk:
+                raise IOError('Unexpected end of record array stream')
+            chunks.append(chunk)
+            length -= len(chunk)
+
+        return b''.join(chunks)
+
+    def _read_binary(self, start, stop):
+        """\
+        Return the BINARY2 bytes [start, stop), before base64 encoding.
+        """
+        first = start // self._row_length
+        last = (stop + self._row_length - 1) // self._row_length
+
+        records = np.frombuffer(
+            self._read_records(first, last), dtype=np.uint8
+        ).reshape(last - first, self._record_length)
+
+        rows = np.zeros((last - first, self._row_length), dtype=np.uint8)
+        rows[:, self._flags_length:] = records
+
+        offset = first * self._row_length
+        return rows.tostring()[start - offset:stop - offset]
+
+    def readinto(self, b):
+        """\
+        Read up to len(b) bytes into b.
+
+        Returns number of bytes read (0 for EOF), or None if the object
+        is set not to block and has no data to read.
+        """
+        if self._position >= self._length:
+            return 0
+
+        # Each group of 4 encoded chars maps to 3 aligned binary bytes
+        first = self._position // 4
+        last = min(
+            (self._position + len(b) + 3) // 4,
+            self._length // 4
+        )
+        binary = self._read_binary(3 * first, min(3 * last, self._binary_length))
+
+        skip = self._position - 4 * first
+        chunk = base64.b64encode(binary)[skip:skip+len(b)]
+
+        n = len(chunk)
+        self._position += n
+
+        # Return the data read
+        try:
+            b[:n] = chunk
+        except TypeError as err:
+            import array
+            if not isinstance(b, array.array):
+                raise err
+            b[:n] = array.array(b'b', chunk)
+
+        return n
+
+    def seek(self, pos, whence=0):
+        """\
+        Change stream position.
+
+        Change the stream position to byte offset pos. Argument pos is
+        interpreted relative to the position indicated by whence.  Values
+        for whence are:
+
+        * 0 -- start of stream (the default); offset should be zero or positive
+        * 1 -- current stream position; offset may be negative
+        * 2 -- end of stream; offset is usually negative
+
+        Return the new absolute position.
+        """
+        if self.closed:
+            raise ValueError("seek on closed file")
+        try:
+            pos.__index__
+        except AttributeError:
+            raise TypeError("an integer is required")
+        if not (0 <= whence <= 2):
+            raise ValueError("invalid whence")
+
+        self._position = {
+            0: max(0, pos),
+            1: min(self._length, max(0, self._position + pos)),
+            2: min(self._length, self._length + pos)
+        }[whence]
+
+        return self._position
+
+    def readable(self):
+        """\
+        Return True if the stream can be read from. If False, `read()` will
+        raise IOError.
+        """
+        return True
+
+    def seekable(self):
+        """\
+        Return True if the stream supports random access. If False, `seek()`,
+        `tell()` and `truncate()` will raise IOError.
+        """
+        return True
+
+class VOTableFile(BaseFormat):
+    """\
+    Wrap an existing stream of record array data into a VOTable BINARY2 envelope.
+    """
+
+    layout = 'recarray'
+
+    compression_config = textwrap.dedent(
+        """\
+        SET hive.exec.compress.output=false;
+        SET mapreduce.output.fileoutputformat.compress=false;
+        SET hive.merge.tezfiles=false;
+        """
+    )
+    row_format = textwrap.dedent(
+        """\
+        ROW FORMAT SERDE 'es.pic.astro.hadoop.serde.RecArraySerDe'
+        STORED AS
+            INPUTFORMAT 'es.pic.astro.hadoop.io.BinaryOutputFormat'
+            OUTPUTFORMAT 'es.pic.astro.hadoop.io.BinaryOutputFormat'
+        """
+    )
+
+    # VOTable datatype and width in bytes of each field in the record array
+    _datatype = {
+        'BIGINT_TYPE'    : ('long', 8),
+        'BOOLEAN_TYPE'   : ('boolean', 1),
+        'CHAR_TYPE'      : ('char', 255),
+        'DATE_TYPE'      : ('long', 8),
+        'DOUBLE_TYPE'    : ('double', 8),
+        'FLOAT_TYPE'     : ('float', 4),
+        'INT_TYPE'       : ('int', 4),
+        'SMALLINT_TYPE'  : ('short', 2),
+        'STRING_TYPE'    : ('char', 255),
+        'TIMESTAMP_TYPE' : ('long', 8),
+        'TINYINT_TYPE'   : ('unsignedByte', 1),
+        'VARCHAR_TYPE'   : ('char', 255),
+    }
+
+    _non_xml_re = re.compile(u'[^\t\n\r\u0020-\ud7ff\ue000-\ufffd]+')
+
+    def __init__(self, fd, description, comments):
+        """\
+        Build the VOTable header and footer
+        """
+        fields = [(c[0], ) + self._datatype[c[1]] for c in description]
+        record_length = sum(f[2] for f in fields)
+
+        stream = Binary2Stream(fd, record_length, len(fields))
+
+        super(VOTableFile, self).__init__(stream, description)
+
+        if isinstance(comments, str):
+            comments = comments.decode('utf8')
+        comments = self._non_xml_re.sub(u'', comments)
+
+        header = [
+            u'<?xml version="1.0" encoding="UTF-8"?>',
+            u'<VOTABLE version="1.3" xmlns="http://www.ivoa.net/xml/VOTable/v1.3">',
+            u'<RESOURCE type="results">',
+            u'<DESCRIPTION>{0}</DESCRIPTION>'.format(escape(comments.strip())),
+            u'<TABLE nrows="{0}">'.format(stream.rows),
+        ]
+        for name, datatype, width in fields:
+            if datatype == 'char':
+                header.append(u'<FIELD name={0} datatype="char" arraysize="{1}"/>'.format(
+                    quoteattr(name), width
+                ))
+            else:
+                header.append(u'<FIELD name={0} datatype="{1}"/>'.format(
+                    quoteattr(name), datatype
+                ))
+        header.append(u'<DATA><BINARY2><STREAM encoding="base64">')
+
+        self._header = u'\n'.join(header).encode('utf8')
+        self._footer = b'</STREAM></BINARY2></DATA>\n</TABLE>\n</RESOURCE>\n</VOTABLE>\n'
@@ -0,0 +1,749 @@
+"""\
+Decode previews and samples of stored query results, without running any job.
+"""
+import bz2
+import datetime
+import gevent.pool
+import io
+import numpy as np
+import random
+import struct
+import zlib
+
+from thriftpy2.http import TFileObjectTransport
+from thriftpy2.protocol import TCompactProtocol
+
+from . import recarray
+from .thrift import parquet_thrift
+
+# Maximum amount of stored data to read to decode a preview
+MAX_READ_LENGTH = 64*1024*1024
+
+# Length of each read, while looking for enough rows
+_READ_LENGTH = 1024*1024
+
+# Maximum amount of stored data to read to draw a sample
+MAX_SAMPLE_LENGTH = 512*1024*1024
+
+# Maximum number of ranges read to draw a sample of records
+MAX_SAMPLE_READS = 1024
+
+# Records in each block read to draw a sample, for every record sampled from it
+_SAMPLE_OVERSAMPLING = 16
+
+# Number of concurrent reads while drawing a sample
+_CONCURRENCY = 8
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+_JULIAN_EPOCH = 2440588
+
+# Units of the dates and timestamps stored by RecArraySerDe, since the epoch
+_RECARRAY_DATE_UNIT = datetime.timedelta(days=1)
+_RECARRAY_TIMESTAMP_UNIT = datetime.timedelta(milliseconds=1)
+
+_integer_types = ('BIGINT_TYPE', 'INT_TYPE', 'SMALLINT_TYPE', 'TINYINT_TYPE')
+_float_types = ('DOUBLE_TYPE', 'FLOAT_TYPE')
+
+class PreviewError(ValueError):
+    """\
+    The stored results cannot be decoded.
+    """
+
+class SampleError(PreviewError):
+    """\
+    The sample requested cannot be drawn within the limits on reads.
+    """
+
+def _from_epoch(value, unit):
+    """\
+    Return the datetime `value` units after the epoch, or None if out of range.
+    """
+    try:
+        return _EPOCH + value * unit
+    except OverflowError:
+        return None
+
+def _recarray_columns(records, description):
+    """\
+    Return the values of every column of a record array.
+    
+    Dates and timestamps are formatted as Hive does, as they are in previews
+    of Parquet and text results.
+    """
+    columns = []
+    for name, type_ in ((str(c[0]), c[1]) for c in description):
+        if type_ == 'BOOLEAN_TYPE':
+            values = (records[name] == b'T').tolist()
+        elif type_ == 'DATE_TYPE':
+            values = [_from_epoch(v, _RECARRAY_DATE_UNIT) for v in records[name].tolist()]
+            values = [v and v.date().isoformat() for v in values]
+        elif type_ == 'TIMESTAMP_TYPE':
+            values = [_from_epoch(v, _RECARRAY_TIMESTAMP_UNIT) for v in records[name].tolist()]
+            values = [v and v.isoformat(' ') for v in values]
+        elif type_ in recarray.string_types:
+            values = [
+                value.rstrip(b' ').decode('utf8', 'replace')
+                for value in records[name].tolist()
+            ]
+        else:
+            values = records[name].tolist()
+        columns.append(values)
+    
+    return columns
+
+def preview_recarray(fd, description, rows):
+    """\
+    Return the first `rows` records of a record array stream, as columns.
+    
+    :param fd: readable record array stream
+    :type fd: file object
+    :param description: Set of fields and types constituting the records
+    :type description: Cursor.description
+    :param rows: maximum number of rows to return
+    :type rows: int
+    :return: values of each column, and whether there are more rows
+    :rtype: tuple(list, bool)
+    """
+    dtype = recarray.dtype(description)
+    length = min(rows * dtype.itemsize, MAX_READ_LENGTH // dtype.itemsize * dtype.itemsize)
+    
+    chunks = []
+    size = 0
+    while size < length:
+        chunk = fd.read(length - size)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        size += len(chunk)
+    
+    data = b''.join(chunks)
+    records = np.frombuffer(data[:len(data) - len(data) % dtype.itemsize], dtype=dtype)
+    
+    limited = bool(fd.read(1))
+    
+    return _recarray_columns(records, description), limited
+
+def _parse_text(value, type_):
+    """\
+    Convert a field of delimited text, as written by Hive, to its value.
+    """
+    if value == b'\\N':
+        return None
+    
+    if type_ in _integer_types:
+        return int(value)
+    
+    if type_ in _float_types:
+        return float(value)
+    
+    if type_ == 'BOOLEAN_TYPE':
+        return value == b'true'
+    
+    return value.decode('utf8', 'replace')
+
+def preview_text(fd, description, rows, delimiter=b','):
+    """\
+    Return the first `rows` lines of a bzip2-compressed text stream, as columns.
+    
+    The stream may hold several concatenated bzip2 streams, such as one for each
+    file of the results, which are decompressed one after the other.
+    
+    :param fd: readable stream of bzip2-compressed delimited text
+    :type fd: file object
+    :param description: Set of fields and types constituting the records
+    :type description: Cursor.description
+    :param rows: maximum number of rows to return
+    :type rows: int
+    :return: values of each column, and whether there are more rows
+    :rtype: tuple(list, bool)
+    """
+    decompressor = bz2.BZ2Decompressor()
+    text = b''
+    read = 0
+    finished = False
+    
+    # One more line than requested tells whether the results are limited
+    while text.count(b'\n') <= rows and read < MAX_READ_LENGTH:
+        chunk = fd.read(_READ_LENGTH)
+        if not chunk:
+            finished = True
+            break
+        read += len(chunk)
+        
+        while chunk:
+            try:
+                text += decompressor.decompress(chunk)
+            except EOFError:
+                decompressor = bz2.BZ2Decompressor()
+                continue
+            
+            chunk = decompressor.unused_data
+            if chunk:
+                decompressor = bz2.BZ2Decompressor()
+    
+    # The last line may be incomplete, unless the whole stream was read
+    lines = text.split(b'\n')
+    if not finished:
+        lines.pop()
+    lines = [line for line in lines if line]
+    
+    limited = len(lines) > rows or not finished
+    lines = lines[:rows]
+    
+    types = [c[1] for c in description]
+    columns = [[] for _ in types]
+    for line in lines:
+        fields = line.split(delimiter)
+        if len(fields) != len(types):
+            raise PreviewError('Unexpected number of fields in stored results')
+        
+        for column, value, type_ in zip(columns, fields, types):
+            column.append(_parse_text(value, type_))
+    
+    return columns, limited
+
+def _varint(data, pos):
+    """\
+    Decode an unsigned LEB128 integer from `data` at `pos`.
+    """
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        shift += 7
+        if not byte & 0x80:
+            return value, pos
+
+def _snappy_decompress(data):
+    """\
+    Decompress a raw Snappy block.
+    """
+    data = bytearray(data)
+    length, pos = _varint(data, 0)
+    
+    out = bytearray()
+    while pos < len(data):
+        tag = data[pos]
+        pos += 1
+        
+        if tag & 3 == 0:
+            n = tag >> 2
+            if n >= 60:
+                extra = n - 59
+                n = sum(data[pos + i] << (8 * i) for i in range(extra))
+                pos += extra
+            n += 1
+            out += data[pos:pos+n]
+            pos += n
+            continue
+        
+        if tag & 3 == 1:
+            n = ((tag >> 2) & 7) + 4
+            offset = ((tag >> 5) << 8) | data[pos]
+            pos += 1
+        elif tag & 3 == 2:
+            n = (tag >> 2) + 1
+            offset = data[pos] | (data[pos+1] << 8)
+            pos += 2
+        else:
+            n = (tag >> 2) + 1
+            offset = struct.unpack('<I', bytes(data[pos:pos+4]))[0]
+            pos += 4
+        
+        if not 0 < offset <= len(out):
+            raise PreviewError('Corrupt Snappy data')
+        
+        # Copies may overlap the data they produce
+        start = len(out) - offset
+        while n > 0:
+            chunk = out[start:start+min(n, offset)]
+            out += chunk
+            start += len(chunk)
+            n -= len(chunk)
+    
+    if len(out) != length:
+        raise PreviewError('Corrupt Snappy data')
+    
+    return bytes(out)
+
+def _decompress(data, codec):
+    """\
+    Decompress a Parquet page compressed with `codec`.
+    """
+    pt = parquet_thrift()
+    
+    if codec == pt.CompressionCodec.UNCOMPRESSED:
+        return data
+    if codec == pt.CompressionCodec.SNAPPY:
+        return _snappy_decompress(data)
+    if codec == pt.CompressionCodec.GZIP:
+        return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+    
+    raise PreviewError('Unsupported Parquet compression codec')
+
+def _unpack_bits(data, bit_width, count):
+    """\
+    Unpack `count` integers of `bit_width` bits, least significant bit first.
+    """
+    if not bit_width:
+        return np.zeros(count, dtype=np.int64)
+    
+    bits = np.unpackbits(np.frombuffer(data, dtype=np.uint8)).reshape(-1, 8)[:, ::-1]
+    bits = bits.ravel()[:count * bit_width].reshape(count, bit_width)
+    
+    return bits.dot(1 << np.arange(bit_width, dtype=np.int64))
+
+def _rle_hybrid(data, pos, bit_width, count):
+    """\
+    Decode `count` integers in the RLE/bit-packing hybrid encoding.
+    """
+    data = bytearray(data)
+    byte_width = (bit_width + 7) // 8
+    
+    runs = []
+    decoded = 0
+    while decoded < count and pos < len(data):
+        header, pos = _varint(data, pos)
+        if header & 1:
+            n = 8 * (header >> 1)
+            length = (header >> 1) * bit_width
+            runs.append(_unpack_bits(bytes(data[pos:pos+length]), bit_width, n))
+            pos += length
+        else:
+            n = header >> 1
+            value = sum(data[pos + i] << (8 * i) for i in range(byte_width))
+            runs.append(np.full(n, value, dtype=np.int64))
+            pos += byte_width
+        decoded += n
+    
+    return np.concatenate(runs or [np.zeros(0, dtype=np.int64)])[:count]
+
+def _plain(data, element, count):
+    """\
+    Decode `count` PLAIN encoded values of the column described by `element`.
+    """
+    pt = parquet_thrift()
+    
+    if element.type == pt.Type.BOOLEAN:
+        return _unpack_bits(data, 1, count).astype(bool)
+    
+    dtypes = {
+        pt.Type.INT32  : '<i4',
+        pt.Type.INT64  : '<i8',
+        pt.Type.FLOAT  : '<f4',
+        pt.Type.DOUBLE : '<f8',
+        pt.Type.INT96  : [('nanoseconds', '<i8'), ('day', '<i4')],
+    }
+    if element.type in dtypes:
+        dtype = np.dtype(dtypes[element.type])
+        return np.frombuffer(data[:count * dtype.itemsize], dtype=dtype)
+    
+    if element.type == pt.Type.FIXED_LEN_BYTE_ARRAY:
+        length = element.type_length
+        return np.array([data[i*length:(i+1)*length] for i in range(count)], dtype=object)
+    
+    values = []
+    pos = 0
+    for _ in range(count):
+        length = struct.unpack('<i', data[pos:pos+4])[0]
+        values.append(data[pos+4:pos+4+length])
+        pos += 4 + length
+    
+    return np.array(values, dtype=object)
+
+def _convert(values, element):
+    """\
+    Convert decoded Parquet values to the ones Hive would have returned.
+    """
+    pt = parquet_thrift()
+    
+    if element.type == pt.Type.INT96:
+        return [
+            (_EPOCH + datetime.timedelta(
+                days=int(v['day']) - _JULIAN_EPOCH,
+                microseconds=int(v['nanoseconds']) // 1000,
+            )).isoformat(' ')
+            for v in values
+        ]
+    
+    if element.converted_type == pt.ConvertedType.DATE:
+        return [(_EPOCH + datetime.timedelta(days=int(v))).date().isoformat() for v in values]
+    
+    if element.converted_type in (pt.ConvertedType.TIMESTAMP_MILLIS, pt.ConvertedType.TIMESTAMP_MICROS):
+        scale = 1000 if element.converted_type == pt.ConvertedType.TIMESTAMP_MILLIS else 1
+        return [
+            (_EPOCH + datetime.timedelta(microseconds=int(v) * scale)).isoformat(' ')
+            for v in values
+        ]
+    
+    if element.type == pt.Type.BYTE_ARRAY:
+        return [bytes(v).decode('utf8', 'replace') for v in values]
+    
+    return values.tolist()
+
+class _ColumnChunkReader(object):
+    """\
+    Read the pages of a column chunk one after the other, reading only as much
+    of the part file as needed, and never more than `limit` bytes.
+    """
+    
+    def __init__(self, fd, name, meta, limit=None):
+        self._fd = fd
+        self._name = name
+        
+        self._start = meta.data_page_offset
+        if meta.dictionary_page_offset:
+            self._start = min(self._start, meta.dictionary_page_offset)
+        self._stop = self._start + meta.total_compressed_size
+        
+        self._end = self._stop
+        if limit is not None:
+            self._end = min(self._end, self._start + limit)
+        
+        self._buffer = b''
+        self._pos = 0
+    
+    def _fill(self, length):
+        """\
+        Make sure that `length` bytes after the current position are buffered,
+        as long as they are within the limit.
+        """
+        offset = self._start + len(self._buffer)
+        missing = min(self._pos + length - len(self._buffer), self._end - offset)
+        if missing <= 0:
+            return
+        
+        missing = min(max(missing, _READ_LENGTH), self._end - offset)
+        self._buffer += self._fd.read_part(self._name, offset, missing)
+    
+    @property
+    def read_length(self):
+        return len(self._buffer)
+    
+    def next_page(self):
+        """\
+        Return the next page header and its data, or None at the end or if
+        the page does not fit in the limit.
+        """
+        if self._start + self._pos >= self._stop:
+            return None
+        
+        while True:
+            self._fill(_READ_LENGTH)
+            buf = io.BytesIO(self._buffer[self._pos:])
+            header = parquet_thrift().PageHeader()
+            try:
+                header.read(TCompactProtocol(TFileObjectTransport(buf)))
+                break
+            except Exception:
+                if self._start + len(self._buffer) >= self._stop:
+                    raise PreviewError('Corrupt Parquet page header')
+                if self._start + len(self._buffer) >= self._end:
+                    return None
+                self._fill(len(self._buffer) - self._pos + _READ_LENGTH)
+        
+        self._pos += buf.tell()
+        self._fill(header.compressed_page_size)
+        if self._pos + header.compressed_page_size > len(self._buffer):
+            return None
+        
+        data = self._buffer[self._pos:self._pos+header.compressed_page_size]
+        self._pos += header.compressed_page_size
+        
+        return header, data
+
+def _read_column(fd, name, column, element, rows, limit=None):
+    """\
+    Decode the first `rows` values of a column chunk, or as many as can be
+    decoded reading at most `limit` bytes.
+    """
+    pt = parquet_thrift()
+    meta = column.meta_data
+    reader = _ColumnChunkReader(fd, name, meta, limit)
+    optional = element.repetition_type != pt.FieldRepetitionType.REQUIRED
+    
+    dictionary = None
+    values = []
+    decoded = 0
+    while decoded < rows:
+        page = reader.next_page()
+        if page is None:
+            break
+        header, data = page
+        
+        if header.type == pt.PageType.DICTIONARY_PAGE:
+            data = _decompress(data, meta.codec)
+            dictionary = _plain(data, element, header.dictionary_page_header.num_values)
+            continue
+        
+        if header.type == pt.PageType.DATA_PAGE:
+            page_header = header.data_page_header
+            data = _decompress(data, meta.codec)
+            count = page_header.num_values
+            pos = 0
+            if optional:
+                length = struct.unpack('<i', data[:4])[0]
+                defined = _rle_hybrid(data[4:4+length], 0, 1, count).astype(bool)
+                pos = 4 + length
+            else:
+                defined = np.ones(count, dtype=bool)
+            data = data[pos:]
+        
+        elif header.type == pt.PageType.DATA_PAGE_V2:
+            page_header = header.data_page_header_v2
+            count = page_header.num_values
+            levels = page_header.repetition_levels_byte_length + page_header.definition_levels_byte_length
+            if optional:
+                defined = _rle_hybrid(
+                    data[page_header.repetition_levels_byte_length:levels], 0, 1, count
+                ).astype(bool)
+            else:
+                defined = np.ones(count, dtype=bool)
+            data = data[levels:]
+            if page_header.is_compressed is None or page_header.is_compressed:
+                data = _decompress(data, meta.codec)
+        
+        else:
+            continue
+        
+        # Only the values needed are decoded
+        count = min(count, rows - decoded)
+        defined = defined[:count]
+        present = int(defined.sum())
+        
+        if page_header.encoding in (pt.Encoding.PLAIN_DICTIONARY, pt.Encoding.RLE_DICTIONARY):
+            if dictionary is None:
+                raise PreviewError('Missing Parquet dictionary page')
+            indexes = _rle_hybrid(data, 1, bytearray(data[:1])[0], present) if present else []
+            present_values = _convert(dictionary[indexes], element) if present else []
+        elif page_header.encoding == pt.Encoding.PLAIN:
+            present_values = _convert(_plain(data, element, present), element)
+        elif page_header.encoding == pt.Encoding.RLE and element.type == pt.Type.BOOLEAN:
+            length = struct.unpack('<i', data[:4])[0]
+            present_values = _rle_hybrid(data[4:4+length], 0, 1, present).astype(bool).tolist()
+        else:
+            raise PreviewError('Unsupported Parquet encoding')
+        
+        present_values = iter(present_values)
+        values.extend(next(present_values) if d else None for d in defined)
+        decoded += count
+    
+    return values, reader.read_length
+
+def preview_parquet(fd, description, rows):
+    """\
+    Return the first `rows` rows of a Parquet dataset, as columns.
+    
+    Rows are decoded from the first row groups, reading only the pages needed
+    from each column chunk. Each chunk reads at most its share of what is left
+    of `MAX_READ_LENGTH`, and only the rows decoded in every column are kept.
+    
+    :param fd: reader providing the FileMetaData of every part file
+    :type fd: HDFSParquetReader
+    :param description: Set of fields and types constituting the records
+    :type description: Cursor.description
+    :param rows: maximum number of rows to return
+    :type rows: int
+    :return: values of each column, and whether there are more rows
+    :rtype: tuple(list, bool)
+    """
+    columns = [[] for _ in description]
+    total = sum(part['filemetadata'].num_rows for part in fd.parts)
+    read = 0
+    
+    for part in fd.parts:
+        fmd = part['filemetadata']
+        
+        elements = [el for el in fmd.schema[1:] if not el.num_children]
+        if len(elements) != len(description):
+            raise PreviewError('Unexpected number of columns in stored results')
+        
+        for rg in fmd.row_groups:
+            missing = rows - len(columns[0])
+            if missing <= 0 or not rg.num_rows:
+                continue
+            
+            limit = (MAX_READ_LENGTH - read) // len(elements)
+            if limit <= 0:
+                return columns, True
+            
+            wanted = min(missing, rg.num_rows)
+            decoded = []
+            for column, element in zip(rg.columns, elements):
+                values, length = _read_column(fd, part['name'], column, element, wanted, limit)
+                decoded.append(values)
+                read += length
+            
+            count = min(len(values) for values in decoded)
+            for values, chunk in zip(columns, decoded):
+                values.extend(chunk[:count])
+            
+            if count < wanted:
+                return columns, True
+    
+    return columns, total > len(columns[0])
+
+def _subsample(length, rows, rng):
+    """\
+    Return the sorted indexes of a uniform sample of `rows` out of `length`.
+    """
+    if rows >= length:
+        return range(length)
+    
+    return sorted(rng.sample(xrange(length), rows))
+
+def _runs(indexes, span):
+    """\
+    Group the sorted `indexes` of records by the block of `span` records they
+    fall in, each block being read at once.
+    """
+    runs = []
+    for index in indexes:
+        if runs and runs[-1][0] // span == index // span:
+            runs[-1].append(index)
+        else:
+            runs.append([index])
+    
+    return runs
+
+def sample_recarray(fd, description, rows, seed=None):
+    """\
+    Return a random sample of `rows` records of a record array stream.
+    
+    Records are sampled by strata: up to `MAX_SAMPLE_READS` random blocks of
+    consecutive records are chosen, and the sample is drawn uniformly from
+    their records. Blocks hold several records for each one sampled, within
+    `MAX_SAMPLE_LENGTH` overall, and each one is read with a single range
+    read, concurrently. Results small enough are sampled as a whole.
+    
+    :param fd: record array stream able to read ranges
+    :type fd: HDFSPathReader
+    :param description: Set of fields and types constituting the records
+    :type description: Cursor.description
+    :param rows: number of rows to sample
+    :type rows: int
+    :param seed: seed of the random generator, to draw the same sample again
+    :type seed: int
+    :return: values of each column, and the total number of rows
+    :rtype: tuple(list, int)
+    :raises SampleError: if the records sampled do not fit in `MAX_SAMPLE_LENGTH`
+    """
+    rng = random.Random(seed)
+    dtype = recarray.dtype(description)
+    length = dtype.itemsize
+    total = fd.seek(0, io.SEEK_END) // length
+    
+    rows = min(rows, total)
+    if rows * length > MAX_SAMPLE_LENGTH:
+        raise SampleError(
+            "At most {0} rows of these results can be sampled.".format(MAX_SAMPLE_LENGTH // length)
+        )
+    
+    if not rows:
+        return _recarray_columns(np.zeros(0, dtype=dtype), description), total
+    
+    reads = min(rows, MAX_SAMPLE_READS)
+    quota = -(-rows // reads)
+    block = max(quota, min(quota * _SAMPLE_OVERSAMPLING, MAX_SAMPLE_LENGTH // (reads * length)))
+    blocks = total // block
+    
+    if blocks <= reads:
+        # Every record can be read within the limits
+        indexes = _subsample(total, rows, rng)
+        runs = _runs(indexes, -(-total // reads) or 1)
+    else:
+        # Blocks are aligned at a random offset, so that any record can be
+        # sampled, and the records sampled are spread across the blocks chosen
+        offset = rng.randint(0, total - blocks * block)
+        chosen = sorted(rng.sample(xrange(blocks), reads))
+        runs = [
+            [offset + chosen[run[0] // block] * block + index % block for index in run]
+            for run in _runs(_subsample(reads * block, rows, rng), block)
+        ]
+    
+    def read(run):
+        start = run[0]
+        data = fd.read_range(start * length, (run[-1] - start + 1) * length)
+        records = np.frombuffer(data, dtype=dtype)
+        return records[[index - start for index in run]]
+    
+    pool = gevent.pool.Pool(_CONCURRENCY)
+    records = np.concatenate(list(pool.imap(read, runs)) or [np.zeros(0, dtype=dtype)])
+    
+    return _recarray_columns(records, description), total
+
+def sample_parquet(fd, description, rows, seed=None):
+    """\
+    Return a random sample of `rows` rows of a Parquet dataset.
+    
+    Random row groups are decoded concurrently, until they hold enough rows,
+    and the sample is drawn uniformly from them.
+    
+    :param fd: reader providing the FileMetaData of every part file
+    :type fd: HDFSParquetReader
+    :param description: Set of fields and types constituting the records
+    :type description: Cursor.description
+    :param rows: number of rows to sample
+    :type rows: int
+    :param seed: seed of the random generator, to draw the same sample again
+    :type seed: int
+    :return: values of each column, and the total number of rows
+    :rtype: tuple(list, int)
+    """
+    rng = random.Random(seed)
+    
+    row_groups = []
+    total = 0
+    for part in fd.parts:
+        fmd = part['filemetadata']
+        total += fmd.num_rows
+        
+        elements = [el for el in fmd.schema[1:] if not el.num_children]
+        if len(elements) != len(description):
+            raise PreviewError('Unexpected number of columns in stored results')
+        
+        row_groups.extend(
+            (part['name'], rg, elements)
+            for rg in fmd.row_groups
+            if rg.num_rows
+        )
+    rng.shuffle(row_groups)
+    
+    # Take random row groups until they hold enough rows
+    chosen = []
+    found = length = 0
+    for name, rg, elements in row_groups:
+        if found >= rows:
+            break
+        
+        size = sum(c.meta_data.total_compressed_size for c in rg.columns)
+        if chosen and length + size > MAX_SAMPLE_LENGTH:
+            break
+        
+        chosen.append((name, rg, elements))
+        found += rg.num_rows
+        length += size
+    
+    def read(task):
+        name, rg, column, element = task
+        return _read_column(fd, name, column, element, rg.num_rows)[0]
+    
+    tasks = [
+        (name, rg, column, element)
+        for name, rg, elements in chosen
+        for column, element in zip(rg.columns, elements)
+    ]
+    
+    pool = gevent.pool.Pool(_CONCURRENCY)
+    decoded = iter(pool.imap(read, tasks))
+    
+    columns = [[] for _ in description]
+    for _ in chosen:
+        for values in columns:
+            values.extend(next(decoded))
+    
+    indexes = _subsample(len(columns[0]), rows, rng)
+    columns = [[values[i] for i in indexes] for values in columns]
+    
+    return columns, total
@@ -0,0 +1,162 @@
+"""\
+Interpret the fixed-width big-endian records written by RecArraySerDe.
+"""
+import numpy as np
+
+# NumPy equivalents of the FITS binary table formats used by RecArraySerDe
+_dtype = {
+    'BIGINT_TYPE'    : '>i8',
+    'BOOLEAN_TYPE'   : 'S1',
+    'CHAR_TYPE'      : 'S255',
+    'DATE_TYPE'      : '>i8',
+    'DOUBLE_TYPE'    : '>f8',
+    'FLOAT_TYPE'     : '>f4',
+    'INT_TYPE'       : '>i4',
+    'SMALLINT_TYPE'  : '>i2',
+    'STRING_TYPE'    : 'S255',
+    'TIMESTAMP_TYPE' : '>i8',
+    'TINYINT_TYPE'   : 'u1',
+    'VARCHAR_TYPE'   : 'S255',
+}
+
+string_types = ('CHAR_TYPE', 'STRING_TYPE', 'VARCHAR_TYPE')
+
+# Position of the actual width of string columns, once recorded, after the
+# items of each field of a Cursor.description
+_WIDTH = 7
+
+def string_width(field):
+    """\
+    Return the actual width recorded for the string column `field`, or None.
+    """
+    return field[_WIDTH] if len(field) > _WIDTH else None
+
+def set_string_width(field, width):
+    """\
+    Record the actual `width` of the string column `field`, in place.
+    """
+    field[_WIDTH:] = [width]
+
+def dtype(description):
+    """\
+    Return the structured dtype of the records described by `description`.
+
+    :param description: Set of fields and types constituting the records
+    :type description: Cursor.description
+    :rtype: numpy.dtype
+    """
+    return np.dtype([
+        (str(c[0]), _dtype[c[1]])
+        for c in description
+    ])
+
+_integer_types = ('BIGINT_TYPE', 'INT_TYPE', 'SMALLINT_TYPE', 'TINYINT_TYPE')
+
+# Units of the dates and timestamps, stored as the number of them since the epoch
+_datetime_units = {
+    'DATE_TYPE'      : 'D',
+    'TIMESTAMP_TYPE' : 'ms',
+}
+
+def string_lengths(column):
+    """\
+    Return the length of each string in a column, without its padding spaces.
+
+    :param column: fixed-width strings, as stored in the records
+    :type column: numpy.ndarray
+    :rtype: numpy.ndarray
+    """
+    text = _as_bytes(column)
+    padding = np.logical_and.accumulate(text[:, ::-1] == ord(b' '), axis=1)
+    return text.shape[1] - padding.sum(axis=1)
+
+def _as_bytes(text):
+    """\
+    Return a fixed-width byte string array as a matrix with a row per value.
+    """
+    text = np.ascontiguousarray(text)
+    return text.view(np.uint8).reshape(len(text), text.dtype.itemsize)
+
+def _integers_to_text(column):
+    """\
+    Format integers in decimal, one digit of every value at a time.
+    """
+    values = column.astype(np.int64)
+    magnitude = np.abs(values).astype(np.uint64)
+    digits = len(str(int(magnitude.max())))
+
+    text = np.zeros((len(values), digits + 1), dtype=np.uint8)
+    text[:, 0] = np.where(values < 0, ord(b'-'), 0)
+    for i in range(digits, 0, -1):
+        text[:, i] = ord(b'0') + magnitude % np.uint64(10)
+        magnitude //= np.uint64(10)
+
+    # Leading zeros are padding, except for the units
+    leading = np.logical_and.accumulate(text[:, 1:-1] == ord(b'0'), axis=1)
+    text[:, 1:-1][leading] = 0
+
+    return text
+
+def _datetimes_to_text(column, unit):
+    """\
+    Format dates or timestamps counted in `unit` since the epoch as Hive does,
+    with a space before the time and without trailing zeros in its fraction.
+    """
+    values = column.astype(np.int64).view('datetime64[{0}]'.format(unit))
+    text = np.datetime_as_string(values, unit=unit)
+    if unit != 'D':
+        text = np.char.rstrip(np.char.rstrip(text, '0'), '.')
+        text = np.char.replace(text, 'T', ' ')
+    
+    return _as_bytes(text.astype(bytes))
+
+def _to_text(column, type_):
+    """\
+    Format all the values of a column as text, the same way Hive does.
+
+    The text is returned as a matrix with a row of bytes per value, padded with
+    NUL bytes to be dropped when all the columns are joined.
+    """
+    if type_ == 'BOOLEAN_TYPE':
+        return _as_bytes(np.where(column == b'T', b'true', b'false'))
+
+    if type_ in string_types:
+        text = _as_bytes(column).copy()
+        text[np.arange(text.shape[1]) >= string_lengths(column)[:, None]] = 0
+        return text
+
+    if type_ in _integer_types:
+        return _integers_to_text(column)
+
+    if type_ in _datetime_units:
+        return _datetimes_to_text(column, _datetime_units[type_])
+    
+    return _as_bytes(column.astype(bytes))
+
+def to_csv(records, description, delimiter=b','):
+    """\
+    Format a record array as lines of delimited text.
+
+    :param records: records to format
+    :type records: numpy.ndarray
+    :param description: Set of fields and types constituting the records
+    :type description: Cursor.description
+    :return: one line for each record, including the trailing newline
+    :rtype: bytes
+    """
+    if not len(records):
+        return b''
+
+    n = len(records)
+    delimiter = np.tile(np.frombuffer(delimiter, dtype=np.uint8), (n, 1))
+    newline = np.tile(np.frombuffer(b'\n', dtype=np.uint8), (n, 1))
+
+    columns = []
+    for name, type_ in ((str(c[0]), c[1]) for c in description):
+        columns.append(_to_text(records[name], type_))
+        columns.append(delimiter)
+    columns[-1] = newline
+
+    # Join all the columns side by side, and drop the padding
+    text = np.hstack(columns)
+    return text[text != 0].tostring()
@@ -0,0 +1,36 @@
+"""\
+Stream the contents of a file object through a bounded read-ahead buffer.
+"""
+import gevent
+import gevent.queue
+
+def range_iter(fd, start, stop, chunk_size, buffer_size):
+    buffer_ = gevent.queue.Queue(maxsize=buffer_size)
+    
+    def prereader():
+        while True:
+            chunk = fd.read(chunk_size)
+            if chunk:
+                buffer_.put(chunk)
+            else:
+                buffer_.put(None)
+                break
+    
+    # Streams that cannot seek are always read from the beginning to the end
+    if fd.seekable():
+        pos = fd.seek(start)
+    else:
+        pos = 0
+    
+    gevent.spawn(prereader)
+    while stop is None or pos < stop:
+        chunk = buffer_.get()
+        if chunk is None:
+            break
+        
+        if stop is not None and pos + len(chunk) > stop:
+            chunk = chunk[:stop-pos]
+        
+        pos += len(chunk)
+        
+        yield chunk
@@ -0,0 +1,21 @@
+"""\
+Load Thrift definitions on first use, as parsing them is expensive.
+"""
+import pkg_resources
+import thriftpy2
+
+_parquet_thrift = None
+
+def parquet_thrift():
+    """\
+    Return the module with the Thrift definitions of the Parquet metadata.
+    """
+    global _parquet_thrift
+    
+    if _parquet_thrift is None:
+        _parquet_thrift = thriftpy2.load(
+            pkg_resources.resource_filename('cosmohub.resources', 'parquet.thrift'),
+            module_name="parquet_thrift"
+        )
+    
+    return _parquet_thrift
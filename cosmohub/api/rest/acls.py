@@ -19,7 +19,6 @@ from sqlalchemy.sql import and_
 from cosmohub.api import (
     api_rest,
     db,
-    mail,
 )
 
 from .. import fields
@@ -155,12 +154,12 @@ class AclItem(Resource):
                         if user.acls[group].is_granted
                     ]
                     
-                    mail.send_message(
+                    session.add(model.MailMessage(
                         subject = current_app.config['MAIL_SUBJECTS']['acls_updated'],
                         recipients = [user.email],
                         body = render_template('mail/acls_updated.txt', user=user, groups=groups),
                         html = render_template('mail/acls_updated.html', user=user, groups=groups),
-                    )
+                    ))
             
             g.session['track']({
                 't' : 'event',
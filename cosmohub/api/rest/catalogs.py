@@ -74,7 +74,7 @@ class CatalogItem(Resource):
                 if not user:
                     raise http_exc.Forbidden
 
-            columns = current_app.columns.loc[catalog.relation].to_dict('records')
+            columns = current_app.columns[catalog.relation]
             data = marshal(catalog, fields.Catalog)
             data.update({'columns' : columns})
             
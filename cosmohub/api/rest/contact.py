@@ -3,7 +3,10 @@ import logging
 from flask import g
 from flask_restful import Resource, reqparse
 
-from cosmohub.api import api_rest, mail
+from cosmohub.api import api_rest, db
+
+from ..database import model
+from ..database.session import transactional_session
 
 log = logging.getLogger(__name__)
 
@@ -16,13 +19,14 @@ class Contact(Resource):
         parser.add_argument('message', required=True)
         attrs = parser.parse_args(strict=True)
         
-        mail.send_message(
-            sender = attrs['email'],
-            reply_to = attrs['email'],
-            subject = attrs['subject'],
-            recipients = ['cosmohub@pic.es'],
-            body = attrs['message'],
-        )
+        with transactional_session(db.session) as session:
+            session.add(model.MailMessage(
+                sender = attrs['email'],
+                reply_to = attrs['email'],
+                subject = attrs['subject'],
+                recipients = ['cosmohub@pic.es'],
+                body = attrs['message'],
+            ))
         
         g.session['track']({
             't' : 'event',
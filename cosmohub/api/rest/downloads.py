@@ -1,11 +1,11 @@
-import gevent.queue
+import hashlib
 import io
 import mimetypes
 import os
 import werkzeug.exceptions as http_exc
 
-from datetime import timedelta
-from flask import g, current_app, request, Response, render_template_string
+from datetime import datetime, timedelta
+from flask import g, current_app, request, Response, render_template_string, stream_with_context
 from flask_restful import Resource
 from hdfs.ext.kerberos import KerberosClient
 from sqlalchemy.orm import joinedload
@@ -16,8 +16,14 @@ from cosmohub.api import db, api_rest
 
 from ..database import model
 from ..database.session import transactional_session
-from ..security import auth_required, Privilege
+from ..security import auth_required, Privilege, Token
 from ..hadoop.hdfs import HDFSPathReader, HDFSParquetReader
+from ..io import digest, preview
+from ..io.stream import range_iter
+from ..io.format.parquet import ParquetDataset, ParquetFile
+
+# Downloads of the same query are only recorded once in this period
+_DOWNLOAD_TRACKING_PERIOD = timedelta(hours=1)
 
 def create_content_range(range_header, length):
     if not range_header:
@@ -33,28 +39,189 @@ def create_content_range(range_header, length):
 
     return range_.make_content_range(length)
 
-def range_iter(fd, start, stop, chunk_size, buffer_size):
-    buffer_ = gevent.queue.Queue(maxsize=buffer_size)
+def results_dir(client, results_id):
+    """\
+    Return the absolute location of the results stored for query `results_id`.
+    """
+    path = os.path.join(current_app.config['RESULTS_BASE_DIR'], str(results_id))
+    if not path.startswith('/'):
+        path = os.path.join(client.get_home_directory(), path)
     
-    def prereader():
-        while True:
-            chunk = fd.read(chunk_size)
-            if chunk:
-                buffer_.put(chunk)
-            else:
-                break
+    return path
+
+def results_path(client, query):
+    """\
+    Return the absolute location of the stored results of `query`.
+    
+    Queries served from the result cache share the results of the query they
+    were first computed for.
+    """
+    return results_dir(client, query.results_id or query.id)
+
+def open_query_results(client, query, format_, comments, columns=None):
+    """\
+    Return a stream with the results of `query` served in `format_`.
+    
+    Results are read in the layout they were stored with, and transcoded on the
+    fly if the requested format cannot wrap them as they are. A subset of the
+    `columns` can be requested for results stored as Parquet.
+    """
+    try:
+        format_ = current_app.formats[format_]
+    except KeyError:
+        raise http_exc.BadRequest("Unsupported format requested.")
     
-    pos = fd.seek(start)
-    gevent.spawn(prereader)
-    while pos < stop:
-        chunk = buffer_.get()
+    layout = query.layout or current_app.formats[query.format].layout
+    if not format_.can_open(layout):
+        raise http_exc.UnprocessableEntity("The results of this query cannot be served in the requested format.")
+    
+    path = results_path(client, query)
+    
+    if columns is not None:
+        if layout != 'parquet' or format_.layout != layout:
+            raise http_exc.UnprocessableEntity("Columns can only be selected for Parquet results.")
+        
+        names = [c[0] for c in query.schema]
+        try:
+            columns = [
+                '_col{0}'.format(names.index(name))
+                for name in columns
+            ]
+        except ValueError:
+            raise http_exc.BadRequest("Unknown column requested.")
         
-        if pos + len(chunk) > stop:
-            chunk = chunk[:stop-pos]
+        if not columns:
+            raise http_exc.BadRequest("At least one column must be requested.")
+    
+    if layout == 'parquet':
+        reader = HDFSParquetReader(client, path, columns=columns)
+    else:
+        reader = HDFSPathReader(client, path)
+    
+    return format_.open(reader, layout, query.schema, comments)
+
+def dataset_parts(client, query, comments):
+    """\
+    Yield the name of every part file served in the Parquet dataset of
+    `query`, with a stream of it.
+    """
+    path = results_path(client, query)
+    for name, entry in client.list(path, status=True):
+        if entry['type'] != 'FILE' or entry['length'] == 0:
+            continue
         
-        pos += len(chunk)
+        yield name + ParquetDataset.suffix, _open_part_file(client, path, name, query, comments)
+
+def _open_part_file(client, path, name, query, comments):
+    """\
+    Return a stream of the part file `name` of the Parquet results in `path`.
+    """
+    return ParquetFile(
+        HDFSParquetReader(client, os.path.join(path, name)),
+        query.schema,
+        comments
+    )
+
+def _store_digests(query, key, comments, length, digests):
+    """\
+    Store in `query` the `digests` of the file served as `key`, `length` bytes
+    long, along with the others already known for that same file.
+    """
+    stored = dict(query.digests or {})
+    entry = stored.get(key)
+    if entry and entry['length'] == length and entry['comments'] == comments:
+        digests = dict(entry['digests'], **digests)
+    
+    stored[key] = {
+        'length' : length,
+        'comments' : comments,
+        'digests' : digests,
+    }
+    query.digests = stored
+
+def record_crc32c(query, comments, key, data):
+    """\
+    Store in `query` the CRC32C of `data`, served as `key`, if it can be
+    combined from the checksums computed by HDFS.
+    
+    It is recorded once, when the results are inspected, so that downloads can
+    announce it without asking HDFS for the checksum of every file again.
+    """
+    if not data.seekable() or not hasattr(data, 'crc32c'):
+        return
+    
+    crc = data.crc32c()
+    if crc is None:
+        return
+    
+    _store_digests(
+        query, key, hashlib.md5(comments.encode('utf8')).hexdigest(),
+        data.seek(0, io.SEEK_END), {'crc32c' : digest.encode_crc32c(crc)},
+    )
+
+class ResultDigests(object):
+    """\
+    Digests of one of the files served from the results of a query.
+    
+    The SHA-256 is computed while the file is first downloaded whole, and the
+    CRC32C when the results are inspected. Both are stored along with the
+    query, so that later downloads can announce them without reading the
+    results again.
+    """
+    
+    def __init__(self, query, comments, key):
+        """\
+        :param query: query whose results are served
+        :type query: model.Query
+        :param comments: comments embedded in the file
+        :type comments: str
+        :param key: format or name of the file served
+        :type key: str
+        """
+        self._query_id = query.id
+        self._key = key
+        self._comments = hashlib.md5(comments.encode('utf8')).hexdigest()
+        self._stored = (query.digests or {}).get(key)
+    
+    def get(self, length):
+        """\
+        Return the stored digests, if they match a file of `length` bytes.
+        """
+        entry = self._stored
+        if not entry or entry['length'] != length or entry['comments'] != self._comments:
+            return {}
         
-        yield chunk
+        return entry['digests']
+    
+    def length(self):
+        """\
+        Return the stored length of the file, or None if it is still unknown.
+        
+        Files transcoded on the fly only know their length once they have been
+        downloaded whole.
+        """
+        entry = self._stored
+        if not entry or entry['comments'] != self._comments:
+            return None
+        
+        return entry['length']
+    
+    def save(self, length, digests):
+        """\
+        Store the `digests` of a file of `length` bytes.
+        
+        The size of the query is also recorded the first time its results are
+        stored in its own format.
+        """
+        with transactional_session(db.session) as session:
+            query = session.query(model.Query).filter_by(
+                id=self._query_id
+            ).with_for_update().one()
+            
+            _store_digests(query, self._key, self._comments, length, digests)
+            
+            if self._key == query.format and query.size is None:
+                query.size = length
 
 class BaseDownload(object):
     @staticmethod
@@ -73,14 +240,53 @@ class BaseDownload(object):
         )
         return client
 
-    def _build_response(self, reader, path, range_header=None):
-        content_length = reader.seek(0, io.SEEK_END)
+    def _build_response(self, reader, path, range_header=None, digests=None):
         mimetype = mimetypes.guess_type(path)
         content_type = 'application/octet-stream'
         if mimetype[0] and not mimetype[1]:
             content_type = mimetype[0]
         headers = self._headers(path)
 
+        if not reader.seekable():
+            # Transcoded on the fly, so ranges are unsupported, and the length
+            # is only known once it has been downloaded whole
+            headers.add('Accept-Ranges', 'none')
+            data = range_iter(
+                reader,
+                0,
+                None,
+                current_app.config['HADOOP_HDFS_CHUNK_SIZE'],
+                current_app.config['HADOOP_HDFS_BUFFER_SIZE']
+            )
+            
+            content_length = digests.length() if digests else None
+            values = dict(digests.get(content_length)) if content_length is not None else {}
+            if values:
+                headers.add('Repr-Digest', digest.repr_digest(values))
+            if 'sha-256' in values:
+                headers.add('Digest', 'SHA-256={0}'.format(values['sha-256']))
+            elif digests:
+                def save(length, sha256):
+                    digests.save(length, {'sha-256' : sha256})
+                
+                data = stream_with_context(digest.sha256_iter(data, content_length, save))
+            
+            response = Response(data, 200, mimetype=content_type)
+            response.content_length = content_length
+            response.headers.extend(headers)
+            
+            return response
+
+        content_length = reader.seek(0, io.SEEK_END)
+        
+        # Digests always refer to the whole file, even for partial responses
+        values = dict(digests.get(content_length)) if digests else {}
+        
+        if values:
+            headers.add('Repr-Digest', digest.repr_digest(values))
+        if 'sha-256' in values:
+            headers.add('Digest', 'SHA-256={0}'.format(values['sha-256']))
+
         if range_header:
             try:
                 content_range = create_content_range(range_header, content_length)
@@ -104,6 +310,12 @@ class BaseDownload(object):
                 current_app.config['HADOOP_HDFS_CHUNK_SIZE'],
                 current_app.config['HADOOP_HDFS_BUFFER_SIZE']
             )
+            if digests and 'sha-256' not in values:
+                def save(length, sha256):
+                    values['sha-256'] = sha256
+                    digests.save(length, values)
+                
+                data = stream_with_context(digest.sha256_iter(data, content_length, save))
             http_code = 200
 
         response = Response(data, http_code, mimetype=content_type)
@@ -222,68 +434,325 @@ class FileContentsDownload(BaseDownload, FileResource):
 
 api_rest.add_resource(FileContentsDownload, '/downloads/files/<int:id_>/contents')
 
-class QueryDownload(BaseDownload, Resource):
+class QueryResource(BaseDownload, Resource):
     decorators = [auth_required(Privilege('/user') | Privilege('/download/query'))]
 
+    @staticmethod
+    def _get_path(item):
+        return os.path.join(current_app.config['RESULTS_BASE_DIR'], str(item.id))
+
+    def _get_query(self, session, id_):
+        """\
+        Return the succeeded query `id_` along with the comments to be embedded
+        in its results, if the current user can download them.
+        """
+        query = session.query(model.Query).filter_by(
+            id=id_
+        ).one()
+
+        if model.Query.Status(query.status) != model.Query.Status.SUCCEEDED:
+            raise http_exc.UnprocessableEntity('The requested query is query is not succeeded.')
+
+        user = session.query(model.User).join(
+            'queries'
+        ).filter(
+            model.Query.id == id_,
+            model.User.id == g.session['user'].id,
+            
+        ).first()
+
+        if not user:
+            raise http_exc.Forbidden
+        
+        priv = Privilege('/user') | Privilege('/download/query/{0}'.format(id_))
+        if not priv.can(g.session['privilege']):
+            raise http_exc.Forbidden
+
+        context = {
+            'query' : query,
+            'duration' : timedelta(seconds=int((query.ts_finished-query.ts_started).total_seconds())),
+            'user' : user,
+        }
+        
+        comments = render_template_string(current_app.config['QUERY_COMMENTS'], **context)
+        
+        return query, comments
+
+    def _track_download(self, query):
+        """\
+        Record that the results of `query` have been downloaded, so that the
+        least recently downloaded results are evicted first.
+        
+        It is written outside of the current read-only transaction, and only
+        by the resources serving the results themselves, not their previews.
+        """
+        if not query.ts_downloaded or query.ts_downloaded < datetime.utcnow() - _DOWNLOAD_TRACKING_PERIOD:
+            table = model.Query.__table__
+            db.engine.execute(
+                table.update().where(
+                    table.c.id == query.id,
+                ).values(
+                    ts_downloaded=datetime.utcnow(),
+                )
+            )
+
+class QueryDownload(QueryResource):
     def _headers(self, path):
         headers = super(QueryDownload, self)._headers(path)
         headers.add('Content-Disposition', 'attachment', filename=os.path.basename(path))
         return headers
 
-    @staticmethod
-    def _get_path(item):
-        return os.path.join(current_app.config['RESULTS_BASE_DIR'], str(item.id))
-
     def get(self, id_):
         with transactional_session(db.session, read_only=True) as session:
-            query = session.query(model.Query).filter_by(
-                id=id_
-            ).one()
+            query, comments = self._get_query(session, id_)
+            self._track_download(query)
+
+            range_header = request.headers.get('Range', None)
+            format_ = request.args.get('format', query.format)
+            columns = request.args.get('columns', None)
+            if columns is not None:
+                columns = [c.strip() for c in columns.split(',') if c.strip()]
+            
+            data = open_query_results(self._create_client(), query, format_, comments, columns)
+            path = '{path}.{ext}'.format(path=self._get_path(query), ext=format_)
+            
+            # Only whole results are digested, as columns can be combined at will
+            digests = None
+            if columns is None:
+                digests = ResultDigests(query, comments, format_)
+            
+            g.session['track']({
+                't' : 'event',
+                'ec' : 'downloads',
+                'ea' : 'query_results',
+                'el' : query.id,
+            })
+            
+            return self._build_response(data, path, range_header, digests)
 
-            if model.Query.Status(query.status) != model.Query.Status.SUCCEEDED:
-                raise http_exc.UnprocessableEntity('The requested query is query is not succeeded.')
+api_rest.add_resource(QueryDownload, '/downloads/queries/<int:id_>/results')
 
-            user = session.query(model.User).join(
-                'queries'
-            ).filter(
-                model.Query.id == id_,
-                model.User.id == g.session['user'].id,
-                
-            ).first()
+class QueryDatasetResource(QueryResource):
+    def _dataset_path(self, client, query):
+        """\
+        Return the location of the Parquet results of `query`.
+        """
+        layout = query.layout or current_app.formats[query.format].layout
+        if layout != 'parquet':
+            raise http_exc.UnprocessableEntity("Only Parquet results can be served as a dataset.")
+        
+        return results_path(client, query)
+    
+    def _open_dataset(self, client, query, comments):
+        """\
+        Return the dataset of the Parquet results of `query`, reading the
+        footer of every part file.
+        """
+        reader = HDFSParquetReader(client, self._dataset_path(client, query))
+        
+        return ParquetDataset(reader, query.schema, comments)
+    
+    def _open_part(self, client, query, comments, name):
+        """\
+        Return the part file of the Parquet results of `query` served as
+        `name`, reading only its own footer.
+        """
+        path = self._dataset_path(client, query)
+        
+        part = None
+        if name.endswith(ParquetDataset.suffix):
+            part = name[:-len(ParquetDataset.suffix)]
+        
+        entries = dict(client.list(path, status=True))
+        entry = entries.get(part)
+        if not entry or entry['type'] != 'FILE' or entry['length'] == 0:
+            raise http_exc.NotFound("The requested file is not part of the dataset.")
+        
+        return _open_part_file(client, path, part, query, comments)
 
-            if not user:
-                raise http_exc.Forbidden
+class QueryDatasetManifest(QueryDatasetResource):
+    def get(self, id_):
+        with transactional_session(db.session, read_only=True) as session:
+            query, comments = self._get_query(session, id_)
+            
+            dataset = self._open_dataset(self._create_client(), query, comments)
+            
+            token = Token(
+                g.session['user'],
+                Privilege('/download/query/{0}'.format(query.id)),
+                expires_in=current_app.config['TOKEN_EXPIRES_IN']['download'],
+            )
             
-            priv = Privilege('/user') | Privilege('/download/query/{0}'.format(id_))
-            if not priv.can(g.session['privilege']):
-                raise http_exc.Forbidden
+            files = []
+            for name, size in dataset.files():
+                url = api_rest.url_for(QueryDatasetDownload, id_=query.id, name=name, auth_token=token.dump(), _external=True)
+                
+                # Summary files are built on request, parts once downloaded
+                if name == '_metadata':
+                    digests = {'sha-256' : digest.encode_sha256(dataset.metadata())}
+                elif name == '_common_metadata':
+                    digests = {'sha-256' : digest.encode_sha256(dataset.common_metadata())}
+                else:
+                    digests = ResultDigests(query, comments, 'dataset/' + name).get(size)
+                
+                files.append({
+                    'name' : name,
+                    'size' : size,
+                    'url'  : url,
+                    'digests' : digests,
+                })
+            
+            g.session['track']({
+                't' : 'event',
+                'ec' : 'downloads',
+                'ea' : 'query_dataset',
+                'el' : query.id,
+            })
+            
+            return {'files' : files}
 
-            range_header = request.headers.get('Range', None)
+api_rest.add_resource(QueryDatasetManifest, '/downloads/queries/<int:id_>/dataset')
+
+class QueryDatasetDownload(QueryDatasetResource):
+    def _headers(self, path):
+        headers = super(QueryDatasetDownload, self)._headers(path)
+        headers.add('Content-Disposition', 'attachment', filename=os.path.basename(path))
+        return headers
+
+    def get(self, id_, name):
+        with transactional_session(db.session, read_only=True) as session:
+            query, comments = self._get_query(session, id_)
+            self._track_download(query)
+            
             client = self._create_client()
-            path = self._get_path(query)
-            if query.format == 'parquet':
-                reader = HDFSParquetReader(client, path)
+            
+            # Summary files need the footer of every part, while parts are
+            # fetched in parallel and only read their own
+            if name == '_metadata':
+                data = io.BytesIO(self._open_dataset(client, query, comments).metadata())
+            elif name == '_common_metadata':
+                data = io.BytesIO(self._open_dataset(client, query, comments).common_metadata())
             else:
-                reader = HDFSPathReader(client, path)
+                data = self._open_part(client, query, comments, name)
             
-            context = {
-                'query' : query,
-                'duration' : timedelta(seconds=int((query.ts_finished-query.ts_started).total_seconds())),
-                'user' : user,
+            range_header = request.headers.get('Range', None)
+            path = os.path.join(self._get_path(query), name)
+            digests = ResultDigests(query, comments, 'dataset/' + name)
+            
+            g.session['track']({
+                't' : 'event',
+                'ec' : 'downloads',
+                'ea' : 'query_dataset_file',
+                'el' : query.id,
+            })
+            
+            return self._build_response(data, path, range_header, digests)
+
+api_rest.add_resource(QueryDatasetDownload, '/downloads/queries/<int:id_>/dataset/<name>')
+
+def _rows_arg(default, maximum, minimum=0):
+    """\
+    Return the number of `rows` requested, from `minimum` up to `maximum`.
+    """
+    try:
+        rows = int(request.args.get('rows', default))
+    except ValueError:
+        raise http_exc.BadRequest("The number of rows must be an integer.")
+    
+    if not minimum <= rows <= maximum:
+        raise http_exc.BadRequest("Between {0} and {1} rows can be requested.".format(minimum, maximum))
+    
+    return rows
+
+class QueryPreview(QueryResource):
+    # Same limit as real-time queries
+    MAX_ROWS = 10000
+
+    def get(self, id_):
+        rows = _rows_arg(100, self.MAX_ROWS)
+        
+        with transactional_session(db.session, read_only=True) as session:
+            query, _ = self._get_query(session, id_)
+            
+            client = self._create_client()
+            path = results_path(client, query)
+            
+            # Decode the first rows directly from the stored results
+            layout = query.layout or current_app.formats[query.format].layout
+            try:
+                if layout == 'parquet':
+                    columns, limited = preview.preview_parquet(HDFSParquetReader(client, path), query.schema, rows)
+                elif layout == 'recarray':
+                    columns, limited = preview.preview_recarray(HDFSPathReader(client, path), query.schema, rows)
+                elif layout == 'text':
+                    columns, limited = preview.preview_text(HDFSPathReader(client, path), query.schema, rows)
+                else:
+                    raise http_exc.UnprocessableEntity("The results of this query cannot be previewed.")
+            except preview.PreviewError:
+                raise http_exc.UnprocessableEntity("The results of this query cannot be previewed.")
+            
+            g.session['track']({
+                't' : 'event',
+                'ec' : 'queries',
+                'ea' : 'preview',
+                'el' : query.id,
+                'ev' : rows,
+            })
+            
+            return {
+                'resultset' : [
+                    {'name': c[0], 'values': values}
+                    for c, values in zip(query.schema, columns)
+                ],
+                'limited' : limited,
             }
+
+api_rest.add_resource(QueryPreview, '/queries/<int:id_>/preview')
+
+class QuerySample(QueryResource):
+    MAX_ROWS = 1000000
+
+    def get(self, id_):
+        rows = _rows_arg(10000, self.MAX_ROWS, minimum=1)
+        try:
+            seed = int(request.args['seed']) if 'seed' in request.args else None
+        except ValueError:
+            raise http_exc.BadRequest("The seed must be an integer.")
+        
+        with transactional_session(db.session, read_only=True) as session:
+            query, _ = self._get_query(session, id_)
             
-            comments = render_template_string(current_app.config['QUERY_COMMENTS'], **context)
+            client = self._create_client()
+            path = results_path(client, query)
             
-            data = current_app.formats[query.format](reader, query.schema, comments)
-            path = '{path}.{ext}'.format(path=path, ext=query.format)
+            # Random row groups or blocks of records are read concurrently
+            layout = query.layout or current_app.formats[query.format].layout
+            try:
+                if layout == 'parquet':
+                    columns, total = preview.sample_parquet(HDFSParquetReader(client, path), query.schema, rows, seed)
+                elif layout == 'recarray':
+                    columns, total = preview.sample_recarray(HDFSPathReader(client, path), query.schema, rows, seed)
+                else:
+                    raise http_exc.UnprocessableEntity("The results of this query cannot be sampled.")
+            except preview.SampleError as e:
+                raise http_exc.BadRequest(str(e))
+            except preview.PreviewError:
+                raise http_exc.UnprocessableEntity("The results of this query cannot be sampled.")
             
             g.session['track']({
                 't' : 'event',
-                'ec' : 'downloads',
-                'ea' : 'query_results',
+                'ec' : 'queries',
+                'ea' : 'sample',
                 'el' : query.id,
+                'ev' : rows,
             })
             
-            return self._build_response(data, path, range_header)
+            return {
+                'resultset' : [
+                    {'name': c[0], 'values': values}
+                    for c, values in zip(query.schema, columns)
+                ],
+                'rows' : total,
+            }
 
-api_rest.add_resource(QueryDownload, '/downloads/queries/<int:id_>/results')
+api_rest.add_resource(QuerySample, '/queries/<int:id_>/sample')
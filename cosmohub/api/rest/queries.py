@@ -1,42 +1,122 @@
+import base64
+import bz2
+import hashlib
 import humanize
 import io
+import json
 import logging
+import math
 import os
-import urlparse
+import zlib
 
 from datetime import datetime, timedelta
 from flask import g, current_app, render_template, render_template_string
 from flask_restful import Resource, marshal, reqparse
 from hdfs.ext.kerberos import KerberosClient
 from pyhive import hive
+from sqlalchemy import func, tuple_
 from sqlalchemy.orm import undefer_group
 from werkzeug import exceptions as http_exc 
 
-from cosmohub.api import db, api_rest, mail
+from cosmohub.api import db, api_rest
 
-from .downloads import QueryDownload
+from .downloads import QueryDownload, dataset_parts, open_query_results, record_crc32c, results_path
 from .. import fields
+from ..io import recarray
+from ..io.format import parquet
 from ..database import model
 from ..database.session import transactional_session, retry_on_serializable_error
-from ..hadoop.hdfs import HDFSPathReader, HDFSParquetReader
 from ..security import auth_required, Privilege, Token
 from ..hadoop import oozie
+from ..hadoop.hive import is_deterministic, normalize_sql, parse_explain, sql_identifiers, sql_relations
 
 log = logging.getLogger(__name__)
 
+# Default and maximum number of queries listed in each page
+QUERIES_PAGE_SIZE = 50
+QUERIES_PAGE_MAX_SIZE = 500
+
+def _encode_cursor(query):
+    """\
+    Return an opaque cursor pointing after `query` in the listing.
+    """
+    value = '{0}_{1}'.format(query.ts_submitted.strftime('%Y%m%dT%H%M%S.%f'), query.id)
+    return base64.urlsafe_b64encode(value.encode('ascii')).decode('ascii')
+
+def _decode_cursor(cursor):
+    """\
+    Return the submission timestamp and id encoded in a listing `cursor`.
+    Raises BadRequest if it is not valid.
+    """
+    try:
+        ts, id_ = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('ascii').split('_')
+        return datetime.strptime(ts, '%Y%m%dT%H%M%S.%f'), int(id_)
+    except (TypeError, ValueError):
+        raise http_exc.BadRequest("Invalid cursor.")
+
 class QueryCollection(Resource):
     decorators = [auth_required(Privilege('/user'))]
 
     def get(self):
+        """\
+        List the queries of the user, from the latest one, a page at a time.
+        
+        Pages are delimited by the submission timestamp and id of their last
+        query, and the next one is linked in the `Link` header. Download URLs
+        are only signed for the succeeded queries of the page.
+        """
+        parser = reqparse.RequestParser()
+        parser.add_argument('limit', type=int, default=QUERIES_PAGE_SIZE, location='args')
+        parser.add_argument('cursor', location='args')
+        parser.add_argument('status', action='append', location='args',
+            choices=sorted(set(s.value for s in model.Query.Status)))
+        
+        attrs = parser.parse_args(strict=True)
+        limit = max(1, min(attrs['limit'], QUERIES_PAGE_MAX_SIZE))
+        
         with transactional_session(db.session, read_only=True) as session:
-            queries = session.query(model.Query).join(
-                'user'
-            ).filter(
-                model.User.id == g.session['user'].id,
+            queries = session.query(model.Query).filter(
+                model.Query.user_id == g.session['user'].id,
+            )
+            
+            if attrs['status']:
+                queries = queries.filter(
+                    model.Query.status.in_(attrs['status']),
+                )
+            
+            if attrs['cursor']:
+                ts_submitted, id_ = _decode_cursor(attrs['cursor'])
+                queries = queries.filter(
+                    tuple_(model.Query.ts_submitted, model.Query._id) < tuple_(ts_submitted, id_),
+                )
+            
+            queries = queries.order_by(
+                model.Query.ts_submitted.desc(),
+                model.Query._id.desc(),
+            ).limit(
+                limit + 1,
             ).all()
             
+            headers = {}
+            if len(queries) > limit:
+                queries = queries[:limit]
+                
+                args = {
+                    'limit' : limit,
+                    'cursor' : _encode_cursor(queries[-1]),
+                }
+                if attrs['status']:
+                    args['status'] = attrs['status']
+                
+                url = api_rest.url_for(QueryCollection, _external=True, **args)
+                headers['Link'] = '<{0}>; rel="next"'.format(url)
+            
             data = marshal(queries, fields.Query)
             for query in data:
+                query['download_results'] = None
+                if query['status'] != model.Query.Status.SUCCEEDED.value:
+                    continue
+                
                 token = Token(
                     g.session['user'],
                     Privilege('/download/query/{0}'.format(query['id'])),
@@ -53,122 +133,546 @@ class QueryCollection(Resource):
                 'ev' : len(data),
             })
             
-            return data
+            return data, 200, headers
 
     def post(self):
         @retry_on_serializable_error
-        def post_query(sql, format_):
-            oozie_rest = oozie.Oozie(
-                current_app.config['OOZIE_URL'],
-                database = current_app.config['HIVE_DATABASE'],
-            )
-            
-            try:
-                with transactional_session(db.session) as session:
-                    user = session.query(model.User).filter_by(
-                        id=g.session['user'].id
-                    ).one()
-                    
-                    query = model.Query(
-                        user = user,
-                        sql = sql,
-                        format = format_,
-                    )
-                    session.add(query)
-                    session.flush()
-                    
-                    try:
-                        format_ = current_app.formats[format_]
-                    except KeyError:
-                        raise http_exc.BadRequest("Unsupported format requested.")
-                    
-                    url = urlparse.urlparse(
-                        api_rest.url_for(QueryDone, id_=query.id, _external=True)
-                    )._replace(
-                        scheme='http',
-                        netloc=current_app.config['WEBHCAT_CALLBACK_NETLOC'],
-                        query='status=$status',
-                    ).geturl()
-                    
-                    query.job_id = oozie_rest.submit(
-                        query = sql,
-                        path = os.path.join(current_app.config['RESULTS_BASE_DIR'], str(query.id)),
-                        format_ = format_,
-                        callback_url = url,
-                    )
-                    
-                    g.session['track']({
-                        't' : 'event',
-                        'ec' : 'queries',
-                        'ea' : 'requested',
-                        'el' : query.format,
-                    })
-                    
-                    return marshal(query, fields.Query)
-            
-            except:
+        def post_query(sql, format_, priority, estimate):
+            with transactional_session(db.session) as session:
+                user = session.query(model.User).filter_by(
+                    id=g.session['user'].id
+                ).one()
+                
+                priority = query_priority(user, priority)
+                
+                if estimate is not None:
+                    limits = admission_limits(user)
+                    if admit_query(session, user, limits, estimate) == 'rejected':
+                        raise http_exc.UnprocessableEntity(
+                            "The estimated cost of the query ({0} scanned, {1} rows) exceeds your limits.".format(
+                                humanize.naturalsize(estimate['bytes'] or 0, binary=True),
+                                estimate['rows'],
+                            )
+                        )
+                
+                query = model.Query(
+                    user = user,
+                    sql = sql,
+                    format = format_,
+                    scan_size = estimate and estimate['bytes'],
+                )
+                session.add(query)
+                session.flush()
+                
                 try:
-                    if query and query.job_id:
-                        oozie_rest.cancel(query.job_id)
-                except:
-                    pass
-                finally:
-                    raise
+                    format_ = current_app.formats[format_]
+                except KeyError:
+                    raise http_exc.BadRequest("Unsupported format requested.")
+                
+                # Store results in a layout that can be served in any format
+                # Parquet results are kept as such, as they can also be
+                # projected and served as datasets
+                storage = current_app.config['RESULTS_STORAGE_FORMAT']
+                if storage and format_.layout != 'parquet' and format_.can_open(current_app.formats[storage].layout):
+                    format_ = current_app.formats[storage]
+                else:
+                    storage = query.format
+                query.layout = format_.layout
+                
+                # Serve the results of an identical query, if still stored,
+                # which cannot be expired until this one shares them
+                query.cache_key = cache_key(session, sql, format_)
+                if query.cache_key and current_app.config['RESULTS_CACHE']:
+                    cached = session.query(model.Query).filter_by(
+                        cache_key=query.cache_key,
+                        status=model.Query.Status.SUCCEEDED.value,
+                    ).options(
+                        undefer_group('json'),
+                    ).order_by(
+                        model.Query.ts_finished.desc(),
+                    ).with_for_update(
+                        read=True,
+                    ).first()
+                    
+                    if cached:
+                        if reuse_results(query, cached):
+                            send_query_ready(session, query)
+                        
+                        g.session['track']({
+                            't' : 'event',
+                            'ec' : 'queries',
+                            'ea' : 'cached',
+                            'el' : query.format,
+                        })
+                        
+                        return marshal(query, fields.Query)
+                
+                # Jobs are submitted to Oozie in the background
+                query.submission = model.QuerySubmission(
+                    format = storage,
+                    priority = priority,
+                )
+                
+                g.session['track']({
+                    't' : 'event',
+                    'ec' : 'queries',
+                    'ea' : 'requested',
+                    'el' : query.format,
+                })
+                
+                return marshal(query, fields.Query)
         
         parser = reqparse.RequestParser()
         parser.add_argument('sql', required=True)
         parser.add_argument('format', required=True)
+        parser.add_argument('priority')
         
         attrs = parser.parse_args(strict=True)
         
-        return post_query(attrs['sql'], attrs['format']), 201
+        # The cost of the query is estimated before opening any transaction
+        estimate = None
+        if current_app.config['QUERIES_ADMISSION']:
+            estimate = estimate_query(attrs['sql'])
+        
+        return post_query(attrs['sql'], attrs['format'], attrs['priority'], estimate), 201
 
 api_rest.add_resource(QueryCollection, '/queries')
 
-def finish_query(query, status):
-    cursor=hive.connect(
+def estimate_query(sql):
+    """\
+    Return the estimated cost of `sql`, from its EXPLAIN plan: the bytes it
+    scans and the rows it returns, along with the size of the catalogs it
+    reads, as stored in the metastore.
+    
+    When the plan has no estimate, the whole catalogs are assumed to be read.
+    Raises BadRequest if the query cannot be compiled.
+    """
+    cursor = _hive_cursor()
+    
+    try:
+        cursor.execute("EXPLAIN {0}".format(sql), async=False)
+    except hive.OperationalError:
+        raise http_exc.BadRequest("The query could not be compiled.")
+    
+    scanned, rows = parse_explain(row[0] for row in cursor.fetchall())
+    
+    tables = sorted(sql_identifiers(sql) & set(current_app.statistics))
+    catalogs = [
+        dict(current_app.statistics[table], name=table)
+        for table in tables
+    ]
+    
+    if scanned is None:
+        scanned = sum(catalog['size'] or 0 for catalog in catalogs)
+    if rows is None:
+        rows = sum(catalog['rows'] or 0 for catalog in catalogs)
+    
+    return {
+        'bytes' : scanned,
+        'rows' : rows,
+        'catalogs' : catalogs,
+    }
+
+def user_limits(user, defaults):
+    """\
+    Return the `defaults` limits, overridden by the quotas of `user`.
+    """
+    limits = dict(defaults or {})
+    for key, value in (user.quotas or {}).items():
+        if key in limits:
+            limits[key] = value
+    
+    return limits
+
+def admission_limits(user):
+    """\
+    Return the `QUERIES_ADMISSION` limits of `user`.
+    """
+    return user_limits(user, current_app.config['QUERIES_ADMISSION'])
+
+def scheduler_limits(user):
+    """\
+    Return the `QUERIES_SCHEDULER` limits of `user`.
+    """
+    limits = user_limits(user, current_app.config['QUERIES_SCHEDULER'])
+    limits['priorities'] = current_app.config['QUERIES_SCHEDULER']['priorities']
+    
+    return limits
+
+def query_priority(user, priority=None):
+    """\
+    Return the priority class of a query of `user` requesting `priority`.
+    
+    Users can lower the priority of their queries, but not raise it above the
+    one in their limits. Raises BadRequest otherwise.
+    """
+    limits = scheduler_limits(user)
+    names = [name for name, _ in limits['priorities']]
+    
+    if priority is None:
+        return limits['priority']
+    
+    if priority not in names:
+        raise http_exc.BadRequest("Unsupported priority requested.")
+    
+    if names.index(priority) < names.index(limits['priority']):
+        raise http_exc.BadRequest("The requested priority is above your own.")
+    
+    return priority
+
+def running_scan_size(session, user_ids):
+    """\
+    Return the estimated bytes being scanned by the submitted queries still
+    running of every user in `user_ids`.
+    """
+    return dict(session.query(
+        model.Query.user_id,
+        func.sum(model.Query.scan_size),
+    ).filter(
+        model.Query.user_id.in_(user_ids),
+        model.Query.status == model.Query.Status.RUNNING.value,
+        model.Query.job_id != None,
+    ).group_by(
+        model.Query.user_id,
+    ).all())
+
+def admit_query(session, user, limits, estimate, running=None):
+    """\
+    Return whether a query of `user` with the `estimate` cost is 'rejected',
+    'queued' until others finish or 'accepted' right away, after its `limits`.
+    
+    Queries scanning more than 'max_bytes' or returning more than 'max_rows'
+    are rejected. Those that would make the running queries of their user scan
+    more than 'max_running_bytes' are queued, unless there are none. Limits set
+    to None are not checked.
+    """
+    if limits.get('max_bytes') is not None and estimate['bytes'] > limits['max_bytes']:
+        return 'rejected'
+    
+    if limits.get('max_rows') is not None and estimate['rows'] > limits['max_rows']:
+        return 'rejected'
+    
+    if limits.get('max_running_bytes') is not None:
+        if running is None:
+            running = running_scan_size(session, [user.id]).get(user.id) or 0
+        if running and running + estimate['bytes'] > limits['max_running_bytes']:
+            return 'queued'
+    
+    return 'accepted'
+
+class QueryEstimate(Resource):
+    decorators = [auth_required(Privilege('/user'))]
+    
+    def get(self):
+        parser = reqparse.RequestParser()
+        parser.add_argument('sql', required=True, location='args')
+        
+        attrs = parser.parse_args(strict=True)
+        
+        estimate = estimate_query(attrs['sql'])
+        
+        with transactional_session(db.session, read_only=True) as session:
+            user = session.query(model.User).filter_by(
+                id=g.session['user'].id
+            ).one()
+            
+            limits = admission_limits(user)
+            estimate['limits'] = limits
+            estimate['admission'] = admit_query(session, user, limits, estimate)
+            
+            g.session['track']({
+                't' : 'event',
+                'ec' : 'queries',
+                'ea' : 'estimate',
+                'el' : estimate['admission'],
+            })
+            
+            return estimate
+
+api_rest.add_resource(QueryEstimate, '/queries/estimate')
+
+def _finite(value):
+    """\
+    Return `value`, or None if it is a float that cannot be stored as JSON.
+    """
+    if isinstance(value, float) and (math.isnan(value) or math.isinf(value)):
+        return None
+    
+    return value
+
+def cache_key(session, sql, format_):
+    """\
+    Return the key identifying the results of `sql` stored with `format_`, or
+    None if they cannot be reused.
+    
+    Results depend on the normalized statement, on how they are written and on
+    the data of the catalogs it reads from, identified by their version and
+    upload time. Statements that vary between runs, or reading any relation
+    other than a catalog, whose changes would go unnoticed, are not reused.
+    """
+    if not is_deterministic(sql):
+        return None
+    
+    database = current_app.config['HIVE_DATABASE'].lower()
+    relations = set()
+    for schema, relation in sql_relations(sql):
+        if schema not in (None, database):
+            return None
+        relations.add(relation)
+    
+    catalogs = []
+    if relations:
+        catalogs = session.query(model.Catalog).filter(
+            func.lower(model.Catalog.relation).in_(relations)
+        ).all()
+    
+    if set(c.relation.lower() for c in catalogs) != relations:
+        return None
+    
+    key = {
+        'sql' : normalize_sql(sql),
+        'storage' : format_.compression_config + format_.row_format,
+        'catalogs' : sorted(
+            [c.relation.lower(), c.version, c.ts_uploaded.isoformat()]
+            for c in catalogs
+        ),
+    }
+    
+    return hashlib.sha256(json.dumps(key, sort_keys=True)).hexdigest()
+
+def results_references(session, results_id):
+    """\
+    Return the number of queries, not deleted, sharing the results stored for
+    query `results_id`, which must be kept until none is left.
+    """
+    return session.query(model.Query).filter(
+        func.coalesce(model.Query.results_id, model.Query.id) == results_id,
+        model.Query.status != model.Query.Status.DELETED.value,
+    ).count()
+
+def reuse_results(query, cached):
+    """\
+    Complete `query` sharing the stored results of `cached`, and return True
+    if it has succeeded at once.
+    
+    Queries served in the same format as `cached` take its size too, while
+    the rest are left for the `inspect_queries` task to inspect their results
+    as served in their own format, so that HDFS is not accessed here.
+    """
+    query.results_id = cached.results_id or cached.id
+    query.layout = cached.layout
+    query.schema = cached.schema
+    query.rows = cached.rows
+    query.statistics = cached.statistics
+    query.stored_size = cached.stored_size
+    query.ts_started = query.ts_finished = datetime.utcnow()
+    
+    if query.format == cached.format:
+        query.size = cached.size
+        query.status = model.Query.Status.SUCCEEDED.value
+        return True
+    
+    query.completion = model.QueryCompletion(
+        status = model.Query.Status.SUCCEEDED.value,
+    )
+    return False
+
+def _create_client():
+    url = ';'.join(['http://'+e for e in current_app.config['HADOOP_NAMENODES']])
+    return KerberosClient(
+        url=url,
+        mutual_auth='OPTIONAL',
+    )
+
+def _hive_cursor():
+    return hive.connect(
         host=current_app.config['HIVE_HOST'],
         port=current_app.config['HIVE_PORT'],
         database=current_app.config['HIVE_DATABASE'],
         auth='KERBEROS',
         kerberos_service_name='hive',
     ).cursor()
+
+def query_schema(sql):
+    """\
+    Return the schema of the results of `sql`, as compiled by HiveServer2.
+    """
+    cursor = _hive_cursor()
+    
+    sql = "SELECT * FROM ( {0} ) AS t LIMIT 0".format(sql)
+    cursor.execute(sql, async=False)
+    
+    return [
+        [f[0][2:], f[1], f[2], f[3], f[4], f[5], f[6]]
+        for f in cursor.description
+    ]
+
+def summary_aggregates(schema, layout):
+    """\
+    Return the aggregates computed over the results of a query, in the same
+    pass that writes them, and stored by the workflow next to them.
+    """
+    aggregates = []
+    
+    # Record the actual width of the strings of record arrays, so that they can
+    # be narrowed
+    if layout == 'recarray' and current_app.config['RESULTS_STRING_WIDTHS']:
+        aggregates.extend(
+            'MAX(OCTET_LENGTH(t.`{0}`))'.format(f[0].replace('`', '``'))
+            for f in schema if f[1] in recarray.string_types
+        )
+    
+    # Parquet footers already hold the statistics of every column
+    if layout != 'parquet' and current_app.config['RESULTS_STATISTICS']:
+        aggregates.append('COUNT(*)')
+        for f in schema:
+            name = f[0].replace('`', '``')
+            if f[1] not in recarray.string_types:
+                aggregates.append('MIN(t.`{0}`)'.format(name))
+                aggregates.append('MAX(t.`{0}`)'.format(name))
+            aggregates.append('COUNT(*) - COUNT(t.`{0}`)'.format(name))
     
+    return aggregates
+
+def _parse_value(text, type_):
+    """\
+    Return a value written as text by Hive, converted after its `type_`.
+    """
+    if text == '\\N':
+        return None
+    
+    if type_ in ('BIGINT_TYPE', 'INT_TYPE', 'SMALLINT_TYPE', 'TINYINT_TYPE'):
+        return int(text)
+    
+    if type_ in ('DECIMAL_TYPE', 'DOUBLE_TYPE', 'FLOAT_TYPE'):
+        return _finite(float(text))
+    
+    if type_ == 'BOOLEAN_TYPE':
+        return text == 'true'
+    
+    return text
+
+def read_summary(client, query):
+    """\
+    Return the values of the summary aggregates of `query`, as written by the
+    workflow next to its results, or None if there is none.
     
-    query.status = model.Query.Status[status['status']].value
+    The summary is compressed like the results, as compression is set for the
+    whole job.
+    """
+    path = results_path(client, query) + oozie.SUMMARY_SUFFIX
+    if not client.status(path, strict=False):
+        return None
     
-    # Update query columns upon completion
+    for name, entry in client.list(path, status=True):
+        if entry['type'] != 'FILE' or entry['length'] == 0:
+            continue
+        
+        with client.read(os.path.join(path, name)) as fd:
+            data = fd.read()
+        
+        if name.endswith('.bz2'):
+            data = bz2.decompress(data)
+        elif name.endswith('.gz'):
+            data = zlib.decompress(data, 16 + zlib.MAX_WBITS)
+        elif name.endswith('.deflate'):
+            data = zlib.decompress(data)
+        
+        return data.decode('utf-8').rstrip('\n').split('\t')
+
+def apply_summary(query, schema, values):
+    """\
+    Store the string widths and the statistics of `query` from the `values` of
+    its summary aggregates.
+    
+    Summaries not matching the aggregates expected for `query`, as when the
+    settings changed after it was submitted, are ignored.
+    """
+    layout = query.layout or current_app.formats[query.format].layout
+    if len(values) != len(summary_aggregates(schema, layout)):
+        log.warning("Ignoring the summary of query %s, which does not match its schema", query.id)
+        return
+    
+    values = iter(values)
+    
+    if layout == 'recarray' and current_app.config['RESULTS_STRING_WIDTHS']:
+        for f in schema:
+            if f[1] in recarray.string_types:
+                recarray.set_string_width(f, _parse_value(next(values), 'INT_TYPE') or 0)
+    
+    if layout != 'parquet' and current_app.config['RESULTS_STATISTICS']:
+        query.rows = _parse_value(next(values), 'BIGINT_TYPE')
+        query.statistics = []
+        for f in schema:
+            min_ = max_ = None
+            if f[1] not in recarray.string_types:
+                min_, max_ = _parse_value(next(values), f[1]), _parse_value(next(values), f[1])
+            query.statistics.append({
+                'min' : min_,
+                'max' : max_,
+                'nulls' : _parse_value(next(values), 'BIGINT_TYPE'),
+            })
+
+def _job_times(query, status):
+    """\
+    Record when the job of `query` started and finished, from its `status`.
+    """
     if status['startTime']:
         query.ts_started = datetime.strptime(status['startTime'], '%a, %d %b %Y %H:%M:%S %Z')
     else:
         query.ts_started = datetime.strptime(status['createdTime'], '%a, %d %b %Y %H:%M:%S %Z')
     query.ts_finished = datetime.strptime(status['endTime'], '%a, %d %b %Y %H:%M:%S %Z')
+
+def mark_query(query, status):
+    """\
+    Record that the job of `query` has finished with `status`.
     
-    if query.status != model.Query.Status.SUCCEEDED.value: # @UndefinedVariable
-        return
+    The query remains processing until its results are inspected and its final
+    status is recorded by the `inspect_queries` task, which is then followed by
+    the `notify_queries` task.
+    """
+    _job_times(query, status)
+    query.completion = model.QueryCompletion(
+        status = model.Query.Status[status['status']].value,
+    )
+
+def finish_query(query):
+    """\
+    Record the schema, string widths and statistics of the succeeded `query`,
+    and the size of its results.
     
-    # Retrieve and store query schema
-    sql = "SELECT * FROM ( {0} ) AS t LIMIT 0".format(query.sql)
-    cursor.execute(sql, async=False)
-    query.schema = [
-        [f[0][2:], f[1], f[2], f[3], f[4], f[5], f[6]]
-        for f in cursor.description
-    ]
+    The database is not accessed, so every attribute of `query` and its user
+    must be already loaded.
+    """
+    # The schema was captured on submission, and the aggregates over the
+    # results were written by the workflow, so Hive is only queried again for
+    # queries submitted without them
+    if query.schema is None:
+        query.schema = query_schema(query.sql)
+    schema = [list(f) for f in query.schema]
     
-    url = ';'.join(['http://'+e for e in current_app.config['HADOOP_NAMENODES']])
-    client=KerberosClient(
-        url=url,
-        mutual_auth='OPTIONAL',
-    )
+    # Queries sharing the results of another one already took its summary
+    values = None
+    if query.results_id is None:
+        values = read_summary(_create_client(), query)
+    if values is not None:
+        apply_summary(query, schema, values)
     
-    path = os.path.join(current_app.config['RESULTS_BASE_DIR'], str(query.id))
-    if not path.startswith('/'):
-        path = os.path.join(client.get_home_directory(), path)
+    query.schema = schema
     
-    if query.format == 'parquet':
-        reader = HDFSParquetReader(client, path)
-    else:
-        reader = HDFSPathReader(client, path)
+    inspect_results(query)
+
+def inspect_results(query):
+    """\
+    Record the size of the results of `query`, as stored and as served in its
+    format, their CRC32C, and the number of rows and statistics of Parquet
+    results, from their footer.
+    
+    Results transcoded on download have their size recorded once they are
+    first downloaded whole.
+    """
+    layout = query.layout or current_app.formats[query.format].layout
+    client = _create_client()
     
     context = {
         'query' : query,
@@ -178,8 +682,81 @@ def finish_query(query, status):
     
     comments = render_template_string(current_app.config['QUERY_COMMENTS'], **context)
     
-    data = current_app.formats[query.format](reader, query.schema, comments)
-    query.size = data.seek(0, io.SEEK_END)
+    data = open_query_results(client, query, query.format, comments)
+    if data.seekable():
+        query.size = query.stored_size = data.seek(0, io.SEEK_END)
+    else:
+        query.size = None
+        query.stored_size = data.source_length
+    
+    record_crc32c(query, comments, query.format, data)
+    
+    if layout == 'parquet':
+        query.rows = data.filemetadata.num_rows
+        query.statistics = parquet.column_statistics(data.filemetadata)
+        
+        # Part files are also served on their own, as a dataset
+        for name, part in dataset_parts(client, query, comments):
+            record_crc32c(query, comments, 'dataset/' + name, part)
+
+def send_query_ready(session, query):
+    """\
+    Queue a message to the owner of `query` announcing that its results are
+    ready for download.
+    """
+    token = Token(
+        query.user,
+        Privilege('/download/query/{0}'.format(query.id)),
+        expires_in=current_app.config['TOKEN_EXPIRES_IN']['download'],
+    )
+    
+    url = api_rest.url_for(QueryDownload, id_=query.id, auth_token=token.dump(), _external=True)
+    
+    context = {
+        'query' : query,
+        'duration' : timedelta(seconds=int((query.ts_finished-query.ts_started).total_seconds())),
+        'humanize' : humanize,
+        'url' : url,
+    }
+    
+    session.add(model.MailMessage(
+        subject = current_app.config['MAIL_SUBJECTS']['query_ready'].format(id=query.id),
+        recipients = [query.user.email],
+        body = render_template('mail/query_ready.txt', **context),
+        html = render_template('mail/query_ready.html', **context),
+    ))
+
+def notify_query(session, query):
+    """\
+    Queue a message to either the owner of the finished `query` or every
+    superuser, depending on its outcome. Failures are batched by superuser.
+    """
+    if query.status == model.Query.Status.SUCCEEDED.value:
+        send_query_ready(session, query)
+        return
+    
+    superusers = session.query(
+        model.User
+    ).filter_by(
+        is_superuser=True
+    ).all()
+    
+    for superuser in superusers:
+        session.add(model.MailMessage(
+            batch_key = 'query_failed:{0}'.format(superuser.email),
+            subject = current_app.config['MAIL_SUBJECTS']['query_failed'].format(id=query.id),
+            recipients = [superuser.email],
+            body = render_template(
+                'mail/query_failed.txt',
+                query=query,
+                exit_code=1
+            ),
+            html = render_template(
+                'mail/query_failed.html',
+                query=query,
+                exit_code=1
+            ),
+        ))
 
 class QueryCancel(Resource):
     decorators = [auth_required(Privilege('/user'))]
@@ -190,17 +767,35 @@ class QueryCancel(Resource):
             database=current_app.config['HIVE_DATABASE'],
         )
         @retry_on_serializable_error
-        def cancel_query(id_):
+        def cancel_query(id_, status=None):
             with transactional_session(db.session) as session:
                 query = session.query(model.Query).filter_by(
                     id=id_,
-                ).options(
-                    undefer_group('text'),
                 ).with_for_update().one()
                 
-                oozie_rest.cancel(query.job_id)
-                status = oozie_rest.status(query.job_id)
-                finish_query(query, status)
+                if model.Query.Status(query.status).is_final() or query.completion is not None:
+                    raise http_exc.UnprocessableEntity('The requested query is not running.')
+                
+                if query.job_id is None:
+                    # Not submitted yet, so just drop it from the outbox
+                    if query.submission is None:
+                        raise http_exc.UnprocessableEntity('The requested query is not running.')
+                    
+                    query.submission = None
+                    query.status = model.Query.Status.KILLED.value
+                    query.ts_started = query.ts_finished = datetime.utcnow()
+                elif status is None:
+                    # The job is killed without holding the lock on the query
+                    return query.job_id
+                elif not model.Query.Status[status['status']].is_final():
+                    return
+                elif model.Query.Status[status['status']] == model.Query.Status.SUCCEEDED:
+                    # Finished before being killed, so complete it as usual
+                    mark_query(query, status)
+                    return
+                else:
+                    _job_times(query, status)
+                    query.status = model.Query.Status[status['status']].value
                 
                 g.session['track']({
                     't' : 'event',
@@ -210,10 +805,38 @@ class QueryCancel(Resource):
                     'ev' : int((query.ts_finished - query.ts_started).total_seconds())
                 })
         
-        cancel_query(id_)
+        job_id = cancel_query(id_)
+        if job_id is not None:
+            oozie_rest.cancel(job_id)
+            cancel_query(id_, oozie_rest.status(job_id))
 
 api_rest.add_resource(QueryCancel, '/queries/<int:id_>/cancel')
 
+class QueryStatistics(Resource):
+    decorators = [auth_required(Privilege('/user'))]
+    
+    def get(self, id_):
+        with transactional_session(db.session, read_only=True) as session:
+            query = session.query(model.Query).filter_by(
+                id=id_,
+                user_id=g.session['user'].id,
+            ).options(
+                undefer_group('json'),
+            ).one()
+            
+            if model.Query.Status(query.status) != model.Query.Status.SUCCEEDED:
+                raise http_exc.UnprocessableEntity('The requested query is not succeeded.')
+            
+            return {
+                'rows' : query.rows,
+                'columns' : [
+                    dict(statistics, name=column[0], type=column[1])
+                    for column, statistics in zip(query.schema, query.statistics or [])
+                ],
+            }
+
+api_rest.add_resource(QueryStatistics, '/queries/<int:id_>/statistics')
+
 class QueryDone(Resource):
     def get(self, id_):
         oozie_rest = oozie.Oozie(
@@ -221,73 +844,34 @@ class QueryDone(Resource):
             database=current_app.config['HIVE_DATABASE'],
         )
         
+        with transactional_session(db.session, read_only=True) as session:
+            job_id = session.query(model.Query).filter_by(
+                id=id_,
+            ).one().job_id
+        
+        if job_id is None:
+            return
+        
+        # The status of the job is retrieved before locking the query, which is
+        # only marked as finished here, leaving the rest to background tasks
+        status = oozie_rest.status(job_id)
+        
+        if not model.Query.Status[status['status']].is_final():
+            return
+        
         with transactional_session(db.session) as session:
             query = session.query(model.Query).filter_by(
                 id=id_,
-            ).join(
-                model.Query.user,
-            ).options(
-                undefer_group('text'),
             ).with_for_update().one()
             
-            if model.Query.Status(query.status).is_final():
+            if model.Query.Status(query.status).is_final() or query.completion is not None:
                 return
             
-            status = oozie_rest.status(query.job_id)
+            mark_query(query, status)
             
-            if not model.Query.Status[status['status']].is_final():
+            if query.completion.status != model.Query.Status.SUCCEEDED.value:
                 return
             
-            finish_query(query, status)
-            
-            if query.status != model.Query.Status.SUCCEEDED.value:
-                superusers = session.query(
-                    model.User
-                ).filter_by(
-                    is_superuser=True
-                ).all()
-                
-                recipients = [superuser.email for superuser in superusers]
-                if recipients:
-                    mail.send_message(
-                        subject = current_app.config['MAIL_SUBJECTS']['query_failed'].format(id=query.id),
-                        recipients = recipients,
-                        body = render_template(
-                            'mail/query_failed.txt',
-                            query=query,
-                            exit_code=1
-                        ),
-                        html = render_template(
-                            'mail/query_failed.html',
-                            query=query,
-                            exit_code=1
-                        ),
-                    )
-                
-                return
-            
-            token = Token(
-                query.user,
-                Privilege('/download/query/{0}'.format(query.id)),
-                expires_in=current_app.config['TOKEN_EXPIRES_IN']['download'],
-            )
-                
-            url = api_rest.url_for(QueryDownload, id_=query.id, auth_token=token.dump(), _external=True)
-            
-            context = {
-                'query' : query,
-                'duration' : timedelta(seconds=int((query.ts_finished-query.ts_started).total_seconds())),
-                'humanize' : humanize,
-                'url' : url,
-            }
-            
-            mail.send_message(
-                subject = current_app.config['MAIL_SUBJECTS']['query_ready'].format(id=query.id),
-                recipients = [query.user.email],
-                body = render_template('mail/query_ready.txt', **context),
-                html = render_template('mail/query_ready.html', **context),
-            )
-            
             g.session['track']({
                 't' : 'event',
                 'ec' : 'queries',
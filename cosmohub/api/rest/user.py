@@ -24,7 +24,6 @@ from sqlalchemy.sql import func
 from cosmohub.api import (
     api_rest,
     db,
-    mail,
     recaptcha,
 )
 
@@ -127,12 +126,12 @@ class UserItem(Resource):
                 url = urlparse.urljoin(request.environ['HTTP_REFERER'], attrs['redirect_to'])
                 url += '?' + urllib.urlencode({ 'auth_token' : token.dump() })
                 
-                mail.send_message(
+                session.add(model.MailMessage(
                     subject = current_app.config['MAIL_SUBJECTS']['email_confirm'],
                     recipients = [user.email],
                     body = render_template('mail/email_confirm.txt', user=user, url=url),
                     html = render_template('mail/email_confirm.html', user=user, url=url),
-                )
+                ))
 
     def post(self):
         parser = reqparse.RequestParser()
@@ -195,7 +194,7 @@ class UserItem(Resource):
             
             email_confirm_url += '?' + urllib.urlencode({ 'auth_token' : token.dump() })
             
-            mail.send_message(
+            session.add(model.MailMessage(
                 subject = current_app.config['MAIL_SUBJECTS']['welcome_user'],
                 recipients = [user.email],
                 body = render_template(
@@ -208,20 +207,21 @@ class UserItem(Resource):
                     user=user,
                     url=email_confirm_url
                 ),
-            )
+            ))
             
             recipients = set()
             for group in groups:
                 for admin in group.users_admins:
                     recipients.add(admin.email)
-            recipients = list(recipients)
             
             acl_update_url += '?' + urllib.urlencode({ 'u' : user.email })
             
-            if recipients:
-                mail.send_message(
+            # Requests to the same admin are batched together
+            for recipient in sorted(recipients):
+                session.add(model.MailMessage(
+                    batch_key = 'acls_request:{0}'.format(recipient),
                     subject = current_app.config['MAIL_SUBJECTS']['acls_request'],
-                    recipients = recipients,
+                    recipients = [recipient],
                     body = render_template(
                         'mail/acls_request.txt',
                         user=user,
@@ -234,13 +234,13 @@ class UserItem(Resource):
                         groups=groups,
                         url=acl_update_url,
                     ),
-                )
+                ))
             
-            recipients = [superuser.email for superuser in superusers]
-            if recipients:
-                mail.send_message(
+            for superuser in superusers:
+                session.add(model.MailMessage(
+                    batch_key = 'user_registered:{0}'.format(superuser.email),
                     subject = current_app.config['MAIL_SUBJECTS']['user_registered'],
-                    recipients = recipients,
+                    recipients = [superuser.email],
                     body = render_template(
                         'mail/user_registered.txt',
                         user=user,
@@ -251,7 +251,7 @@ class UserItem(Resource):
                         user=user,
                         groups=groups,
                     ),
-                )
+                ))
             
             g.session['track']({
                 't' : 'event',
@@ -327,7 +327,7 @@ class UserPasswordReset(Resource):
         
         url = urlparse.urljoin(request.environ['HTTP_REFERER'], attrs['redirect_to'])
         
-        with transactional_session(db.session, read_only=True) as session:
+        with transactional_session(db.session) as session:
             user = session.query(model.User).filter_by(
                 email=attrs['email']
             ).one()
@@ -340,12 +340,12 @@ class UserPasswordReset(Resource):
             
             url += '?' + urllib.urlencode({ 'auth_token' : token.dump() })
             
-            mail.send_message(
+            session.add(model.MailMessage(
                 subject = current_app.config['MAIL_SUBJECTS']['password_reset'],
                 recipients = [user.email],
                 body = render_template('mail/password_reset.txt',  user=user, url=url),
                 html = render_template('mail/password_reset.html', user=user, url=url),
-            )
+            ))
             
             g.session['track']({
                 't' : 'event',
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+import argparse
+import json
+import logging
+import subprocess
+import sys
+import textwrap
+
+from cosmohub.api.release import __version__
+
+log = logging.getLogger(__name__)
+
+# Modules that must not be loaded until a download actually needs them
+HEAVY_MODULES = ['asdf', 'astropy', 'pandas', 'parquet_thrift']
+
+_MARKER = '#startup_benchmark#'
+
+_PROBE = textwrap.dedent("""\
+    import json, sys, time
+    start = time.time()
+    {statement}
+    elapsed = time.time() - start
+    sys.stdout.write('\\n' + {marker!r} + json.dumps({{
+        'elapsed' : elapsed,
+        'loaded' : [m for m in {heavy!r} if m in sys.modules],
+    }}) + '\\n')
+    """)
+
+def _measure(statement, heavy):
+    """\
+    Run `statement` in a fresh interpreter and return its elapsed time and the
+    heavy modules it loaded.
+    """
+    code = _PROBE.format(statement=statement, marker=_MARKER, heavy=heavy)
+    output = subprocess.check_output([sys.executable, '-c', code])
+
+    for line in reversed(output.splitlines()):
+        if line.startswith(_MARKER):
+            return json.loads(line[len(_MARKER):])
+
+def _targets(formats):
+    """\
+    Return the name and statement of every import to be measured.
+    """
+    targets = [
+        ('registry', "from cosmohub.api.io.format import FormatRegistry; FormatRegistry('cosmohub_format')"),
+    ]
+
+    if formats:
+        from cosmohub.api.io.format import FormatRegistry
+
+        for name in FormatRegistry('cosmohub_format'):
+            targets.append((
+                'format:' + name,
+                "from cosmohub.api.io.format import FormatRegistry; "
+                "FormatRegistry('cosmohub_format')[{0!r}]".format(name)
+            ))
+
+    targets.append(('app', 'import cosmohub.api'))
+
+    return targets
+
+def _parse_args(args):
+    parser = argparse.ArgumentParser(add_help=False,
+        description='Measure the time taken to import the CosmoHub API in a fresh interpreter.')
+    parser.add_argument('--repeat', '-r', type=int, default=5,
+        help="number of fresh interpreters to measure each import with")
+    parser.add_argument('--no-formats', dest='formats', action='store_false', default=True,
+        help="do not measure loading each format plugin")
+    parser.add_argument('--max-seconds', '-m', type=float, default=None,
+        help="fail if importing the application takes longer than this (median)")
+    parser.add_argument('--help', '-?', action='help',
+        help='show this help message and exit')
+    parser.add_argument('--version', '-V', action='version',
+        version='%%(prog)s %s' % __version__)
+
+    options = vars(parser.parse_args(args))
+
+    return options
+
+def main(args=None):
+    if not args:
+        args = sys.argv[1:]
+
+    options = _parse_args(args)
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    failed = False
+    for name, statement in _targets(options['formats']):
+        runs = [_measure(statement, HEAVY_MODULES) for _ in range(options['repeat'])]
+        elapsed = sorted(run['elapsed'] for run in runs)
+        median = elapsed[len(elapsed) // 2]
+        loaded = sorted(set(m for run in runs for m in run['loaded']))
+
+        log.info('{name:<20} min {min:7.3f}s  median {median:7.3f}s  max {max:7.3f}s  heavy: {loaded}'.format(
+            name=name, min=elapsed[0], median=median, max=elapsed[-1],
+            loaded=', '.join(loaded) or '-',
+        ))
+
+        if name == 'app':
+            if loaded:
+                log.error('Importing the application loads heavy modules: %s', ', '.join(loaded))
+                failed = True
+
+            if options['max_seconds'] is not None and median > options['max_seconds']:
+                log.error('Importing the application takes %.3fs, over %.3fs', median, options['max_seconds'])
+                failed = True
+
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,7 +1,6 @@
 import gevent
 import json
 import logging
-import pandas as pd
 import requests
 import time
 
@@ -130,11 +129,11 @@ def _execute_query(ws, cursor, sql):
         
         # col[0][2:] : Remove 't.' prefix from column names
         cols = [col[0][2:] for col in cursor.description]
-        df = pd.DataFrame(data, columns=cols)
+        values = zip(*data) or [()] * len(cols)
         
         rs = [
-            {'name': name, 'values': values}
-            for name, values in df.iteritems()
+            {'name': name, 'values': list(column)}
+            for name, column in zip(cols, values)
         ]
         
         ws.send(json.dumps({
@@ -0,0 +1,44 @@
+"""\
+Background tasks run periodically by the application workers.
+"""
+import gevent
+import logging
+
+from cosmohub.api import app, db
+
+from ..database.session import transactional_session, try_advisory_lock
+
+log = logging.getLogger(__name__)
+
+def periodic(name, interval):
+    """\
+    Decorator that runs a function every `interval` seconds in the background.
+    
+    The function is called with a session, within a transaction holding an
+    advisory lock named after the task, so that a single worker runs it at a
+    time. Requests are simulated on `API_BASE_URL`, so that links to the API
+    can be built. Tasks without an interval are not started.
+    """
+    def decorator(fn):
+        def loop():
+            while True:
+                gevent.sleep(interval)
+                try:
+                    with app.test_request_context(base_url=app.config['API_BASE_URL']):
+                        with transactional_session(db.session) as session:
+                            if try_advisory_lock(session, name):
+                                fn(session)
+                except Exception:
+                    log.exception("Periodic task %s failed", name)
+                finally:
+                    db.session.remove()
+        
+        @app.before_first_request
+        def start():
+            if interval:
+                gevent.spawn(loop)
+        
+        return fn
+    return decorator
+
+from . import mail, queries, results # @UnusedImport
@@ -0,0 +1,115 @@
+import collections
+import logging
+
+from datetime import timedelta
+from flask_mail import Message
+from sqlalchemy import func, or_
+
+from cosmohub.api import app, mail
+
+from ..database import model
+from . import periodic
+
+log = logging.getLogger(__name__)
+
+# Maximum number of messages handled at each run
+_SEND_BATCH = 100
+
+# Seconds to wait after the first failed attempt, doubled after each one
+_SEND_BACKOFF = 60
+
+def _message(messages):
+    """\
+    Return a single message with the contents of `messages`, which share their
+    recipients.
+    """
+    first = messages[0]
+    if len(messages) == 1:
+        subject = first.subject
+    else:
+        subject = u'{0} (+{1})'.format(first.subject, len(messages) - 1)
+    
+    html = None
+    if all(message.html for message in messages):
+        html = u'\n<hr>\n'.join(message.html for message in messages)
+    
+    return Message(
+        subject = subject,
+        recipients = first.recipients,
+        body = u'\n\n{0}\n\n'.format(u'-' * 72).join(message.body for message in messages),
+        html = html,
+        sender = first.sender,
+        reply_to = first.reply_to,
+    )
+
+@periodic('send_mail', app.config['MAIL_OUTBOX_INTERVAL'])
+def send_mail(session):
+    """\
+    Send the messages waiting in the outbox, through a single connection.
+    
+    Messages sharing a batch key are held for `MAIL_BATCH_DELAY` seconds, and
+    then sent together with the ones queued meanwhile. Failed messages are
+    retried later, waiting twice as long after each attempt, until they are
+    given up.
+    """
+    delay = timedelta(seconds=app.config['MAIL_BATCH_DELAY'])
+    
+    messages = session.query(model.MailMessage).filter(
+        model.MailMessage.ts_due <= func.now(),
+        or_(
+            model.MailMessage.batch_key == None,
+            model.MailMessage.ts_created <= func.now() - delay,
+        ),
+    ).order_by(
+        model.MailMessage.ts_due,
+    ).limit(
+        _SEND_BATCH,
+    ).all()
+    
+    if not messages:
+        return
+    
+    # Collect every other pending message of the same batches
+    keys = set(message.batch_key for message in messages if message.batch_key)
+    if keys:
+        messages.extend(session.query(model.MailMessage).filter(
+            model.MailMessage.batch_key.in_(keys),
+            model.MailMessage.attempts == 0,
+            ~model.MailMessage.id.in_([message.id for message in messages]),
+        ).all())
+    
+    batches = collections.OrderedDict()
+    for message in messages:
+        batches.setdefault(message.batch_key or message.id, []).append(message)
+    
+    errors = {}
+    try:
+        with mail.connect() as connection:
+            for key, batch in batches.items():
+                try:
+                    connection.send(_message(batch))
+                except Exception as e:
+                    errors[key] = e
+                else:
+                    errors[key] = None
+    except Exception as e:
+        # Could not connect, so every batch not sent yet has failed
+        for key in batches:
+            errors.setdefault(key, e)
+    
+    for key, batch in batches.items():
+        exc = errors[key]
+        for message in batch:
+            if exc is None:
+                session.delete(message)
+                continue
+            
+            message.attempts += 1
+            message.error = repr(exc)
+            
+            if message.attempts < app.config['MAIL_OUTBOX_ATTEMPTS']:
+                backoff = _SEND_BACKOFF * 2 ** (message.attempts - 1)
+                message.ts_due = func.now() + timedelta(seconds=backoff)
+            else:
+                log.error("Giving up message %s to %s: %s", message.id, message.recipients, message.error)
+                session.delete(message)
@@ -0,0 +1,476 @@
+import collections
+import gevent
+import gevent.pool
+import heapq
+import logging
+import os
+import requests
+import socket
+import urlparse
+
+from datetime import datetime, timedelta
+from hdfs.util import HdfsError
+from sqlalchemy import func
+from sqlalchemy.orm import contains_eager, joinedload, undefer_group
+from thrift.transport.TTransport import TTransportException
+
+from cosmohub.api import app, api_rest
+
+from ..database import model
+from ..hadoop import oozie
+from ..rest.queries import (
+    QueryDone, admission_limits, admit_query, finish_query, mark_query,
+    notify_query, query_schema, running_scan_size, scheduler_limits,
+    summary_aggregates,
+)
+from . import periodic
+
+log = logging.getLogger(__name__)
+
+# Maximum number of submissions handled at each run
+_SUBMIT_BATCH = 100
+
+# Maximum number of waiting submissions of each user considered at each run
+_SCHEDULE_DEPTH = 20
+
+# Seconds to wait after the first failed submission, doubled after each one
+_SUBMIT_BACKOFF = 30
+
+# Maximum number of completions handled at each run
+_COMPLETE_BATCH = 100
+
+# Seconds to wait after the first failed completion stage, doubled after each one
+_COMPLETE_BACKOFF = 30
+
+# Maximum seconds to wait between inspections failed by an unavailable service
+_COMPLETE_MAX_BACKOFF = 3600
+
+# Remote exceptions of HDFS raised while it is not available
+_HDFS_UNAVAILABLE = frozenset([
+    None,
+    'RetriableException',
+    'SafeModeException',
+    'StandbyException',
+])
+
+# Attributes of a query recorded by the inspection of its results
+_INSPECTED = ['schema', 'size', 'stored_size', 'rows', 'statistics', 'digests']
+
+def _submit(query_id, sql, format_, callback_url, queue):
+    """\
+    Submit the job of a query to Oozie and return its identifier and the
+    schema of its results.
+    
+    Jobs are named after their query, and looked up by name first, so that
+    the job submitted by a previous run whose outcome or commit was lost is
+    adopted instead of duplicated.
+    The schema is captured here, so that the job can compute the aggregates
+    over the results and no round trip to Hive is needed on completion.
+    """
+    with app.app_context():
+        oozie_rest = oozie.Oozie(
+            app.config['OOZIE_URL'],
+            database=app.config['HIVE_DATABASE'],
+        )
+        name = 'cosmohub-query-{0}'.format(query_id)
+        format_ = app.formats[format_]
+        
+        schema = query_schema(sql)
+        
+        job_id = oozie_rest.find(name)
+        if job_id:
+            return job_id, schema
+        
+        job_id = oozie_rest.submit(
+            query = sql,
+            path = os.path.join(app.config['RESULTS_BASE_DIR'], str(query_id)),
+            format_ = format_,
+            callback_url = callback_url,
+            name = name,
+            summary = summary_aggregates(schema, format_.layout),
+            queue = queue,
+        )
+        
+        return job_id, schema
+
+def _running_jobs(session, user_ids):
+    """\
+    Return the number of jobs still running of every user in `user_ids`.
+    """
+    return dict(session.query(
+        model.Query.user_id,
+        func.count(),
+    ).filter(
+        model.Query.user_id.in_(user_ids),
+        model.Query.status == model.Query.Status.RUNNING.value,
+        model.Query.job_id != None,
+        ~model.Query.completion.has(),
+    ).group_by(
+        model.Query.user_id,
+    ).all())
+
+def _schedule(session, queries):
+    """\
+    Return the `queries` to submit now, in order, without exceeding the number
+    of running jobs allowed to their users.
+    
+    Queries are taken by priority class, from the highest, and within each one
+    from the user with the fewest running jobs for their weight, so that free
+    slots are shared fairly. Ties go to the longest waiting query.
+    """
+    running = _running_jobs(session, set(query.user_id for query in queries))
+    limits = dict((query.user_id, scheduler_limits(query.user)) for query in queries)
+    
+    names = [name for name, _ in app.config['QUERIES_SCHEDULER']['priorities']]
+    waiting = collections.defaultdict(lambda: collections.defaultdict(collections.deque))
+    for query in queries:
+        priority = query.submission.priority
+        rank = names.index(priority) if priority in names else len(names)
+        waiting[rank][query.user_id].append(query)
+    
+    def share(user_id):
+        return running.get(user_id, 0) / float(limits[user_id]['weight'] or 1)
+    
+    scheduled = []
+    for rank in sorted(waiting):
+        heap = [
+            (share(user_id), pending[0].submission.ts_due, user_id)
+            for user_id, pending in waiting[rank].items()
+        ]
+        heapq.heapify(heap)
+        
+        while heap:
+            _, _, user_id = heapq.heappop(heap)
+            
+            max_running = limits[user_id]['max_running']
+            if max_running is not None and running.get(user_id, 0) >= max_running:
+                continue
+            
+            pending = waiting[rank][user_id]
+            scheduled.append(pending.popleft())
+            running[user_id] = running.get(user_id, 0) + 1
+            
+            if pending:
+                heapq.heappush(heap, (share(user_id), pending[0].submission.ts_due, user_id))
+    
+    return scheduled
+
+def _admit(session, queries):
+    """\
+    Return the `queries` whose estimated cost fits within the running quota of
+    their user, in order, and send the others to the back of the outbox.
+    """
+    running = running_scan_size(session, set(query.user_id for query in queries))
+    
+    admitted = []
+    for query in queries:
+        scan_size = query.scan_size or 0
+        user_running = running.get(query.user_id) or 0
+        
+        limits = admission_limits(query.user)
+        estimate = {'bytes' : scan_size, 'rows' : 0}
+        if admit_query(session, query.user, limits, estimate, user_running) == 'queued':
+            query.submission.ts_due = func.now()
+            continue
+        
+        running[query.user_id] = user_running + scan_size
+        admitted.append(query)
+    
+    return admitted
+
+@periodic('submit_queries', app.config['QUERIES_SUBMIT_INTERVAL'])
+def submit_queries(session):
+    """\
+    Submit to Oozie the jobs of the queries waiting in the outbox.
+    
+    Due submissions are locked, skipping those handled by a cancellation right
+    now, scheduled and submitted concurrently to the YARN queue of their
+    priority. Queries that would exceed the running jobs or quota of their
+    user are held, and promoted in later runs as their other jobs finish.
+    Submissions failed because Hive or Oozie were not available are retried
+    later, waiting twice as long after each attempt, until the query is given
+    up as failed. Queries failed otherwise, such as those that cannot be
+    compiled, are given up at once. Either way, the failure is notified by
+    the `notify_queries` task.
+    """
+    # Only the oldest due submissions of each user are considered, so that
+    # users with many waiting queries do not crowd out the others
+    candidates = session.query(
+        model.Query._id.label('id'),
+        func.row_number().over(
+            partition_by=model.Query._user_id,
+            order_by=model.QuerySubmission.ts_due,
+        ).label('position'),
+    ).join(
+        model.Query.submission,
+    ).filter(
+        model.QuerySubmission.ts_due <= func.now(),
+    ).subquery()
+    
+    queries = session.query(model.Query).join(
+        model.Query.submission,
+    ).filter(
+        model.Query._id.in_(
+            session.query(candidates.c.id).filter(
+                candidates.c.position <= _SCHEDULE_DEPTH,
+            )
+        ),
+    ).options(
+        contains_eager(model.Query.submission),
+        joinedload(model.Query.user, innerjoin=True),
+    ).order_by(
+        model.QuerySubmission.ts_due,
+    ).with_for_update(
+        skip_locked=True,
+        of=model.Query,
+    ).all()
+    
+    queries = _schedule(session, queries)[:_SUBMIT_BATCH]
+    
+    if app.config['QUERIES_ADMISSION']:
+        queries = _admit(session, queries)
+    
+    queues = dict(app.config['QUERIES_SCHEDULER']['priorities'])
+    
+    pool = gevent.pool.Pool(app.config['QUERIES_SUBMIT_CONCURRENCY'])
+    jobs = []
+    for query in queries:
+        callback_url = urlparse.urlparse(
+            api_rest.url_for(QueryDone, id_=query.id, _external=True)
+        )._replace(
+            scheme='http',
+            netloc=app.config['WEBHCAT_CALLBACK_NETLOC'],
+            query='status=$status',
+        ).geturl()
+        
+        jobs.append(pool.spawn(
+            _submit, query.id, query.sql, query.submission.format,
+            callback_url, queues.get(query.submission.priority),
+        ))
+    gevent.joinall(jobs)
+    
+    for query, job in zip(queries, jobs):
+        if job.successful():
+            query.job_id, query.schema = job.value
+            query.submission = None
+            continue
+        
+        submission = query.submission
+        submission.attempts += 1
+        submission.error = repr(job.exception)
+        log.warning("Cannot submit query %s: %s", query.id, submission.error)
+        
+        if submission.attempts < app.config['QUERIES_SUBMIT_ATTEMPTS'] and _transient(job.exception):
+            delay = _SUBMIT_BACKOFF * 2 ** (submission.attempts - 1)
+            submission.ts_due = func.now() + timedelta(seconds=delay)
+        else:
+            # Failures are notified as those of the jobs that have run
+            query.submission = None
+            query.status = model.Query.Status.FAILED.value
+            query.ts_started = query.ts_finished = datetime.utcnow()
+            query.completion = model.QueryCompletion(
+                status = model.Query.Status.FAILED.value,
+                stage = model.QueryCompletion.Stage.NOTIFY.value,
+                error = submission.error,
+            )
+
+@periodic('poll_queries', app.config['QUERIES_POLL_INTERVAL'])
+def poll_queries(session):
+    """\
+    Mark the queries whose jobs have finished, in case their callback to
+    `QueryDone` was lost.
+    
+    The status of every running job is retrieved in bulk, and queries being
+    marked by a callback right now are skipped.
+    """
+    queries = session.query(model.Query).filter(
+        model.Query.status == model.Query.Status.RUNNING.value,
+        model.Query.job_id != None,
+        ~model.Query.completion.has(),
+    ).with_for_update(
+        skip_locked=True,
+        of=model.Query,
+    ).all()
+    
+    if not queries:
+        return
+    
+    oozie_rest = oozie.Oozie(
+        app.config['OOZIE_URL'],
+        database=app.config['HIVE_DATABASE'],
+    )
+    statuses = oozie_rest.status_multi([query.job_id for query in queries])
+    
+    for query in queries:
+        status = statuses.get(query.job_id)
+        if not status or status['status'] not in model.Query.Status.__members__:
+            continue
+        
+        if not model.Query.Status[status['status']].is_final():
+            continue
+        
+        mark_query(query, status)
+
+def _due_completions(session, stage):
+    """\
+    Return the queries with a completion due in `stage`, along with their user
+    and every deferred attribute.
+    """
+    return session.query(model.Query).join(
+        model.Query.completion,
+    ).join(
+        model.Query.user,
+    ).filter(
+        model.QueryCompletion.stage == stage.value,
+        model.QueryCompletion.ts_due <= func.now(),
+    ).options(
+        contains_eager(model.Query.completion),
+        contains_eager(model.Query.user),
+        undefer_group('text'),
+        undefer_group('json'),
+    ).order_by(
+        model.QueryCompletion.ts_due,
+    ).limit(
+        _COMPLETE_BATCH,
+    ).all()
+
+def _transient(exc):
+    """\
+    Return whether `exc` was raised because HDFS, Hive or Oozie were not
+    available, rather than because of the query or its results.
+    """
+    if isinstance(exc, HdfsError):
+        return exc.exception in _HDFS_UNAVAILABLE
+    
+    if isinstance(exc, requests.HTTPError):
+        return exc.response is not None and exc.response.status_code >= 500
+    
+    return isinstance(exc, (
+        requests.ConnectionError,
+        requests.Timeout,
+        socket.error,
+        TTransportException,
+    ))
+
+def _retry(completion, exc, transient=False):
+    """\
+    Record a failed attempt of the current stage of `completion`, and return
+    whether it has to be retried later.
+    
+    Attempts failed by a `transient` error are retried for as long as it
+    lasts, waiting at most `_COMPLETE_MAX_BACKOFF` seconds between them.
+    """
+    completion.attempts += 1
+    completion.error = repr(exc)
+    log.warning("Cannot complete query %s: %s", completion.query_id, completion.error)
+    
+    if completion.attempts >= app.config['QUERIES_COMPLETE_ATTEMPTS'] and not transient:
+        return False
+    
+    delay = _COMPLETE_BACKOFF * 2 ** min(completion.attempts - 1, 16)
+    completion.ts_due = func.now() + timedelta(seconds=min(delay, _COMPLETE_MAX_BACKOFF))
+    return True
+
+def _inspect(query):
+    """\
+    Inspect the results of a query, in an application context of its own.
+    """
+    with app.app_context():
+        finish_query(query)
+
+@periodic('inspect_queries', app.config['QUERIES_COMPLETE_INTERVAL'])
+def inspect_queries(session):
+    """\
+    Inspect the results of the queries marked as finished, and record their
+    final status.
+    
+    Results are inspected concurrently on detached queries, without locking
+    them, and each one is then locked to record its outcome, unless it has
+    been deleted, or has no longer a completion pending inspection, meanwhile.
+    Failed inspections are retried later, waiting twice as long after each
+    attempt, until the query is given up as failed. Inspections failed
+    because HDFS or Hive were not available are retried until they succeed,
+    so that their results are not expired as those of a failed query.
+    """
+    queries = _due_completions(session, model.QueryCompletion.Stage.INSPECT)
+    
+    # Nothing recorded by the inspections is written until locking each query
+    session.expunge_all()
+    
+    pool = gevent.pool.Pool(app.config['QUERIES_COMPLETE_CONCURRENCY'])
+    jobs = {}
+    for query in queries:
+        if query.completion.status == model.Query.Status.SUCCEEDED.value:
+            jobs[query.id] = pool.spawn(_inspect, query)
+    gevent.joinall(jobs.values())
+    
+    for query in queries:
+        job = jobs.get(query.id)
+        
+        try:
+            with session.begin_nested():
+                locked = session.query(model.Query).filter_by(
+                    id=query.id,
+                ).options(
+                    undefer_group('json'),
+                ).with_for_update().one_or_none()
+                
+                if locked is None:
+                    continue
+                
+                completion = locked.completion
+                if completion is None or completion.stage != model.QueryCompletion.Stage.INSPECT.value:
+                    continue
+                
+                if model.Query.Status(locked.status).is_final():
+                    locked.completion = None
+                    continue
+                
+                if job and not job.successful():
+                    if _retry(completion, job.exception, _transient(job.exception)):
+                        continue
+                    locked.status = model.Query.Status.FAILED.value
+                else:
+                    if job:
+                        # Digests recorded by downloads meanwhile are kept
+                        digests = dict(locked.digests or {})
+                        digests.update(query.digests or {})
+                        query.digests = digests
+                        
+                        for attr in _INSPECTED:
+                            setattr(locked, attr, getattr(query, attr))
+                    
+                    locked.status = completion.status
+                
+                completion.stage = model.QueryCompletion.Stage.NOTIFY.value
+                completion.attempts = 0
+                completion.error = None
+                completion.ts_due = func.now()
+        except Exception:
+            log.exception("Cannot complete query %s", query.id)
+
+@periodic('notify_queries', app.config['QUERIES_COMPLETE_INTERVAL'])
+def notify_queries(session):
+    """\
+    Notify the outcome of the queries whose final status has been recorded.
+    
+    Messages are queued in the mail outbox, to be sent by the `send_mail`
+    task. Failed notifications are retried later, waiting twice as long after
+    each attempt, until they are given up.
+    """
+    queries = _due_completions(session, model.QueryCompletion.Stage.NOTIFY)
+    
+    for query in queries:
+        # Messages queued before a failure are discarded along with it
+        try:
+            with session.begin_nested():
+                notify_query(session, query)
+        except Exception as e:
+            if _retry(query.completion, e):
+                continue
+        
+        try:
+            with session.begin_nested():
+                query.completion = None
+        except Exception:
+            log.exception("Cannot complete query %s", query.id)
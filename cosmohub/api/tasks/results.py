@@ -0,0 +1,223 @@
+import gevent
+import gevent.pool
+import logging
+
+from datetime import datetime, timedelta
+from flask import current_app
+from hdfs.ext.kerberos import KerberosClient
+from sqlalchemy import and_, func, or_
+
+from cosmohub.api import app
+
+from ..database import model
+from ..hadoop import oozie
+from ..rest.downloads import results_dir
+from ..rest.queries import user_limits
+from . import periodic
+
+log = logging.getLogger(__name__)
+
+# Maximum number of stored results removed at each run
+_PURGE_BATCH = 500
+
+# Statuses of the queries whose results are no longer served
+_EXPIRED = [
+    model.Query.Status.DELETED.value,
+    model.Query.Status.FAILED.value,
+    model.Query.Status.KILLED.value,
+]
+
+def _create_client():
+    url = ';'.join(['http://'+e for e in current_app.config['HADOOP_NAMENODES']])
+    return KerberosClient(
+        url=url,
+        mutual_auth='OPTIONAL',
+    )
+
+def _last_access():
+    return func.coalesce(model.Query.ts_downloaded, model.Query.ts_finished)
+
+def _results_key():
+    return func.coalesce(model.Query.results_id, model.Query._id)
+
+def _stored_size():
+    return func.coalesce(model.Query.stored_size, model.Query.size)
+
+def _expire_ttl(session, ttl):
+    """\
+    Expire the results not downloaded in the number of days set for their
+    format in `ttl`, returning how many were expired.
+    """
+    now = datetime.utcnow()
+    formats = [format_ for format_ in ttl if format_ is not None]
+    
+    conditions = [
+        and_(
+            model.Query.format == format_,
+            _last_access() < now - timedelta(days=ttl[format_]),
+        )
+        for format_ in formats
+        if ttl[format_] is not None
+    ]
+    if ttl.get(None) is not None:
+        others = _last_access() < now - timedelta(days=ttl[None])
+        if formats:
+            others = and_(~model.Query.format.in_(formats), others)
+        conditions.append(others)
+    
+    if not conditions:
+        return 0
+    
+    return session.query(model.Query).filter(
+        model.Query.status == model.Query.Status.SUCCEEDED.value,
+        or_(*conditions),
+    ).update(
+        {model.Query.status : model.Query.Status.DELETED.value},
+        synchronize_session=False,
+    )
+
+def _expire_quota(session, user, max_stored_bytes):
+    """\
+    Expire the least recently downloaded results of `user` that do not fit in
+    `max_stored_bytes`, returning how many queries were expired.
+    
+    Results shared by several queries of `user` are counted once, as last
+    accessed by any of them, and expired along with all of them.
+    """
+    results = session.query(
+        _results_key().label('key'),
+        func.max(_last_access()).label('accessed'),
+        func.max(_stored_size()).label('size'),
+    ).filter(
+        model.Query.user_id == user.id,
+        model.Query.status == model.Query.Status.SUCCEEDED.value,
+    ).group_by(
+        _results_key(),
+    ).subquery()
+    
+    stored = session.query(
+        results.c.key,
+        func.sum(results.c.size).over(
+            order_by=(results.c.accessed.desc(), results.c.key.desc()),
+        ).label('stored'),
+    ).subquery()
+    
+    return session.query(model.Query).filter(
+        model.Query.user_id == user.id,
+        model.Query.status == model.Query.Status.SUCCEEDED.value,
+        _results_key().in_(
+            session.query(stored.c.key).filter(
+                stored.c.stored > max_stored_bytes,
+            )
+        ),
+    ).update(
+        {model.Query.status : model.Query.Status.DELETED.value},
+        synchronize_session=False,
+    )
+
+@periodic('expire_results', app.config['RESULTS_RETENTION_INTERVAL'])
+def expire_results(session):
+    """\
+    Expire the results of succeeded queries, which are then deleted.
+    
+    Results not downloaded within the days set for their format in
+    `RESULTS_TTL` are expired first. Then, users storing more than their
+    quota have their least recently downloaded results expired until the rest
+    fit in it. Results are counted by their stored size, once for each user
+    sharing them, as they are kept for as long as any of them does.
+    """
+    if app.config['RESULTS_TTL']:
+        count = _expire_ttl(session, app.config['RESULTS_TTL'])
+        if count:
+            log.info("Expired %s query results past their TTL", count)
+    
+    results = session.query(
+        model.Query.user_id.label('user_id'),
+        func.max(_stored_size()).label('size'),
+    ).filter(
+        model.Query.status == model.Query.Status.SUCCEEDED.value,
+    ).group_by(
+        model.Query.user_id,
+        _results_key(),
+    ).subquery()
+    
+    totals = dict(session.query(
+        results.c.user_id,
+        func.sum(results.c.size),
+    ).group_by(
+        results.c.user_id,
+    ).all())
+    
+    if not totals:
+        return
+    
+    users = session.query(model.User).filter(
+        model.User.id.in_(totals.keys()),
+    ).all()
+    
+    for user in users:
+        limits = user_limits(user, app.config['RESULTS_QUOTA'])
+        max_stored_bytes = limits['max_stored_bytes']
+        if max_stored_bytes is None or (totals[user.id] or 0) <= max_stored_bytes:
+            continue
+        
+        count = _expire_quota(session, user, max_stored_bytes)
+        log.info("Expired %s query results of user %s over their quota", count, user.id)
+
+def _purge(results_id):
+    """\
+    Delete the results stored for query `results_id`, and their summary, in an
+    application context of its own.
+    """
+    with app.app_context():
+        client = _create_client()
+        path = results_dir(client, results_id)
+        client.delete(path, recursive=True)
+        client.delete(path + oozie.SUMMARY_SUFFIX, recursive=True)
+
+@periodic('purge_results', app.config['RESULTS_RETENTION_INTERVAL'])
+def purge_results(session):
+    """\
+    Delete the stored results no longer served to any query.
+    
+    Results are shared by every query completed from the result cache, so they
+    are only deleted once all of them have been deleted, have failed or have
+    been cancelled. Directories are deleted concurrently, and the queries
+    sharing them are then marked as purged. Failed deletions are retried at
+    the next run.
+    """
+    key = func.coalesce(model.Query.results_id, model.Query._id)
+    
+    keys = [row[0] for row in session.query(
+        key,
+    ).group_by(
+        key,
+    ).having(
+        func.bool_and(model.Query.status.in_(_EXPIRED)),
+    ).having(
+        func.bool_or(model.Query.ts_purged == None),
+    ).limit(
+        _PURGE_BATCH,
+    ).all()]
+    
+    if not keys:
+        return
+    
+    pool = gevent.pool.Pool(app.config['RESULTS_PURGE_CONCURRENCY'])
+    jobs = dict((results_id, pool.spawn(_purge, results_id)) for results_id in keys)
+    gevent.joinall(jobs.values())
+    
+    purged = []
+    for results_id, job in jobs.items():
+        if job.successful():
+            purged.append(results_id)
+        else:
+            log.error("Cannot delete the results of query %s: %r", results_id, job.exception)
+    
+    if purged:
+        session.query(model.Query).filter(
+            key.in_(purged),
+        ).update(
+            {model.Query.ts_purged : datetime.utcnow()},
+            synchronize_session=False,
+        )
@@ -27,8 +27,32 @@
     <name>jdbcURL</name>
     <value>${jdbc_url}</value>
   </property>
+  <property>
+    <name>jobName</name>
+    <value>${job_name}</value>
+  </property>
+  <property>
+    <name>queueName</name>
+    <value>${queue_name}</value>
+  </property>
   <property>
     <name>query</name>
     <value>${query}</value>
   </property>
+  <property>
+    <name>resultsPath</name>
+    <value>${results_path}</value>
+  </property>
+  <property>
+    <name>compact</name>
+    <value>${compact}</value>
+  </property>
+  <property>
+    <name>compactMaxFiles</name>
+    <value>${compact_max_files}</value>
+  </property>
+  <property>
+    <name>compactTargetSize</name>
+    <value>${compact_target_size}</value>
+  </property>
 </configuration>
@@ -27,7 +27,6 @@ setup(
     author_email = 'pau.tallada@gmail.com',
 
     install_requires = [
-        'asdf',
         'astropy',
         'enum34',
         'gevent',
@@ -42,8 +41,8 @@ setup(
         'flask-logconfig',
         'hdfs',
         'humanize',
+        'numpy',
         'opbeat[flask]',
-        'pandas',
         'passlib',
         'psycogreen',
         'psycopg2-binary',
@@ -56,18 +55,27 @@ setup(
         'thriftpy2',
     ],
     
+    extras_require = {
+        'lz4' : ['lz4'],
+    },
+    
     include_package_data=True,
     zip_safe=False,
 
     entry_points = {
         'console_scripts' : [
             'cosmohub_api_initialize_db = cosmohub.api.scripts.initialize_db:main',
+            'cosmohub_api_startup_benchmark = cosmohub.api.scripts.startup_benchmark:main',
         ],
         'cosmohub_format' : [
-            'csv.bz2 = cosmohub.api.io.format.csv_bz2:CsvBz2File',
-            'fits    = cosmohub.api.io.format.fits:FitsFile',
-            'asdf    = cosmohub.api.io.format.asdf:AsdfFile',
-            'parquet = cosmohub.api.io.format.parquet:ParquetFile',
+            'csv.bz2  = cosmohub.api.io.format.csv_bz2:CsvBz2File',
+            'fits     = cosmohub.api.io.format.fits:FitsFile',
+            'fits.fz  = cosmohub.api.io.format.fits_fz:FitsFzFile',
+            'asdf     = cosmohub.api.io.format.asdf:AsdfFile',
+            'asdf.bz2 = cosmohub.api.io.format.asdf:AsdfBz2File',
+            'asdf.lz4 = cosmohub.api.io.format.asdf:AsdfLz4File',
+            'parquet  = cosmohub.api.io.format.parquet:ParquetFile',
+            'votable  = cosmohub.api.io.format.votable:VOTableFile',
         ]
     },
 )
@@ -0,0 +1,111 @@
+#!/bin/bash
+#
+# Coalesce the part files of query results into files of about TARGET_SIZE
+# bytes, when there are more than MAX_FILES of them and they are small, with an
+# average size below half of TARGET_SIZE.
+#
+# Results are read as the concatenation of their non-empty files, ordered by
+# name, so concatenating consecutive files keeps the same stream of bytes. This
+# holds for record arrays and compressed text, but not for Parquet files.
+#
+# Each run of consecutive small files is concatenated into a new file, named
+# after the first one of the run so that it sorts in its place, while files
+# already large are left as they are. The compacted files are moved in before
+# deleting the ones they replace, whose list is written beforehand, so that a
+# rerun after a failure completes the replacement instead of losing data.
+#
+# Usage: compact.sh RESULTS_PATH MAX_FILES TARGET_SIZE
+
+set -euo pipefail
+
+RESULTS_PATH="$1"
+MAX_FILES="$2"
+TARGET_SIZE="$3"
+
+STAGING="${RESULTS_PATH}/.compaction"
+COMPACTED="${STAGING}/files"
+REPLACED="${STAGING}/replaced"
+
+# Sorts right after the name of the first file of each run, as written by Hive
+SUFFIX=".compacted"
+
+replace() {
+    if [ "$(hdfs dfs -count "${COMPACTED}" | awk '{ print $2 }')" -gt 0 ]; then
+        hdfs dfs -mv "${COMPACTED}/*" "${RESULTS_PATH}"
+    fi
+    
+    # Paths are deleted in batches, not to exceed the maximum command length
+    hdfs dfs -cat "${REPLACED}" | xargs -r hdfs dfs -rm -f -skipTrash
+    hdfs dfs -rm -r -skipTrash "${STAGING}"
+}
+
+if hdfs dfs -test -e "${REPLACED}"; then
+    echo "Completing an interrupted compaction"
+    replace
+    exit 0
+fi
+
+# Size and path of every non-empty file, ordered by name as HDFS does
+mapfile -t FILES < <(
+    hdfs dfs -ls "${RESULTS_PATH}" | awk '$1 ~ /^-/ && $5 > 0 { print $5, $8 }' | LC_ALL=C sort -k 2
+)
+
+if [ "${#FILES[@]}" -le "${MAX_FILES}" ]; then
+    echo "${#FILES[@]} part files, not compacting"
+    exit 0
+fi
+
+TOTAL_SIZE=0
+for entry in "${FILES[@]}"; do
+    TOTAL_SIZE=$((TOTAL_SIZE + ${entry%% *}))
+done
+
+if [ $((2 * TOTAL_SIZE / ${#FILES[@]})) -ge "${TARGET_SIZE}" ]; then
+    echo "${#FILES[@]} part files of ${TOTAL_SIZE} bytes, not compacting"
+    exit 0
+fi
+
+hdfs dfs -rm -r -f -skipTrash "${STAGING}"
+hdfs dfs -mkdir -p "${COMPACTED}"
+
+BATCH=()
+BATCH_SIZE=0
+PARTS=0
+PATHS=()
+
+flush() {
+    # Files alone in their batch are kept as they are
+    if [ "${#BATCH[@]}" -gt 1 ]; then
+        printf '%s\n' "${BATCH[@]}" | xargs hdfs dfs -cat | hdfs dfs -put - "${COMPACTED}/$(basename "${BATCH[0]}")${SUFFIX}"
+        PARTS=$((PARTS + 1))
+        PATHS+=("${BATCH[@]}")
+    fi
+    
+    BATCH=()
+    BATCH_SIZE=0
+}
+
+for entry in "${FILES[@]}"; do
+    size="${entry%% *}"
+    path="${entry#* }"
+    
+    if [ "${BATCH_SIZE}" -gt 0 ] && [ $((BATCH_SIZE + size)) -gt "${TARGET_SIZE}" ]; then
+        flush
+    fi
+    
+    BATCH+=("${path}")
+    BATCH_SIZE=$((BATCH_SIZE + size))
+done
+flush
+
+if [ "${PARTS}" -eq 0 ]; then
+    echo "No consecutive small part files, not compacting"
+    hdfs dfs -rm -r -skipTrash "${STAGING}"
+    exit 0
+fi
+
+echo "Compacted ${#PATHS[@]} of ${#FILES[@]} part files into ${PARTS}"
+
+# Record the files to delete, then replace them with the compacted ones
+printf '%s\n' "${PATHS[@]}" | hdfs dfs -put - "${REPLACED}"
+replace